@@ -0,0 +1,215 @@
+# 檔案名稱: benchmarks/db_bench.py
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+# 加入專案根目錄，讓直接執行此檔案時也能 import server 與 benchmarks 的模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_gen import git_commit, percentile
+from benchmarks.synthetic import ZipfPicker, random_time, write_synthetic_db
+from server.db_engine import SteadyHandDB, SHARD_MODES
+from server.db_writer import SYNC_MODES
+
+# --- SteadyHandDB 微基準測試 ---
+# 對每個資料量 (預設 10k / 100k / 1M 筆，--sizes 可以到 10M)：
+#   1. 產生合成的 .db 檔 (關卡與玩家都是 Zipf 分布，見 synthetic.py)
+#   2. 冷啟動：開啟 SteadyHandDB (掃描檔案、重建索引) 的時間
+#   3. add_score 吞吐量：單執行緒與多執行緒 (等所有 WriteTicket 完成才停錶)
+#   4. get_leaderboard 延遲：每個關卡各查 --queries 次 (每個 limit 一組)
+#   5. 峰值 RSS
+# 每個資料量在獨立的子行程中執行，峰值 RSS 不會被前一個資料量影響。
+# 結果印成表格，--json 另外輸出機器可讀的結果 (含 git commit)，方便比較不同版本。
+#
+# 用法:
+#   python benchmarks/db_bench.py
+#   python benchmarks/db_bench.py --sizes 10k,100k,1M,10M --threads 8 --json db_bench.json
+#   python benchmarks/db_bench.py --shard-mode hash --sync interval
+
+UNITS = {"k": 1000, "m": 1000000}
+
+
+def parse_size(text) -> int:
+    """"10k" -> 10000, "1M" -> 1000000"""
+    text = text.strip().lower()
+    if text and text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def peak_rss_mb() -> float:
+    # Linux 的 ru_maxrss 單位是 KB，macOS 是 bytes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _open_db(db_file, options):
+    return SteadyHandDB(db_file, sync_mode=options["sync"], shard_mode=options["shard_mode"],
+                        shard_buckets=options["shard_buckets"], compact_interval=1e9) # 測試期間不壓縮
+
+
+def bench_inserts(db, count, threads, levels, seed):
+    """threads 個執行緒共寫入 count 筆，回傳每秒筆數 (包含等待寫入完成)"""
+    per_thread = count // threads
+    barrier = threading.Barrier(threads + 1)
+    tickets = [[] for _ in range(threads)]
+
+    def run(i):
+        rng = random.Random(seed + i)
+        out = tickets[i]
+        barrier.wait()
+        for _ in range(per_thread):
+            out.append(db.add_score(f"writer{i}_{rng.randrange(1000)}", levels.pick(rng), random_time(rng),
+                                    rng.randint(1, 3)))
+
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for w in workers:
+        w.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for w in workers:
+        w.join()
+    ok = all(t.wait() for group in tickets for t in group)
+    elapsed = time.perf_counter() - started
+    if not ok:
+        raise RuntimeError("Some writes failed")
+    return round(per_thread * threads / elapsed, 1)
+
+
+def bench_leaderboards(db, level_count, limit, queries):
+    """每個關卡查詢 queries 次，回傳 {level: {p50_us, p99_us}} 與全部合起來的分位數"""
+    per_level = {}
+    everything = []
+    for level in range(1, level_count + 1):
+        samples = []
+        for _ in range(queries):
+            started = time.perf_counter()
+            db.get_leaderboard(level, limit)
+            samples.append(time.perf_counter() - started)
+        samples.sort()
+        everything.extend(samples)
+        per_level[level] = {"p50_us": round(percentile(samples, 0.50) * 1e6, 2),
+                            "p99_us": round(percentile(samples, 0.99) * 1e6, 2)}
+    everything.sort()
+    return {
+        "p50_us": round(percentile(everything, 0.50) * 1e6, 2),
+        "p99_us": round(percentile(everything, 0.99) * 1e6, 2),
+        "max_us": round(everything[-1] * 1e6, 2),
+        "per_level": per_level,
+    }
+
+
+def bench_size(size, options):
+    """(子行程) 對一個資料量跑完所有項目，回傳結果 dict"""
+    root = tempfile.mkdtemp(prefix="shdb-bench-", dir=options["workdir"])
+    db_file = os.path.join(root, "steadyhand.db")
+    result = {"records": size}
+    try:
+        result["generate_s"] = round(write_synthetic_db(
+            db_file, size, options["levels"], options["users"], options["skew"],
+            options["shard_mode"], options["shard_buckets"]), 3)
+        result["file_mb"] = round(sum(os.path.getsize(os.path.join(d, f))
+                                      for d, _, files in os.walk(root) for f in files) / (1024 * 1024), 1)
+
+        started = time.perf_counter()
+        db = _open_db(db_file, options)
+        result["cold_open_s"] = round(time.perf_counter() - started, 3)
+        result["rss_after_open_mb"] = peak_rss_mb()
+
+        levels = ZipfPicker(options["levels"], options["skew"])
+        try:
+            result["insert_1_thread_per_s"] = bench_inserts(db, options["inserts"], 1, levels, 1)
+            if options["threads"] > 1:
+                result[f"insert_{options['threads']}_threads_per_s"] = bench_inserts(
+                    db, options["inserts"], options["threads"], levels, 100)
+            result["leaderboard"] = {str(limit): bench_leaderboards(db, options["levels"], limit, options["queries"])
+                                     for limit in options["limits"]}
+        finally:
+            db.close()
+        result["peak_rss_mb"] = peak_rss_mb()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return result
+
+
+def _size_process(size, options, out):
+    try:
+        out.put(bench_size(size, options))
+    except Exception as e:
+        out.put({"records": size, "error": repr(e)})
+
+
+def print_result(r):
+    if "error" in r:
+        print(f"{r['records']:>10}  error: {r['error']}")
+        return
+    inserts = "  ".join(f"{k[len('insert_'):-len('_per_s')]}={v:,.0f}/s"
+                        for k, v in r.items() if k.startswith("insert_"))
+    boards = "  ".join(f"limit {limit}: p50 {b['p50_us']}us p99 {b['p99_us']}us"
+                       for limit, b in r["leaderboard"].items())
+    print(f"{r['records']:>10,} records  {r['file_mb']:>7} MB  generate {r['generate_s']:.2f}s  "
+          f"cold open {r['cold_open_s']:.2f}s  peak RSS {r['peak_rss_mb']} MB")
+    print(f"{'':>12}add_score {inserts}")
+    print(f"{'':>12}get_leaderboard {boards}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SteadyHandDB microbenchmarks on synthetic data")
+    parser.add_argument("--sizes", default="10k,100k,1M", help="comma separated record counts, e.g. 10k,1M,10M")
+    parser.add_argument("--levels", type=int, default=200)
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent for levels and users")
+    parser.add_argument("--inserts", type=int, default=20000, help="add_score calls per insert test")
+    parser.add_argument("--threads", type=int, default=4, help="threads for the multi-threaded insert test")
+    parser.add_argument("--queries", type=int, default=200, help="get_leaderboard calls per level")
+    parser.add_argument("--limits", default="5,100", help="leaderboard depths to query")
+    parser.add_argument("--sync", default="never", choices=SYNC_MODES)
+    parser.add_argument("--shard-mode", default="none", choices=["none"] + [m for m in SHARD_MODES if m])
+    parser.add_argument("--shard-buckets", type=int, default=16)
+    parser.add_argument("--workdir", help="where synthetic files are written (default: system temp dir)")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    options = {
+        "levels": args.levels, "users": args.users, "skew": args.skew, "inserts": args.inserts,
+        "threads": args.threads, "queries": args.queries,
+        "limits": [int(x) for x in args.limits.split(",")], "sync": args.sync,
+        "shard_mode": None if args.shard_mode == "none" else args.shard_mode,
+        "shard_buckets": args.shard_buckets, "workdir": args.workdir,
+    }
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for size in (parse_size(s) for s in args.sizes.split(",")):
+        out = ctx.Queue()
+        proc = ctx.Process(target=_size_process, args=(size, options, out))
+        proc.start()
+        while True:
+            try:
+                result = out.get(timeout=1.0)
+                break
+            except queue.Empty:
+                if not proc.is_alive(): # 例如記憶體不足被系統砍掉
+                    result = {"records": size, "error": f"benchmark process exited with code {proc.exitcode}"}
+                    break
+        proc.join()
+        print_result(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"commit": git_commit(), "time": time.time(), "config": vars(args), "results": results},
+                      f, indent=2)
+        print(f"[Bench] Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
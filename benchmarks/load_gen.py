@@ -0,0 +1,372 @@
+# 檔案名稱: benchmarks/load_gen.py
+import argparse
+import array
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+# 加入專案根目錄，讓直接執行此檔案時也能 import server 與 benchmarks 的模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import ZipfPicker, random_time, write_synthetic_db
+from server.metrics import fetch_stats
+from shp.protocol import (SteadyHandProtocol, BinaryCodec, CMD_UPLOAD_SCORE, CMD_GET_LEADERBOARD,
+                          CMD_GET_RANK, CMD_GET_AROUND, CMD_GET_LEVEL_STATS, CMD_ERROR, FLAG_BINARY,
+                          FLAG_NOT_MODIFIED)
+
+# --- SHP 閉迴路壓力測試 ---
+# 模擬 players 個虛擬玩家：每個玩家送出一個請求、等到回覆 (再等 think 時間) 才送下一個，
+# 所以送出速度由 Server 的回應速度決定 (closed loop)，量到的是 Server 能「持續」處理的吞吐量與延遲。
+# 玩家共用 connections 條連線 (與遊戲 Client 一樣以 REQ_ID pipelining)，關卡依 Zipf 分布挑選。
+#
+# 預設會在暫存目錄預先寫入 --seed 筆紀錄、啟動一個 Server (server/main.py)，跑完後關閉並刪除；
+# --server-env 可以加上任何 .env 設定 (例如 SERVER_WORKERS=4、DB_SHARD_MODE=hash) 比較不同模式。
+# 給了 --port 時改為測試已經在跑的 Server (不預先寫入資料)。
+#
+# 用法:
+#   python benchmarks/load_gen.py --seed 1000000 --players 2000 --duration 30
+#   python benchmarks/load_gen.py --mix upload=0.05,leaderboard=0.8,rank=0.15 --server-env DB_WORKERS=16
+#   python benchmarks/load_gen.py --port 9999 --json before.json
+
+BASE_PORT = 9960
+OPS = {
+    # 名稱: (指令, 建立 payload 的函式)
+    "upload": (CMD_UPLOAD_SCORE, lambda user, level, rng: {"user": user, "level": level,
+                                                           "time": random_time(rng), "stars": rng.randint(1, 3)}),
+    "leaderboard": (CMD_GET_LEADERBOARD, lambda user, level, rng: {"level": level}),
+    "rank": (CMD_GET_RANK, lambda user, level, rng: {"level": level, "user": user}),
+    "around": (CMD_GET_AROUND, lambda user, level, rng: {"level": level, "user": user, "k": 5}),
+    "stats": (CMD_GET_LEVEL_STATS, lambda user, level, rng: {"level": level, "user": user}),
+}
+
+
+def parse_mix(text):
+    """"upload=0.2,leaderboard=0.8" -> [(名稱, 累積比例), ...]"""
+    weights = []
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in OPS:
+            raise argparse.ArgumentTypeError(f"Unknown op '{name}' (choose from {', '.join(OPS)})")
+        weights.append((name, float(weight or 1)))
+    total = sum(w for _, w in weights)
+    mix, acc = [], 0.0
+    for name, w in weights:
+        acc += w / total
+        mix.append((name, acc))
+    return mix
+
+
+class BenchConnection:
+    """一條 SHP 連線：多個玩家同時送出請求，依 REQ_ID 對應回覆"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.pending = {}   # req_id -> Future
+        self.next_id = 1
+        self.reader_task = asyncio.ensure_future(self._read_loop())
+
+    @classmethod
+    async def open(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return cls(reader, writer)
+
+    async def request(self, cmd, body, flags, timeout):
+        req_id = self.next_id
+        self.next_id = self.next_id % 0xFFFFFFFF + 1 # REQ_ID 0 保留給推播
+        future = self.pending[req_id] = asyncio.get_running_loop().create_future()
+        self.writer.write(SteadyHandProtocol.pack_header(cmd, len(body), req_id, flags) + body)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(req_id, None)
+
+    async def _read_loop(self):
+        header_size = SteadyHandProtocol.HEADER_SIZE
+        try:
+            while True:
+                cmd, flags, req_id, length = SteadyHandProtocol.unpack_header(
+                    await self.reader.readexactly(header_size))
+                body = await self.reader.readexactly(length) if length else b""
+                future = self.pending.get(req_id)
+                if future is not None and not future.done():
+                    future.set_result((cmd, flags, body))
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"Connection closed: {e}"))
+
+    async def close(self):
+        self.reader_task.cancel()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+
+def _response_error(op_cmd, cmd, flags, body):
+    """回覆是錯誤時回傳錯誤訊息，成功回傳 None"""
+    if flags & FLAG_NOT_MODIFIED:
+        return None
+    if flags & FLAG_BINARY and cmd != CMD_ERROR:
+        response = BinaryCodec.decode_response(op_cmd, memoryview(body))
+    else:
+        response = SteadyHandProtocol.decode_payload(body)
+    if cmd == CMD_ERROR or response.get("status") != "ok":
+        return response.get("msg", "error")
+    return None
+
+
+async def _player(idx, conn, config, rng, deadline, measure_from, results):
+    loop = asyncio.get_running_loop()
+    user = f"bench{idx}"
+    levels = config["level_picker"]
+    mix = config["mix"]
+    while loop.time() < deadline:
+        r = rng.random()
+        op = next((name for name, acc in mix if r <= acc), mix[-1][0])
+        cmd, build = OPS[op]
+        payload = build(user, levels.pick(rng), rng)
+        if config["binary"] and cmd in BinaryCodec.COMMANDS:
+            body, flags = BinaryCodec.encode_request(cmd, payload), FLAG_BINARY
+        else:
+            body, flags = SteadyHandProtocol.encode_payload(payload), 0
+
+        started = loop.time()
+        broken = False
+        try:
+            reply_cmd, reply_flags, reply = await conn.request(cmd, body, flags, config["timeout"])
+            error = _response_error(cmd, reply_cmd, reply_flags, reply)
+        except asyncio.TimeoutError:
+            error = "timeout"
+        except OSError as e: # 包含 ConnectionError
+            error, broken = type(e).__name__, True
+        finished = loop.time()
+
+        if started >= measure_from:
+            latencies, errors = results[op]
+            if error is None:
+                latencies.append(finished - started)
+            else:
+                errors[error] += 1
+        if broken:
+            return # 連線斷了，這個玩家退出
+        if config["think"]:
+            await asyncio.sleep(config["think"] * rng.random() * 2)
+
+
+async def run_load(config, first_player, players, connections, seed):
+    """(一個行程) 跑 players 個玩家，回傳 {op: (latencies bytes, {錯誤: 次數})}"""
+    rng = random.Random(seed)
+    conns = [await BenchConnection.open(config["host"], config["port"]) for _ in range(connections)]
+    loop = asyncio.get_running_loop()
+    measure_from = loop.time() + config["warmup"]
+    deadline = measure_from + config["duration"]
+    results = {op: (array.array("d"), Counter()) for op in OPS}
+    await asyncio.gather(*(
+        _player(first_player + i, conns[i % connections], config, random.Random(rng.random()),
+                deadline, measure_from, results)
+        for i in range(players)
+    ))
+    for conn in conns:
+        await conn.close()
+    return {op: (latencies.tobytes(), dict(errors)) for op, (latencies, errors) in results.items()}
+
+
+def _load_process(config, first_player, players, connections, seed, out):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    out.put(asyncio.run(run_load(config, first_player, players, connections, seed)))
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def summarize(parts, duration):
+    """合併各行程的結果，計算每種操作與全部的吞吐量與延遲分位數 (毫秒)"""
+    merged = {}
+    for part in parts:
+        for op, (raw, errors) in part.items():
+            latencies, error_counts = merged.setdefault(op, (array.array("d"), Counter()))
+            latencies.frombytes(raw)
+            error_counts.update(errors)
+
+    def stats(latencies, errors):
+        values = sorted(latencies)
+        return {
+            "requests": len(values) + sum(errors.values()),
+            "ok": len(values),
+            "errors": dict(errors),
+            "throughput": round(len(values) / duration, 1),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+        }
+
+    report = {op: stats(latencies, errors) for op, (latencies, errors) in merged.items()
+              if latencies or errors}
+    all_latencies = array.array("d")
+    all_errors = Counter()
+    for latencies, errors in merged.values():
+        all_latencies.extend(latencies)
+        all_errors.update(errors)
+    report["total"] = stats(all_latencies, all_errors)
+    return report
+
+
+def start_server(root, port, extra_env, startup_timeout=300):
+    """在 root 寫入 .env 並啟動 server/main.py，等到可以連線才回傳 Popen"""
+    with open(os.path.join(root, ".env"), "w") as f:
+        f.write(f"SERVER_PORT={port}\n")
+        for item in extra_env:
+            f.write(item + "\n")
+    main_py = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server", "main.py")
+    log_file = open(os.path.join(root, "server.log"), "w")
+    proc = subprocess.Popen([sys.executable, main_py], cwd=root, stdout=log_file, stderr=subprocess.STDOUT,
+                            start_new_session=True)
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Server exited during startup, see {log_file.name}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("Server did not start in time")
+
+
+def stop_server(proc):
+    proc.send_signal(signal.SIGINT)
+    try:
+        proc.wait(30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_report(report):
+    print(f"{'op':<12} {'ok':>9} {'errors':>7} {'req/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for op, s in report.items():
+        print(f"{op:<12} {s['ok']:>9} {sum(s['errors'].values()):>7} {s['throughput']:>10.1f} "
+              f"{s['p50_ms']:>9.3f} {s['p95_ms']:>9.3f} {s['p99_ms']:>9.3f} {s['max_ms']:>9.3f}")
+    errors = report["total"]["errors"]
+    if errors:
+        print(f"errors: {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Closed-loop SHP load generator for SteadyHand servers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="benchmark an already running server instead of starting one")
+    parser.add_argument("--players", type=int, default=1000, help="concurrent virtual players")
+    parser.add_argument("--connections", type=int, default=64, help="TCP connections shared by the players")
+    parser.add_argument("--procs", type=int, default=1, help="load generator processes")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds before measuring starts")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("upload=0.2,leaderboard=0.8"),
+                        help=f"op weights, ops: {', '.join(OPS)}")
+    parser.add_argument("--levels", type=int, default=50)
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent for level popularity (0 = uniform)")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="mean pause between a player's requests")
+    parser.add_argument("--timeout", type=float, default=10.0, help="per-request timeout in seconds")
+    parser.add_argument("--json-payload", dest="binary", action="store_false",
+                        help="send JSON instead of binary payloads for uploads/leaderboards")
+    parser.add_argument("--seed", type=int, default=100000, help="records pre-seeded into the spawned server's DB")
+    parser.add_argument("--users", type=int, default=10000, help="distinct players in the seeded DB")
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra .env setting for the spawned server (repeatable)")
+    parser.add_argument("--keep", action="store_true", help="keep the spawned server's directory")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    proc = root = None
+    port = args.port
+    if port is None:
+        root = tempfile.mkdtemp(prefix="shp-bench-")
+        env = dict(item.split("=", 1) for item in args.server_env)
+        shard_mode = env.get("DB_SHARD_MODE", "none").lower()
+        if args.seed:
+            elapsed = write_synthetic_db(os.path.join(root, "steadyhand.db"), args.seed, args.levels, args.users,
+                                         args.skew, None if shard_mode == "none" else shard_mode,
+                                         int(env.get("DB_SHARD_BUCKETS", 16)))
+            print(f"[Bench] Seeded {args.seed} records in {elapsed:.1f}s")
+        port = BASE_PORT
+        started = time.perf_counter()
+        proc = start_server(root, port, args.server_env)
+        print(f"[Bench] Server ready in {time.perf_counter() - started:.1f}s ({root})")
+
+    config = {
+        "host": args.host, "port": port, "mix": args.mix, "binary": args.binary,
+        "level_picker": ZipfPicker(args.levels, args.skew), "think": args.think_ms / 1000.0,
+        "timeout": args.timeout, "warmup": args.warmup, "duration": args.duration,
+    }
+    print(f"[Bench] {args.players} players on {args.connections} connections x {args.procs} process(es), "
+          f"{args.warmup:g}s warmup + {args.duration:g}s")
+    try:
+        if args.procs == 1:
+            parts = [asyncio.run(run_load(config, 0, args.players, args.connections, 1))]
+        else:
+            ctx = multiprocessing.get_context("spawn")
+            out = ctx.Queue()
+            per_proc = args.players // args.procs
+            procs = [ctx.Process(target=_load_process,
+                                 args=(config, i * per_proc, per_proc, max(1, args.connections // args.procs),
+                                       i + 1, out))
+                     for i in range(args.procs)]
+            for p in procs:
+                p.start()
+            parts = [out.get() for _ in procs]
+            for p in procs:
+                p.join()
+
+        report = summarize(parts, args.duration)
+        server_stats = None
+        try:
+            server_stats = fetch_stats(args.host, port)
+        except (OSError, RuntimeError, ValueError):
+            pass # 舊版 Server 沒有 CMD_STATS
+    finally:
+        if proc is not None:
+            stop_server(proc)
+            if not args.keep:
+                shutil.rmtree(root, ignore_errors=True)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "commit": git_commit(), "time": time.time(),
+                "config": {k: v for k, v in vars(args).items() if k != "json"},
+                "results": report, "server_stats": server_stats,
+            }, f, indent=2)
+        print(f"[Bench] Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# 檔案名稱: benchmarks/synthetic.py
+import bisect
+import itertools
+import os
+import random
+import struct
+import sys
+import time
+
+# 加入專案根目錄，讓直接執行 benchmarks 底下的檔案時也能 import server 的模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server.db_engine import shard_dir, shard_file, shard_key, SHARD_NONE
+from server.db_scan import RECORD_FORMAT
+
+# --- 壓測用的合成資料 ---
+# 關卡熱門程度用 Zipf 分布 (第 k 熱門的關卡被玩的機率正比於 1 / k^skew)，玩家也一樣：
+# 少數關卡與重度玩家佔了大部分的紀錄，比平均分布更接近真實的排行榜負載。
+
+
+class ZipfPicker:
+    """從 1..n 中依 Zipf(skew) 抽一個值 (skew=0 時為平均分布)，抽樣 O(log n)"""
+
+    def __init__(self, n, skew=1.0):
+        self.n = n
+        self.cumulative = list(itertools.accumulate(1.0 / (k ** skew) for k in range(1, n + 1)))
+        self.total = self.cumulative[-1]
+
+    def pick(self, rng) -> int:
+        return bisect.bisect_left(self.cumulative, rng.random() * self.total) + 1
+
+
+def random_time(rng) -> float:
+    """一局的秒數：大多落在 20~60 秒，少數很快或很慢 (對數常態分布)"""
+    return round(min(999.0, rng.lognormvariate(3.5, 0.4)), 2)
+
+
+def write_synthetic_db(db_file, records, levels=50, users=10000, skew=1.0,
+                       shard_mode=SHARD_NONE, shard_buckets=16, days=7, seed=1, chunk=100000):
+    """
+    產生 records 筆紀錄，直接寫成 SteadyHandDB 的檔案 (依 shard_mode 分到各分片檔)，回傳花費的秒數
+    時間戳平均分散在最近 days 天 (依時間排序寫入，與實際追加的順序相同)；既有的檔案會被覆蓋。
+    """
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    level_picker = ZipfPicker(levels, skew)
+    user_picker = ZipfPicker(users, skew)
+    names = [f"player{i}".encode("utf-8")[:16].ljust(16, b"\x00") for i in range(users + 1)]
+    pack = struct.Struct(RECORD_FORMAT).pack
+
+    if shard_mode != SHARD_NONE:
+        os.makedirs(shard_dir(db_file, shard_mode, shard_buckets), exist_ok=True)
+    files = {}
+    try:
+        now = time.time()
+        start = now - days * 86400
+        step = (now - start) / max(1, records)
+        written = 0
+        while written < records:
+            batch = min(chunk, records - written)
+            by_file = {}
+            for i in range(written, written + batch):
+                level = level_picker.pick(rng)
+                data = pack(names[user_picker.pick(rng)], level, random_time(rng), rng.randint(1, 3), start + i * step)
+                key = shard_key(level, shard_mode, shard_buckets)
+                by_file.setdefault(key, []).append(data)
+            for key, rows in by_file.items():
+                f = files.get(key)
+                if f is None:
+                    f = files[key] = open(shard_file(db_file, shard_mode, shard_buckets, key), "wb")
+                f.write(b"".join(rows))
+            written += batch
+    finally:
+        for f in files.values():
+            f.close()
+    return time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    # 用法: python benchmarks/synthetic.py 輸出檔 [筆數=100000] [關卡數=50] [玩家數=10000]
+    out = sys.argv[1]
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    elapsed = write_synthetic_db(out, count,
+                                 int(sys.argv[3]) if len(sys.argv) > 3 else 50,
+                                 int(sys.argv[4]) if len(sys.argv) > 4 else 10000)
+    print(f"[Bench] Wrote {count} records to {out} in {elapsed:.2f}s")
@@ -0,0 +1,48 @@
+# 檔案名稱: server/cluster.py
+import os
+import signal
+import subprocess
+import sys
+
+# --- 叢集模式 (依關卡分區) ---
+# 每個節點是一個獨立的 Server (各自的資料庫)，只負責分區表指派給它的關卡，寫入也就分散到各節點。
+# Client 向任何一個節點要分區表 (CMD_GET_PARTITION_MAP)，之後直接把請求送到負責該關卡的節點；
+# 送錯節點時 Server 回覆以 WRONG_NODE 開頭的錯誤，Client 重新取得分區表後再送一次。
+# 分區表 PartitionMap 放在 shp/partition.py (Client 也 import 同一份)；這裡只負責在本機啟動整個叢集。
+
+
+def launch_local_cluster(count=3, base_port=9931, root="cluster_data"):
+    """
+    在本機啟動 count 個節點 (每個節點一個目錄、一份 .env 與自己的資料庫)，Ctrl+C 一起關閉
+    Client 的 .env 指向任何一個節點 (例如 SERVER_PORT=9931) 即可。
+    """
+    nodes = ",".join(f"127.0.0.1:{base_port + i}" for i in range(count))
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    procs = []
+    for i in range(count):
+        node_dir = os.path.join(root, f"node{i}")
+        os.makedirs(node_dir, exist_ok=True)
+        with open(os.path.join(node_dir, ".env"), "w") as f:
+            f.write(f"SERVER_PORT={base_port + i}\nCLUSTER_NODES={nodes}\nCLUSTER_NODE_ID={i}\n")
+        # 節點放在自己的 session，Ctrl+C 只送到這裡，再由這裡逐一通知節點關閉
+        procs.append(subprocess.Popen([sys.executable, main_py], cwd=node_dir, start_new_session=True))
+    print(f"[Cluster] Started {count} nodes: {nodes}")
+
+    try:
+        for proc in procs:
+            proc.wait()
+    except KeyboardInterrupt:
+        print("[Cluster] Shutting down...")
+    finally:
+        for proc in procs:
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGINT)
+        for proc in procs:
+            proc.wait()
+
+
+# --- 本機叢集 ---
+# 用法: python server/cluster.py [節點數=3] [起始 port=9931]
+if __name__ == "__main__":
+    launch_local_cluster(int(sys.argv[1]) if len(sys.argv) > 1 else 3,
+                         int(sys.argv[2]) if len(sys.argv) > 2 else 9931)
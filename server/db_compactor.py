@@ -0,0 +1,195 @@
+# 檔案名稱: server/db_compactor.py
+import json
+import math
+import os
+import struct
+import sys
+import threading
+import time
+
+# 加入專案根目錄，讓直接執行此檔案時也能 import server 底下的模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server.db_index import LevelStats, TIME_WINDOWS, bucket_of, next_version
+from server.db_scan import RECORD_FORMAT, iter_raw_file
+from server.db_segments import list_sealed, segment_lock
+from server.log import get_logger
+
+log = get_logger("db")
+
+
+# --- 統計檔 (<db_file>.stats) ---
+# 壓縮會丟掉被超越的舊嘗試，但關卡統計 (LevelStats: 嘗試次數、平均、直方圖) 要算進所有嘗試。
+# 壓縮器把丟掉的紀錄累加成每關一份 LevelStats 存在統計檔，與分段在同一把 segment_lock 內一起換上；
+# 重建索引時先載入統計檔，再套用檔案中的紀錄，結果與沒有壓縮過相同。
+# 統計檔也保存每關壓縮當下的版本號 (丟掉的可能正是設定版本號的最新一筆)，重建後每關取較大者，版本號不會倒退。
+
+def stats_path(db_file):
+    return db_file + ".stats"
+
+
+def encode_carried(stats, versions) -> dict:
+    """統計檔的內容 (也是複寫快照結束時附帶的內容)"""
+    return {"levels": {str(level): s.to_dict() for level, s in stats.items()},
+            "versions": {str(level): v for level, v in versions.items()}}
+
+
+def decode_carried(data):
+    """encode_carried() 的反向，回傳 ({ level_id: LevelStats }, { level_id: 版本號 })；格式不符時丟出 ValueError"""
+    try:
+        stats = {int(level): LevelStats.from_dict(d) for level, d in data["levels"].items()}
+        versions = {int(level): int(v) for level, v in data.get("versions", {}).items()}
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Bad carried stats: {e}")
+    return stats, versions
+
+
+def load_carried_stats(db_file):
+    """
+    讀取統計檔，回傳 ({ level_id: LevelStats }, { level_id: 版本號 })；檔案不存在 (從沒壓縮過) 時回傳兩個空 dict
+    呼叫端要與讀取分段 (map_segments) 在同一個 segment_lock 內，兩者才會是同一組。
+    """
+    try:
+        with open(stats_path(db_file), "r", encoding="utf-8") as f:
+            return decode_carried(json.load(f))
+    except FileNotFoundError:
+        return {}, {}
+    except (OSError, ValueError) as e:
+        log.error(f"[DB] Error: cannot read {stats_path(db_file)}, compacted attempts are not counted: {e}")
+        return {}, {}
+
+
+def write_stats_file(path, stats, versions):
+    """把 { level_id: LevelStats } 與 { level_id: 版本號 } 寫到 path 並 fsync"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(encode_carried(stats, versions), f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def compact_records(rows, history_cutoff):
+    """
+    決定哪些紀錄要保留 (輸入/輸出都是原始 tuple，依寫入順序)，回傳 (保留的紀錄, 丟掉的紀錄)
+    1. 每位玩家在每個關卡的最佳成績 (同秒數留最早的一筆)
+    2. 每位玩家在每個關卡、每個時間視窗「這一期」的最佳成績 (重建日/週/季榜用)
+    3. timestamp >= history_cutoff 的所有紀錄 (歷史保留期間)
+    輸出維持原本的寫入順序，重建索引時的同分排序結果不變。
+    """
+    now = time.time()
+    current = {w: bucket_of(w, now) for w in TIME_WINDOWS}
+
+    best = {} # (name_bytes, level_id[, window]) -> 列號
+    for i, (name_b, lvl, t, _, ts) in enumerate(rows):
+        keys = [(name_b, lvl)]
+        for window, bucket in current.items():
+            if bucket_of(window, ts) == bucket:
+                keys.append((name_b, lvl, window))
+        for key in keys:
+            j = best.get(key)
+            if j is None or t < rows[j][2]:
+                best[key] = i
+
+    keep = set(best.values())
+    keep.update(i for i, row in enumerate(rows) if row[4] >= history_cutoff)
+    return [rows[i] for i in sorted(keep)], [row for i, row in enumerate(rows) if i not in keep]
+
+
+class Compactor:
+    """
+    背景壓縮器
+    定期把每個檔案的所有 sealed segment 合併重寫成一個檔案，只留下 compact_records 決定保留的紀錄。
+    db_files 是一個 callable，每次壓縮時呼叫，回傳目前要壓縮的所有檔案 (SteadyHandDB 的所有分片共用一個壓縮器)。
+    - 讀取 sealed segment 不需要任何鎖 (sealed 之後檔案內容不會再變)
+    - 只有最後「換檔」那一步持有 segment_lock，讀取端 (iter_raw) 看到的永遠是完整的一組檔案
+    - 排行榜查詢走記憶體索引，完全不受壓縮影響
+    """
+
+    def __init__(self, db_files, interval=60.0, min_segments=2, history_days=7):
+        self.db_files = db_files
+        self.interval = interval
+        self.min_segments = min_segments
+        self.history_seconds = history_days * 86400
+
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="db-compactor", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.compact_once()
+
+    def compact_once(self):
+        """每個檔案各壓縮一次 (單一檔案失敗不影響其他檔案)，回傳有壓縮的檔案數"""
+        compacted = 0
+        for db_file in self.db_files():
+            if self._stop.is_set():
+                break
+            try:
+                if self.compact_file(db_file) is not None:
+                    compacted += 1
+            except OSError as e:
+                log.error(f"[DB] Error: compaction of {db_file} failed: {e}")
+        return compacted
+
+    def compact_file(self, db_file):
+        """
+        壓縮一個檔案。回傳 (輸入筆數, 輸出筆數)；sealed segment 不足 min_segments 時回傳 None。
+        """
+        sealed = list_sealed(db_file)
+        if len(sealed) < self.min_segments:
+            return None
+
+        rows = []
+        for _, path in sealed:
+            rows.extend(iter_raw_file(path))
+        kept, dropped = compact_records(rows, time.time() - self.history_seconds)
+
+        # 1. 寫到暫存檔並 fsync
+        target = sealed[-1][1]
+        tmp_path = db_file + ".compact.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(struct.pack(RECORD_FORMAT, *row) for row in kept))
+            f.flush()
+            os.fsync(f.fileno())
+
+        # 丟掉的嘗試加進統計檔 (同樣先寫暫存檔)，重建後的關卡統計才不會變少；
+        # 每關的版本號也記下來 (輸入的所有紀錄算出的版本號，與執行中的索引相同)，重建後不會倒退
+        stats_tmp = None
+        if dropped:
+            carried, versions = load_carried_stats(db_file)
+            for _, lvl, t, _, _ in dropped:
+                if math.isfinite(t): # 與 LeaderboardIndex.apply 一樣略過舊版留下的 NaN / inf
+                    stats = carried.get(lvl)
+                    if stats is None:
+                        stats = carried[lvl] = LevelStats()
+                    stats.add(t)
+            rebuilt = {}
+            for _, lvl, t, _, ts in rows:
+                if math.isfinite(t):
+                    rebuilt[lvl] = next_version(rebuilt.get(lvl, 0), ts)
+            for lvl, version in rebuilt.items():
+                versions[lvl] = max(version, versions.get(lvl, 0))
+            stats_tmp = stats_path(db_file) + ".tmp"
+            write_stats_file(stats_tmp, carried, versions)
+
+        # 2. 換檔：暫存檔取代編號最大的輸入檔，統計檔一起換上，其他輸入檔刪除
+        # 輸出沿用最大編號，之後新 seal 的分段編號一定更大，讀取順序仍是時間順序
+        # (若在兩次換檔之間當機，這次丟掉的嘗試不會計入統計；若在刪除途中當機，
+        #  只會留下重複的舊紀錄，重建索引時最佳成績不受影響，只有統計會多算一次)
+        with segment_lock(db_file):
+            os.replace(tmp_path, target)
+            if stats_tmp is not None:
+                os.replace(stats_tmp, stats_path(db_file))
+            for _, path in sealed[:-1]:
+                os.remove(path)
+
+        log.info(f"[DB] Compacted {len(sealed)} segments of {os.path.basename(db_file)}: "
+                 f"{len(rows)} -> {len(kept)} records")
+        return len(rows), len(kept)
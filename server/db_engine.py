@@ -1,8 +1,136 @@
 # 檔案名稱: server/db_engine.py
 import struct
 import os
+import re
+import sys
 import threading
 import time
+from contextlib import contextmanager
+
+# 加入專案根目錄，讓直接執行此檔案時也能 import server 底下的模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server.db_index import (LeaderboardIndex, ScoreRecord, SNAPSHOT_DEPTH, WINDOW_ALL, TIME_WINDOWS,
+                             board_version)
+from server.db_scan import iter_records, map_segments
+from server.db_segments import segment_lock
+from server.metrics import DBMetrics
+from server.log import get_logger, access_log
+from server.db_writer import GroupCommitWriter, SYNC_NEVER
+from server.db_compactor import Compactor, load_carried_stats
+
+# --- 分片 (Sharding) ---
+# shard_mode=None:    所有關卡共用一個 db_file (舊版行為)
+# shard_mode="level": 每個 level_id 一個檔案，放在 <db_file>.level/level_000001.db ...
+# shard_mode="hash":  依 level_id % shard_buckets 分成固定數量的檔案，放在 <db_file>.hash16/bucket_00.db ...
+# 目錄名稱包含模式與桶數，換了設定不會把資料寫進錯的檔案。
+SHARD_NONE = None
+SHARD_LEVEL = "level"
+SHARD_HASH = "hash"
+SHARD_MODES = (SHARD_NONE, SHARD_LEVEL, SHARD_HASH)
+
+_LEVEL_FILE_PATTERN = re.compile(r"^level_(\d+)\.db$")
+
+log = get_logger("db")
+
+# 一局的秒數上限 (超過就當作不合法的上傳，也遠小於 float32 能表示的範圍)
+MAX_TIME_SPENT = 86400.0
+_UINT32_MAX = 0xFFFFFFFF
+
+
+def check_score(level_id, time_spent, stars):
+    """
+    檢查一筆成績能不能寫入 (打包之前呼叫)，不合法時丟出 ValueError("Bad payload")
+    level_id / stars 必須是 uint32 範圍內的整數，time_spent 必須是 0 ~ MAX_TIME_SPENT 的有限數字；
+    NaN / inf 一旦寫進檔案，之後每次啟動重建索引都會失敗。
+    """
+    for value in (level_id, stars):
+        if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value <= _UINT32_MAX:
+            raise ValueError("Bad payload")
+    if isinstance(time_spent, bool) or not isinstance(time_spent, (int, float)) \
+            or not 0.0 <= time_spent <= MAX_TIME_SPENT: # NaN 的比較一律是 False
+        raise ValueError("Bad payload")
+
+
+def shard_dir(db_file, shard_mode, shard_buckets=16):
+    if shard_mode == SHARD_LEVEL:
+        return db_file + ".level"
+    return f"{db_file}.hash{shard_buckets}"
+
+
+def shard_key(level_id, shard_mode, shard_buckets=16):
+    """level_id 屬於哪個分片"""
+    if shard_mode == SHARD_NONE:
+        return 0
+    if shard_mode == SHARD_LEVEL:
+        return level_id
+    return level_id % shard_buckets
+
+
+def shard_file(db_file, shard_mode, shard_buckets, key):
+    """分片 key 對應的檔案路徑"""
+    if shard_mode == SHARD_NONE:
+        return db_file
+    if shard_mode == SHARD_LEVEL:
+        name = f"level_{key:06d}.db"
+    else:
+        name = f"bucket_{key:02d}.db"
+    return os.path.join(shard_dir(db_file, shard_mode, shard_buckets), name)
+
+
+def shard_keys(db_file, shard_mode, shard_buckets=16):
+    """目前存在的分片 key (依序)：hash 模式固定是所有桶，level 模式看分片目錄裡有哪些關卡檔"""
+    if shard_mode == SHARD_NONE:
+        return [0]
+    if shard_mode == SHARD_HASH:
+        return list(range(shard_buckets))
+    try:
+        names = os.listdir(shard_dir(db_file, shard_mode))
+    except FileNotFoundError:
+        return []
+    return sorted(int(m.group(1)) for m in map(_LEVEL_FILE_PATTERN.match, names) if m)
+
+
+class _Shard:
+    """
+    一個儲存檔 (含其分段) 與它專屬的寫入鎖、索引。
+    寫入不同分片的請求不會搶同一把鎖，可以平行進行；實際寫檔由 SteadyHandDB 共用的批次寫入器負責。
+    read_only=True 時只建立索引 (給多行程模式的 worker 使用)，也不建立檔案。
+    """
+
+    def __init__(self, db_file, read_only=False):
+        self.db_file = db_file
+        # 寫入鎖：只有寫入端彼此排隊 (防止多人同時寫入時檔案與索引壞掉)
+        # 讀取端讀的是索引發布的不可變快照，不會被寫入卡住，也不會卡住寫入
+        self.write_lock = threading.Lock()
+
+        # 初始化：確保檔案存在
+        if not read_only and not os.path.exists(self.db_file):
+            with open(self.db_file, "wb") as f:
+                pass # 建立空檔案
+
+        # --- [核心] 記憶體索引 ---
+        # 每個關卡保存「每位玩家最佳成績」的排序清單
+        # 啟動時掃描一次檔案建立，之後由 add_score 增量更新，查詢前 N 名只需 O(N)
+        self.index = LeaderboardIndex()
+        start = time.perf_counter()
+        self.count = self._load_index()
+        self.load_seconds = time.perf_counter() - start
+
+    def _load_index(self):
+        """(啟動時) 以 mmap 批次解包全表一次，建立排行榜索引"""
+        count = 0
+        with self.write_lock:
+            # 關卡統計從統計檔 (被壓縮掉的嘗試) 開始累加；統計檔與分段由壓縮器在同一把鎖內一起換掉
+            with segment_lock(self.db_file):
+                self.index.stats, versions = load_carried_stats(self.db_file)
+                views = map_segments(self.db_file)
+            for record in iter_records(self.db_file, views):
+                self.index.apply(record)
+                count += 1
+            self.index.restore_versions(versions)
+        return count
+
 
 class SteadyHandDB:
     """
@@ -11,9 +139,21 @@ class SteadyHandDB:
     不依賴 SQL，直接操作 Bytes。
     """
     
-    def __init__(self, db_file="steadyhand.db"):
+    def __init__(self, db_file="steadyhand.db", sync_mode=SYNC_NEVER, sync_interval_ms=50, sync_batch=256,
+                 segment_max_bytes=64 * 1024 * 1024, compact_interval=60.0, history_days=7,
+                 shard_mode=SHARD_NONE, shard_buckets=16, max_level_shards=256, read_only=False):
+        """
+        read_only=True: 唯讀副本，只從檔案建立索引，之後由 apply_record() 套用別處寫入的紀錄
+        max_level_shards: level 模式下最多幾個關卡 (分片檔)，超過後寫入新關卡會被拒絕
+        """
+        if shard_mode not in SHARD_MODES:
+            raise ValueError(f"Unknown shard mode: {shard_mode}")
+
         self.db_file = db_file
-        self.lock = threading.Lock() # 線程鎖，防止多人同時寫入時檔案壞掉
+        self.shard_mode = shard_mode
+        self.shard_buckets = shard_buckets
+        self.max_level_shards = max_level_shards
+        self.read_only = read_only
         
         # --- [核心] 資料結構定義 (Schema) ---
         # 我們使用 struct 模組的格式字串來定義每一筆紀錄的樣子
@@ -27,19 +167,161 @@ class SteadyHandDB:
         # 總長度 = 16 + 4 + 4 + 4 + 8 = 36 bytes / record
         self.format = "16sIfId" 
         self.record_size = struct.calcsize(self.format)
-        
-        # 初始化：確保檔案存在
-        if not os.path.exists(self.db_file):
-            with open(self.db_file, "wb") as f:
-                pass # 建立空檔案
-        
-        print(f"[DB] Engine initialized. Record size: {self.record_size} bytes")
+
+        # --- [核心] 分片 ---
+        # { shard_key: _Shard }，shards_lock 只在 level 模式新增分片時使用
+        self.shards = {}
+        self.shards_lock = threading.Lock()
+
+        # 寫入通知：add_score 更新索引後會呼叫 callback(record)，例如讓 Server 清除回應快取
+        self.listeners = []
+
+        # 指標：啟動掃描筆數、查詢讀出的筆數、等待寫入鎖的時間 (CMD_STATS 回報)
+        self.metrics = DBMetrics()
+
+        # 複寫紀錄 (見 replication.py 的 ReplicationLog)：在寫入鎖內依序記下每次寫入的原始 bytes，None = 不記錄
+        self.replication_log = None
+
+        self.writer = self.compactor = None
+        if not read_only:
+            # --- [核心] 批次寫入器 ---
+            # 所有分片共用一個：每個檔案只開啟一次，由背景執行緒把累積的紀錄整批寫入，並依 sync_mode 決定何時 fsync
+            # (分片數量不會影響執行緒數；level 模式下關卡再多也只有一個寫入執行緒)
+            self.writer = GroupCommitWriter(None, sync_mode, sync_interval_ms, sync_batch, segment_max_bytes)
+
+            # --- [核心] 分段與背景壓縮 ---
+            # active 檔寫滿 segment_max_bytes 後會換檔，壓縮器定期把每個分片的 sealed segment
+            # 重寫成「每位玩家每關最佳成績 + 最近 history_days 天的紀錄」(同樣所有分片共用一個)
+            self.compactor = Compactor(self._shard_files, compact_interval, history_days=history_days)
+
+        if shard_mode != SHARD_NONE and not read_only: # 唯讀時不建立任何檔案或目錄
+            os.makedirs(shard_dir(db_file, shard_mode, shard_buckets), exist_ok=True)
+        for key in shard_keys(db_file, shard_mode, shard_buckets):
+            self.shards[key] = self._open_shard(key)
+        if self.compactor is not None:
+            self.compactor.start()
+
+        count = sum(shard.count for shard in self.shards.values())
+        shard_desc = shard_mode or "none"
+        mode_desc = "read-only replica" if read_only else f"sync={sync_mode}"
+        log.info(f"[DB] Engine initialized. Record size: {self.record_size} bytes, {count} records indexed, "
+              f"{mode_desc}, shards={len(self.shards)} ({shard_desc})")
+
+    def _open_shard(self, key):
+        path = shard_file(self.db_file, self.shard_mode, self.shard_buckets, key)
+        shard = _Shard(path, self.read_only)
+        self.metrics.record_scan(shard.count, shard.load_seconds)
+        return shard
+
+    @contextmanager
+    def _locked(self, shard):
+        """取得分片的寫入鎖，並記錄等了多久"""
+        start = time.perf_counter()
+        with shard.write_lock:
+            self.metrics.record_lock_wait(time.perf_counter() - start)
+            yield
+
+    def _shard_files(self):
+        """(壓縮器) 目前所有分片的檔案"""
+        with self.shards_lock:
+            return [shard.db_file for shard in self.shards.values()]
+
+    def _shard_for(self, level_id, create=False):
+        """
+        找出 level_id 所屬的分片；level 模式下第一次寫入新關卡時建立分片
+        關卡由 Client 決定，所以分片數有上限 (max_level_shards)，超過時丟出 ValueError；
+        唯讀副本只套用寫入端已經接受的紀錄，不檢查上限。
+        """
+        key = shard_key(level_id, self.shard_mode, self.shard_buckets)
+        shard = self.shards.get(key)
+        if shard is None and create:
+            with self.shards_lock:
+                shard = self.shards.get(key)
+                if shard is None:
+                    if not self.read_only and len(self.shards) >= self.max_level_shards:
+                        raise ValueError(f"Too many levels (max {self.max_level_shards})")
+                    shard = self.shards[key] = self._open_shard(key)
+        return shard
+
+    def _unpack_record(self, chunk) -> ScoreRecord:
+        """解包一筆 36 bytes 的紀錄"""
+        name_b, lvl, t, star, ts = struct.unpack(self.format, chunk)
+        # 清理名字 (把後面的 \x00 拿掉)
+        clean_name = name_b.decode('utf-8', errors='ignore').rstrip('\x00')
+        return ScoreRecord(clean_name, lvl, t, star, ts)
+
+    def add_listener(self, callback):
+        """註冊寫入通知，callback(record: ScoreRecord) 會在寫入者的執行緒中被呼叫 (不持有任何鎖)"""
+        self.listeners.append(callback)
+
+    def apply_record(self, record: ScoreRecord):
+        """(唯讀副本) 套用其他行程已經寫入檔案的紀錄，並通知 listeners"""
+        shard = self._shard_for(record.level, create=True)
+        with self._locked(shard):
+            shard.index.apply(record)
+        for callback in self.listeners:
+            callback(record)
+
+    def replace_indexes(self, indexes):
+        """
+        (唯讀副本) 換上整批重建好的索引 { shard_key: LeaderboardIndex }，沒有出現的分片換成空索引
+        每個分片的索引是一次換掉的，查詢不會看到重建到一半的排行榜。
+        """
+        with self.shards_lock:
+            for key in indexes:
+                if key not in self.shards:
+                    self.shards[key] = self._open_shard(key)
+            shards = list(self.shards.items())
+        for key, shard in shards:
+            index = indexes.get(key)
+            with self._locked(shard):
+                shard.index = index if index is not None else LeaderboardIndex()
+
+    def replication_snapshot(self):
+        """
+        (複寫) 取得一份與 replication_log 序號一致的完整快照，
+        回傳 (lsn, [[(mmap, bytes 數), ...] 每個分片], ({ level_id: LevelStats }, { level_id: 版本號 }))
+        期間暫停所有寫入：等寫入器把已送出的紀錄都寫進檔案，再一次 mmap 所有分段，
+        檔案內容剛好是序號 <= lsn 的所有紀錄 (壓縮器丟掉的舊紀錄除外，與重啟後重建的索引相同)；
+        丟掉的舊紀錄只以統計檔的形式一起回傳 (讓 Follower 的關卡統計與版本號與 Primary 相同)。
+        呼叫端讀完後必須 close() 每個 mmap。
+        """
+        with self.shards_lock: # 暫停 level 模式建立新分片
+            shards = [self.shards[key] for key in sorted(self.shards)]
+            for shard in shards:
+                shard.write_lock.acquire()
+            try:
+                barriers = [self.writer.submit(b"", shard.db_file) for shard in shards]
+                for ticket in barriers:
+                    ticket.wait()
+                lsn = self.replication_log.lsn
+                views, carried, versions = [], {}, {}
+                for shard in shards:
+                    with segment_lock(shard.db_file):
+                        stats, shard_versions = load_carried_stats(shard.db_file)
+                        carried.update(stats) # 每個關卡只屬於一個分片
+                        versions.update(shard_versions)
+                        views.append(map_segments(shard.db_file))
+            finally:
+                for shard in shards:
+                    shard.write_lock.release()
+        return lsn, views, (carried, versions)
+
+    def close(self):
+        """停止壓縮器，把尚未寫入的紀錄全部寫完並關閉所有檔案"""
+        if self.compactor is not None:
+            self.compactor.stop()
+        if self.writer is not None:
+            self.writer.close()
 
     def add_score(self, username: str, level_id: int, time_spent: float, stars: int):
         """
         寫入一筆新成績 (Append Only)
+        回傳 WriteTicket，呼叫 ticket.wait() 可等到紀錄依 sync_mode 寫入完成。
         """
         # 1. 資料處理
+        # 先檢查欄位 (不合法的紀錄不能進到檔案裡)
+        check_score(level_id, time_spent, stars)
         # 確保 username 是 bytes，且長度剛好 16 (不足補 \x00，太長切掉)
         name_bytes = username.encode('utf-8')[:16].ljust(16, b'\x00')
         timestamp = time.time()
@@ -48,60 +330,232 @@ class SteadyHandDB:
         # 這裡會把所有資料變成一串看不懂的 bytes，例如 b'Ray\x00...\x00\x01\x00...'
         data = struct.pack(self.format, name_bytes, level_id, time_spent, stars, timestamp)
         
-        # 3. 寫入檔案 (Thread-Safe)
-        with self.lock:
-            with open(self.db_file, "ab") as f: # 'ab' = Append Binary
-                f.write(data)
-                
-        print(f"[DB] Inserted score: {username} - Lv.{level_id} - {time_spent:.2f}s")
+        # 3. 更新索引並交給批次寫入器寫到該分片的檔案 (Thread-Safe)
+        # 索引用「解包後」的紀錄，確保與重啟後從檔案讀回的結果一致 (名字截斷、float32 精度)
+        # 兩者在同一把鎖內進行，檔案中的順序與索引的寫入順序 (seq) 保持一致；
+        # 先更新索引，萬一失敗 (丟出例外) 紀錄也還沒送進寫入器，不會留在檔案裡
+        record = self._unpack_record(data)
+        shard = self._shard_for(level_id, create=True)
+        with self._locked(shard):
+            shard.index.apply(record)
+            ticket = self.writer.submit(data, shard.db_file)
+            if self.replication_log is not None:
+                self.replication_log.append(data)
 
-    def get_leaderboard(self, level_id: int, limit=5):
+        for callback in self.listeners:
+            callback(record)
+
+        access_log.info("[DB] Inserted score: %s - Lv.%s - %.2fs", username, level_id, time_spent)
+        return ticket
+
+    def add_scores(self, username: str, scores):
         """
-        讀取排行榜 (全表掃描並排序)
+        批次寫入同一位玩家的多筆成績 (例如離線時累積的紀錄)
+        scores: [(level_id, time_spent, stars), ...]
+        同一個分片的紀錄合併成一次寫入請求，每個分片只取一次鎖。
+        回傳 WriteTicket 列表 (每個分片一個)，全部 wait() 成功才代表整批寫入完成。
         """
-        records = []
-        
-        with self.lock:
-            with open(self.db_file, "rb") as f:
-                while True:
-                    # 1. 每次讀取固定長度 (36 bytes)
-                    chunk = f.read(self.record_size)
-                    if not chunk: 
-                        break # 讀到檔尾停止
-                    
-                    # 2. 解包 (Unpack)
-                    try:
-                        name_b, lvl, t, star, ts = struct.unpack(self.format, chunk)
-                    except struct.error:
-                        print("[DB] Warning: Corrupted record found, skipping.")
-                        continue
-                    
-                    # 3. 篩選：只取目前關卡的資料
-                    if lvl == level_id:
-                        # 清理名字 (把後面的 \x00 拿掉)
-                        clean_name = name_b.decode('utf-8').rstrip('\x00')
-                        records.append({
-                            "name": clean_name,
-                            "time": round(t, 2),
-                            "stars": star,
-                            "date": time.ctime(ts) # 轉成可讀時間
-                        })
-        
-        # 4. 排序與取前幾名
-        # 規則：時間越短越好 (Ascending)
-        records.sort(key=lambda x: x["time"])
-        
-        # 5. 去重 (選用)：如果同一個人有多筆成績，只留最好的
-        # 這裡簡單實作：用 dict 過濾
-        best_scores = {}
-        for r in records:
-            name = r["name"]
-            if name not in best_scores:
-                best_scores[name] = r
-            # 因為已經排過序了，先出現的一定是比較好的，所以不用做比較
-            
-        final_list = list(best_scores.values())
-        return final_list[:limit]
+        name_bytes = username.encode('utf-8')[:16].ljust(16, b'\x00')
+        timestamp = time.time()
+
+        # 整批先檢查，有任何一筆不合法就整批拒絕 (還沒有任何紀錄被寫入)
+        scores = list(scores)
+        for level_id, time_spent, stars in scores:
+            check_score(level_id, time_spent, stars)
+
+        # 先在鎖外打包好，依分片分組
+        groups = {} # shard -> ([data...], [record...])
+        for level_id, time_spent, stars in scores:
+            data = struct.pack(self.format, name_bytes, level_id, time_spent, stars, timestamp)
+            shard = self._shard_for(level_id, create=True)
+            datas, records = groups.setdefault(shard, ([], []))
+            datas.append(data)
+            records.append(self._unpack_record(data))
+
+        tickets = []
+        for shard, (datas, records) in groups.items():
+            with self._locked(shard):
+                data = b"".join(datas)
+                for record in records:
+                    shard.index.apply(record)
+                tickets.append(self.writer.submit(data, shard.db_file))
+                if self.replication_log is not None:
+                    self.replication_log.append(data)
+
+        for _, records in groups.values():
+            for record in records:
+                for callback in self.listeners:
+                    callback(record)
+
+        access_log.info("[DB] Inserted %d scores for %s (%d shard(s))",
+                        sum(len(r) for _, r in groups.values()), username, len(groups))
+        return tickets
+
+    def get_leaderboard(self, level_id: int, limit=5, window=WINDOW_ALL):
+        """
+        讀取排行榜 (只查詢該關卡所屬分片的記憶體索引)
+        規則：時間越短越好，同一個人只留最好的一筆
+        window: "all" (歷史總榜) / "day" / "week" / "season" (只算這一期的成績)
+        """
+        return [self._format_record(r) for r in self.get_leaderboard_records(level_id, limit, window)]
+
+    def get_leaderboard_records(self, level_id: int, limit=5, window=WINDOW_ALL):
+        """
+        與 get_leaderboard 相同，但回傳原始的 ScoreRecord (給二進位編碼直接打包，不經過字典)
+        limit <= SNAPSHOT_DEPTH 時直接讀快照，不需要鎖
+        """
+        self._check_window(window)
+        shard = self._shard_for(level_id)
+        if shard is None:
+            return []
+        if limit <= SNAPSHOT_DEPTH:
+            records = shard.index.top(level_id, limit, window)
+        else:
+            with self._locked(shard):
+                records = shard.index.top(level_id, limit, window)
+        self.metrics.record_rows(len(records))
+        return records
+
+    def get_leaderboard_version(self, level_id: int, window=WINDOW_ALL) -> int:
+        """
+        排行榜目前的版本號 (每次寫入該關都會變大)，不需要鎖
+        要和排行榜內容一起回傳時，請先取版本號再讀內容：讀取途中有新寫入時，
+        Client 拿到的是「舊版本號 + 新內容」，下次只會多下載一次，不會誤判為沒有變動。
+        """
+        self._check_window(window)
+        shard = self._shard_for(level_id)
+        if shard is None:
+            return board_version(0, window)
+        return shard.index.version(level_id, window)
+
+    def get_leaderboards(self, level_ids, limit=5, window=WINDOW_ALL):
+        """
+        一次讀取多個關卡的排行榜，回傳 { level_id: [records...] }
+        limit <= SNAPSHOT_DEPTH 時每關只是讀一次快照；更深的查詢每個分片只取一次鎖。
+        """
+        self._check_window(window)
+        by_shard = {} # shard -> [level_id...]
+        result = {}
+        for level_id in level_ids:
+            shard = self._shard_for(level_id)
+            if shard is None:
+                result[level_id] = []
+            else:
+                by_shard.setdefault(shard, []).append(level_id)
+
+        for shard, levels in by_shard.items():
+            if limit <= SNAPSHOT_DEPTH:
+                for level_id in levels:
+                    result[level_id] = [self._format_record(r) for r in shard.index.top(level_id, limit, window)]
+            else:
+                with self._locked(shard):
+                    tops = [(level_id, shard.index.top(level_id, limit, window)) for level_id in levels]
+                for level_id, top in tops:
+                    result[level_id] = [self._format_record(r) for r in top]
+        self.metrics.record_rows(sum(len(rows) for rows in result.values()))
+        return result
+
+    def get_rank(self, level_id: int, username: str, window=WINDOW_ALL):
+        """
+        查詢玩家在某關的名次與個人最佳 (O(log n))
+        回傳 {"rank", "total", "name", "time", "stars", "date"}；沒有紀錄時回傳 None
+        """
+        self._check_window(window)
+        shard = self._shard_for(level_id)
+        if shard is None:
+            return None
+        with self._locked(shard):
+            board = shard.index.board(level_id, window)
+            found = board.rank_of(self._clean_name(username)) if board else None
+            total = len(board) if board else 0
+        if found is None:
+            return None
+        self.metrics.record_rows(1)
+
+        rank, record = found
+        return {"rank": rank, "total": total, **self._format_record(record)}
+
+    def get_around(self, level_id: int, username: str, k=5, window=WINDOW_ALL):
+        """
+        查詢玩家前後各 k 名 (O(log n + k))
+        回傳 {"rank", "total", "data": [{"rank", "name", "time", ...}, ...]}；沒有紀錄時回傳 None
+        """
+        self._check_window(window)
+        shard = self._shard_for(level_id)
+        if shard is None:
+            return None
+        with self._locked(shard):
+            board = shard.index.board(level_id, window)
+            rows = board.around(self._clean_name(username), k) if board else None
+            total = len(board) if board else 0
+        if rows is None:
+            return None
+        self.metrics.record_rows(len(rows))
+
+        name = self._clean_name(username)
+        my_rank = next(rank for rank, r in rows if r.name == name)
+        return {
+            "rank": my_rank,
+            "total": total,
+            "data": [{"rank": rank, **self._format_record(r)} for rank, r in rows],
+        }
+
+    def get_stats(self, level_id: int, username: str = None):
+        """
+        關卡統計：嘗試次數、玩家數、最快/平均秒數、近似分位數與秒數直方圖
+        若提供 username，另外回傳該玩家的名次與「贏過多少 % 的玩家」
+        """
+        empty = {"count": 0, "players": 0}
+        shard = self._shard_for(level_id)
+        if shard is None:
+            return empty
+        with self._locked(shard):
+            stats = shard.index.stats.get(level_id)
+            board = shard.index.board(level_id)
+            if stats is None or board is None:
+                return empty
+            players = len(board)
+            found = board.rank_of(self._clean_name(username)) if username else None
+
+            bins = stats.bins
+            last = max((i for i, n in enumerate(bins) if n), default=-1)
+            result = {
+                "count": stats.count,
+                "players": players,
+                "min": round(stats.min_time, 2),
+                "mean": round(stats.mean(), 2),
+                "p50": round(stats.quantile(0.50), 2),
+                "p90": round(stats.quantile(0.90), 2),
+                "p99": round(stats.quantile(0.99), 2),
+                # 只送到最後一個非零的格子，最後一格 (若有送到) 是 overflow
+                "histogram": {"bin_width": stats.BIN_WIDTH, "counts": bins[:last + 1]},
+            }
+
+        if found is not None:
+            rank = found[0]
+            result["rank"] = rank
+            # 贏過的玩家比例 (不含自己)
+            result["beat_pct"] = round(100.0 * (players - rank) / (players - 1), 1) if players > 1 else 100.0
+        return result
+
+    @staticmethod
+    def _check_window(window):
+        if window != WINDOW_ALL and window not in TIME_WINDOWS:
+            raise ValueError(f"Unknown window: {window}")
+
+    @staticmethod
+    def _clean_name(username: str) -> str:
+        """與寫入時相同的名字處理 (16 bytes 截斷)，用來在索引中查詢玩家"""
+        return username.encode('utf-8')[:16].decode('utf-8', errors='ignore').rstrip('\x00')
+
+    @staticmethod
+    def _format_record(r: ScoreRecord) -> dict:
+        return {
+            "name": r.name,
+            "time": round(r.time, 2),
+            "stars": r.stars,
+            "date": time.ctime(r.timestamp) # 轉成可讀時間
+        }
 
 # --- 測試區 (當直接執行此檔案時運作) ---
 if __name__ == "__main__":
@@ -130,6 +584,8 @@ if __name__ == "__main__":
     top5_lv2 = db.get_leaderboard(2)
     for i, r in enumerate(top5_lv2):
         print(f"Rank {i+1}: {r['name']} - {r['time']}s")
+
+    db.close()
     
     # [修正 2] 註解掉刪除指令，讓檔案保留下來
     # os.remove(db_filename) 
@@ -0,0 +1,431 @@
+# 檔案名稱: server/db_index.py
+import math
+import random
+import time
+from collections import namedtuple
+
+# 一筆成績紀錄 (對應 db_engine 的 "16sIfId" 格式，name 已解碼成 str)
+ScoreRecord = namedtuple("ScoreRecord", ["name", "level", "time", "stars", "timestamp"])
+
+# 每個關卡預先發布的「前 N 名快照」深度，查詢 limit 不超過這個數字時完全不需要鎖
+SNAPSHOT_DEPTH = 100
+
+
+class _SkipNode:
+    __slots__ = ("key", "next", "span")
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        self.span = [0] * level   # 從此節點沿 next[i] 前進會跨過幾個名次
+
+
+class IndexableSkipList:
+    """
+    可索引跳躍串列 (Order-Statistic Skip List)
+    依 key 排序，並在每一層記錄跨距 (span)，因此除了插入/刪除，
+    「查某個 key 的名次」與「取第 r 名」也都是 O(log n)。
+    名次 (rank) 從 1 開始。
+    """
+
+    MAX_LEVEL = 32
+    P = 0.25
+
+    def __init__(self):
+        self.head = _SkipNode(None, self.MAX_LEVEL)
+        self.level = 1
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _random_level(self):
+        level = 1
+        while level < self.MAX_LEVEL and random.random() < self.P:
+            level += 1
+        return level
+
+    def insert(self, key) -> int:
+        """插入 key，回傳它的名次"""
+        update = [self.head] * self.MAX_LEVEL
+        rank = [0] * self.MAX_LEVEL
+        x = self.head
+        for i in range(self.level - 1, -1, -1):
+            rank[i] = rank[i + 1] if i + 1 < self.level else 0
+            while x.next[i] is not None and x.next[i].key < key:
+                rank[i] += x.span[i]
+                x = x.next[i]
+            update[i] = x
+
+        level = self._random_level()
+        if level > self.level:
+            for i in range(self.level, level):
+                rank[i] = 0
+                update[i] = self.head
+                self.head.span[i] = self.size
+            self.level = level
+
+        node = _SkipNode(key, level)
+        for i in range(level):
+            node.next[i] = update[i].next[i]
+            update[i].next[i] = node
+            node.span[i] = update[i].span[i] - (rank[0] - rank[i])
+            update[i].span[i] = (rank[0] - rank[i]) + 1
+        for i in range(level, self.level):
+            update[i].span[i] += 1
+
+        self.size += 1
+        return rank[0] + 1
+
+    def remove(self, key) -> int:
+        """刪除 key (必須存在)，回傳它原本的名次"""
+        update = [self.head] * self.MAX_LEVEL
+        rank = 0
+        x = self.head
+        for i in range(self.level - 1, -1, -1):
+            while x.next[i] is not None and x.next[i].key < key:
+                rank += x.span[i]
+                x = x.next[i]
+            update[i] = x
+
+        node = x.next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+
+        for i in range(self.level):
+            if update[i].next[i] is node:
+                update[i].span[i] += node.span[i] - 1
+                update[i].next[i] = node.next[i]
+            else:
+                update[i].span[i] -= 1
+        while self.level > 1 and self.head.next[self.level - 1] is None:
+            self.level -= 1
+
+        self.size -= 1
+        return rank + 1
+
+    def rank(self, key) -> int:
+        """key 的名次；不存在時回傳 0"""
+        rank = 0
+        x = self.head
+        for i in range(self.level - 1, -1, -1):
+            while x.next[i] is not None and x.next[i].key <= key:
+                rank += x.span[i]
+                x = x.next[i]
+            if x is not self.head and x.key == key:
+                return rank
+        return 0
+
+    def count_less(self, key) -> int:
+        """比 key 小的元素個數 (key 不需要存在)"""
+        rank = 0
+        x = self.head
+        for i in range(self.level - 1, -1, -1):
+            while x.next[i] is not None and x.next[i].key < key:
+                rank += x.span[i]
+                x = x.next[i]
+        return rank
+
+    def _node_at(self, rank):
+        traversed = 0
+        x = self.head
+        for i in range(self.level - 1, -1, -1):
+            while x.next[i] is not None and traversed + x.span[i] <= rank:
+                traversed += x.span[i]
+                x = x.next[i]
+            if traversed == rank:
+                return x
+        return None
+
+    def slice(self, start, stop):
+        """取名次 start+1 ~ stop 的 key (與 list[start:stop] 相同語意，start/stop 不可為負)"""
+        stop = min(stop, self.size)
+        if start >= stop:
+            return []
+        x = self._node_at(start + 1)
+        keys = []
+        for _ in range(stop - start):
+            keys.append(x.key)
+            x = x.next[0]
+        return keys
+
+
+class LevelBoard:
+    """
+    單一關卡的排行榜索引 (In-Memory Index)
+    - entries: { name: (time, seq, record) }，每位玩家只保留最佳成績
+    - order:   依 (time, seq) 排序的 IndexableSkipList，前 N 筆就是前 N 名，
+               任一玩家的名次與其前後名次也能在 O(log n) 內取得
+    seq 是寫入順序，用來讓同秒數的成績「先達成者排前面」，與舊版全表排序的穩定排序結果一致。
+
+    讀寫分離 (Copy-on-Write):
+    寫入端 (持有 DB 的 write_lock) 修改 order 後，若前 SNAPSHOT_DEPTH 名有變動，
+    就重新發布一個不可變的 tuple 到 self.snapshot。讀取端只讀這個 tuple，不需要任何鎖，
+    也不會看到寫到一半的排行榜。其他查詢 (名次、更深的排名) 需由呼叫端持有寫入鎖。
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.order = IndexableSkipList()
+        self.version = 0      # 每次排行榜有變動就 +1
+        self.snapshot = ()    # 前 SNAPSHOT_DEPTH 名 (tuple of ScoreRecord)
+
+    def __len__(self):
+        return len(self.order)
+
+    def update(self, record: ScoreRecord, seq: int) -> bool:
+        """
+        套用一筆新成績，只有比該玩家目前最佳成績更快才會更新。
+        回傳 True 代表排行榜有變動。(呼叫端必須持有寫入鎖)
+        """
+        changed_at = len(self.order) + 1
+        old = self.entries.get(record.name)
+        if old is not None:
+            if record.time >= old[0]:
+                return False
+            # 移除舊的最佳成績
+            changed_at = self.order.remove(old)
+
+        # seq 不會重複，所以 tuple 比較永遠不會比到 record
+        entry = (record.time, seq, record)
+        rank = self.order.insert(entry)
+        self.entries[record.name] = entry
+        self.version += 1
+
+        if min(changed_at, rank) <= SNAPSHOT_DEPTH:
+            self.snapshot = tuple(e[2] for e in self.order.slice(0, SNAPSHOT_DEPTH))
+        return True
+
+    def top(self, limit: int):
+        """
+        取前 limit 名 (O(log n + limit))
+        limit <= SNAPSHOT_DEPTH 時讀快照 (不需鎖)；更深的查詢需由呼叫端持有寫入鎖。
+        """
+        if limit <= SNAPSHOT_DEPTH:
+            return list(self.snapshot[:limit])
+        return [e[2] for e in self.order.slice(0, limit)]
+
+    def rank_of(self, name):
+        """玩家的 (名次, 最佳成績)；沒有紀錄時回傳 None"""
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        return self.order.rank(entry), entry[2]
+
+    def around(self, name, k):
+        """
+        玩家前後各 k 名 (含玩家本人)，回傳 [(名次, ScoreRecord), ...]
+        沒有紀錄時回傳 None
+        """
+        found = self.rank_of(name)
+        if found is None:
+            return None
+        rank = found[0]
+        start = max(0, rank - 1 - k)
+        entries = self.order.slice(start, rank + k)
+        return [(start + i + 1, e[2]) for i, e in enumerate(entries)]
+
+
+class LevelStats:
+    """
+    單一關卡的統計 (串流聚合，每筆紀錄 O(1) 更新)
+    - count / min / mean: 所有嘗試 (attempts) 的次數、最快、平均秒數
+    - histogram: 固定寬度的秒數直方圖，最後一格收集所有超過上限的紀錄
+    - quantile(): 由直方圖內插出的近似分位數
+    壓縮器丟掉的舊嘗試會先加進統計檔 (見 db_compactor.py)，重建索引時從統計檔開始累加，統計不會因為壓縮而變少。
+    """
+
+    BIN_WIDTH = 0.5   # 秒
+    NUM_BINS = 240    # 0 ~ 120 秒，再加一格 overflow
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.min_time = None
+        self.max_time = None
+        self.bins = [0] * (self.NUM_BINS + 1)
+
+    def add(self, t):
+        self.count += 1
+        self.total_time += t
+        if self.min_time is None or t < self.min_time:
+            self.min_time = t
+        if self.max_time is None or t > self.max_time:
+            self.max_time = t
+        self.bins[min(max(int(t / self.BIN_WIDTH), 0), self.NUM_BINS)] += 1
+
+    def merge(self, other: "LevelStats"):
+        """加上另一份統計 (例如統計檔裡被壓縮掉的嘗試)"""
+        if not other.count:
+            return
+        self.count += other.count
+        self.total_time += other.total_time
+        if self.min_time is None or other.min_time < self.min_time:
+            self.min_time = other.min_time
+        if self.max_time is None or other.max_time > self.max_time:
+            self.max_time = other.max_time
+        self.bins = [a + b for a, b in zip(self.bins, other.bins)]
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "total_time": self.total_time,
+                "min_time": self.min_time, "max_time": self.max_time, "bins": self.bins}
+
+    @classmethod
+    def from_dict(cls, data) -> "LevelStats":
+        """to_dict() 的反向；格式不符時丟出 ValueError"""
+        stats = cls()
+        try:
+            stats.count = int(data["count"])
+            stats.total_time = float(data["total_time"])
+            stats.min_time = None if data["min_time"] is None else float(data["min_time"])
+            stats.max_time = None if data["max_time"] is None else float(data["max_time"])
+            stats.bins = [int(n) for n in data["bins"]]
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Bad level stats: {e}")
+        if len(stats.bins) != cls.NUM_BINS + 1:
+            raise ValueError(f"Bad level stats: expected {cls.NUM_BINS + 1} bins, got {len(stats.bins)}")
+        return stats
+
+    def mean(self):
+        return self.total_time / self.count if self.count else None
+
+    def quantile(self, q):
+        """近似分位數 (0 <= q <= 1)，在命中的那一格內做線性內插"""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.bins):
+            if n and seen + n >= target:
+                if i == self.NUM_BINS:
+                    return self.max_time # overflow 格沒有上界，用最大值代替
+                lo = i * self.BIN_WIDTH
+                value = lo + self.BIN_WIDTH * (target - seen) / n
+                return min(max(value, self.min_time), self.max_time)
+            seen += n
+        return self.max_time
+
+
+# --- 時間視窗 (Time-Bucketed Leaderboards) ---
+# all:    歷史總榜
+# day:    UTC 當日
+# week:   UTC 當週 (週一開始)
+# season: UTC 當季 (1-3 月、4-6 月、7-9 月、10-12 月)
+WINDOW_ALL = "all"
+WINDOW_DAY = "day"
+WINDOW_WEEK = "week"
+WINDOW_SEASON = "season"
+TIME_WINDOWS = (WINDOW_DAY, WINDOW_WEEK, WINDOW_SEASON)
+
+
+def bucket_of(window, ts):
+    """timestamp 在某個時間視窗中屬於第幾期 (整數，越新越大)"""
+    if window == WINDOW_DAY:
+        return int(ts // 86400)
+    if window == WINDOW_WEEK:
+        # 1970-01-01 是星期四，+3 天讓每一期從星期一開始
+        return int(ts // 86400 + 3) // 7
+    if window == WINDOW_SEASON:
+        t = time.gmtime(ts)
+        return t.tm_year * 4 + (t.tm_mon - 1) // 3
+    raise ValueError(f"Unknown window: {window}")
+
+
+def next_version(old, timestamp) -> int:
+    """
+    寫入一筆紀錄後該關的版本號：取紀錄時間戳 (微秒)，且保證嚴格遞增
+    重啟後由同樣的紀錄重建出同樣的版本號；壓縮掉的紀錄由統計檔保存的版本號補上 (見 restore_versions)
+    """
+    version = int(timestamp * 1000000)
+    return version if version > old else old + 1
+
+
+def board_version(level_version, window, now=None):
+    """
+    某個時間視窗排行榜的版本號 (level_version 是該關的版本號，沒有紀錄時為 0)
+    時間視窗榜再加上「第幾期」：版本號與期數都只會增加，
+    所以 Client 看過的 (版本, 期數) 加總等於現在的加總時，必定是同一組，換期後一定會不同。
+    """
+    if window == WINDOW_ALL:
+        return level_version
+    return level_version + bucket_of(window, time.time() if now is None else now)
+
+
+class LeaderboardIndex:
+    """
+    所有關卡的排行榜索引
+    - levels:  { level_id: LevelBoard }，歷史總榜
+    - windows: { window: (bucket, { level_id: LevelBoard }) }，每個時間視窗只保留「這一期」
+    - stats:   { level_id: LevelStats }，所有嘗試的統計
+    - versions: { level_id: int }，該關的版本號，每寫入一筆就變大 (給 Client 做條件式查詢)
+    啟動時由資料庫檔案重建一次，之後由 add_score 增量維護。
+    新的一期開始時 (寫入的紀錄屬於更新的 bucket)，舊一期的排行榜整批丟掉；
+    在那之前，讀取時若發現這一期已經過了，也直接當作空榜。
+    """
+
+    def __init__(self, now=None):
+        now = time.time() if now is None else now
+        self.levels = {}
+        self.windows = {w: (bucket_of(w, now), {}) for w in TIME_WINDOWS}
+        self.stats = {}
+        self.versions = {}
+        self._seq = 0
+
+    @staticmethod
+    def _apply_to(levels, record, seq):
+        board = levels.get(record.level)
+        if board is None:
+            board = levels[record.level] = LevelBoard()
+        return board.update(record, seq)
+
+    def apply(self, record: ScoreRecord) -> bool:
+        """套用一筆紀錄，回傳歷史總榜是否有變動"""
+        if not math.isfinite(record.time):
+            # 舊版沒有檢查上傳內容，檔案裡可能有 NaN / inf 的紀錄：略過，不讓整個索引無法重建
+            return False
+        self._seq += 1
+        stats = self.stats.get(record.level)
+        if stats is None:
+            stats = self.stats[record.level] = LevelStats()
+        stats.add(record.time)
+
+        self.versions[record.level] = next_version(self.versions.get(record.level, 0), record.timestamp)
+
+        for window in TIME_WINDOWS:
+            bucket, levels = self.windows[window]
+            record_bucket = bucket_of(window, record.timestamp)
+            if record_bucket < bucket:
+                continue # 已過期的舊紀錄
+            if record_bucket > bucket:
+                # 新的一期開始：整個替換 (讀取端拿到的是舊的或新的，不會是一半)
+                levels = {}
+                self.windows[window] = (record_bucket, levels)
+            self._apply_to(levels, record, self._seq)
+        return self._apply_to(self.levels, record, self._seq)
+
+    def restore_versions(self, versions):
+        """
+        (重建索引後) 套用統計檔保存的版本號 { level_id: int }，每關取兩者較大的一個
+        壓縮會丟掉設定版本號的那筆紀錄，只靠剩下的紀錄重建出的版本號可能變小 (Client 的版本號就失效了)
+        """
+        for level_id, version in versions.items():
+            if version > self.versions.get(level_id, 0):
+                self.versions[level_id] = version
+
+    def board(self, level_id: int, window=WINDOW_ALL):
+        if window == WINDOW_ALL:
+            return self.levels.get(level_id)
+        bucket, levels = self.windows[window]
+        if bucket != bucket_of(window, time.time()):
+            return None # 這一期已經結束
+        return levels.get(level_id)
+
+    def version(self, level_id: int, window=WINDOW_ALL, now=None) -> int:
+        """排行榜的版本號 (見 board_version)"""
+        return board_version(self.versions.get(level_id, 0), window, now)
+
+    def top(self, level_id: int, limit: int, window=WINDOW_ALL):
+        board = self.board(level_id, window)
+        if board is None:
+            return []
+        return board.top(limit)
@@ -0,0 +1,83 @@
+# 檔案名稱: server/db_migrate.py
+import argparse
+import os
+import struct
+import sys
+
+# 加入專案根目錄，讓直接執行此檔案時也能 import server 底下的模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server.db_engine import SHARD_LEVEL, SHARD_HASH, shard_dir, shard_file, shard_key
+from server.db_scan import RECORD_FORMAT, iter_raw
+from server.db_compactor import load_carried_stats, stats_path, write_stats_file
+
+
+def split_database(db_file, shard_mode, shard_buckets=16):
+    """
+    把單一檔案 (含所有分段) 的資料庫拆成分片檔案，原始檔案保持不變。
+    目標分片目錄必須不存在或是空的，避免把資料重複寫入。
+    回傳 { shard_key: 筆數 }
+    """
+    if not os.path.exists(db_file):
+        raise FileNotFoundError(db_file)
+
+    target_dir = shard_dir(db_file, shard_mode, shard_buckets)
+    if os.path.isdir(target_dir) and os.listdir(target_dir):
+        raise FileExistsError(f"{target_dir} is not empty")
+    os.makedirs(target_dir, exist_ok=True)
+
+    files = {}
+    counts = {}
+    try:
+        for row in iter_raw(db_file):
+            key = shard_key(row[1], shard_mode, shard_buckets)
+            f = files.get(key)
+            if f is None:
+                f = files[key] = open(shard_file(db_file, shard_mode, shard_buckets, key), "wb")
+                counts[key] = 0
+            f.write(struct.pack(RECORD_FORMAT, *row))
+            counts[key] += 1
+    finally:
+        for f in files.values():
+            f.close()
+
+    # 統計檔 (被壓縮掉的嘗試的關卡統計與版本號) 也依關卡分到各分片
+    carried, versions = load_carried_stats(db_file)
+    by_key = {}
+    for level_id in carried.keys() | versions.keys():
+        key = shard_key(level_id, shard_mode, shard_buckets)
+        stats, key_versions = by_key.setdefault(key, ({}, {}))
+        if level_id in carried:
+            stats[level_id] = carried[level_id]
+        if level_id in versions:
+            key_versions[level_id] = versions[level_id]
+    for key, (stats, key_versions) in by_key.items():
+        path = shard_file(db_file, shard_mode, shard_buckets, key)
+        if key not in counts:
+            open(path, "wb").close()
+            counts[key] = 0
+        write_stats_file(stats_path(path), stats, key_versions)
+
+    # hash 模式的空桶也建立檔案，與 SteadyHandDB 啟動時的結構一致
+    if shard_mode == SHARD_HASH:
+        for key in range(shard_buckets):
+            if key not in counts:
+                open(shard_file(db_file, shard_mode, shard_buckets, key), "wb").close()
+                counts[key] = 0
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="把單一 steadyhand.db 拆成分片檔案")
+    parser.add_argument("db_file", nargs="?", default="steadyhand.db")
+    parser.add_argument("--mode", choices=[SHARD_LEVEL, SHARD_HASH], default=SHARD_LEVEL)
+    parser.add_argument("--buckets", type=int, default=16, help="hash 模式的桶數")
+    args = parser.parse_args()
+
+    counts = split_database(args.db_file, args.mode, args.buckets)
+    for key in sorted(counts):
+        path = shard_file(args.db_file, args.mode, args.buckets, key)
+        print(f"{path:<40} {counts[key]:>10} 筆")
+    print(f"總計: {sum(counts.values())} 筆資料 -> {len(counts)} 個分片")
+    print(f"請在 .env 設定 DB_SHARD_MODE={args.mode}" +
+          (f" 與 DB_SHARD_BUCKETS={args.buckets}" if args.mode == SHARD_HASH else ""))
@@ -0,0 +1,186 @@
+# 檔案名稱: server/db_scan.py
+import mmap
+import os
+import struct
+import sys
+from array import array
+from itertools import compress
+
+# 加入專案根目錄，讓直接執行此檔案時也能 import server 底下的模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server.db_index import ScoreRecord
+from server.db_segments import segment_files, segment_lock
+from server.log import get_logger
+
+log = get_logger("db")
+
+# 必須與 db_engine.py 使用完全相同的格式
+RECORD_FORMAT = "16sIfId"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+
+def _open_view(path):
+    """
+    以 mmap 唯讀開啟一個分段檔案，回傳 (mmap, 完整紀錄的 bytes 數)
+    檔案為空時回傳 (None, 0)；檔尾不足一筆的殘缺資料會被忽略。
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return None, 0
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    usable = size - (size % RECORD_SIZE)
+    if usable != size:
+        log.warning(f"[DB] Warning: {size - usable} trailing bytes in {path} ignored (partial record).")
+    return mm, usable
+
+
+def _iter_view(mm, usable):
+    it = struct.iter_unpack(RECORD_FORMAT, memoryview(mm)[:usable])
+    try:
+        yield from it
+    finally:
+        # 先丟掉 iterator 釋放 buffer，mmap 才能關閉
+        del it
+        mm.close()
+
+
+def iter_raw_file(path):
+    """批次解包單一分段檔案"""
+    mm, usable = _open_view(path)
+    if mm is None:
+        return
+    yield from _iter_view(mm, usable)
+
+
+def map_segments(db_file):
+    """
+    在同一把鎖內一次 mmap 所有分段 (依寫入順序)，回傳 [(mmap, 完整紀錄的 bytes 數), ...]
+    呼叫端讀完後必須自行 close()。
+    """
+    views = []
+    with segment_lock(db_file):
+        for path in segment_files(db_file):
+            try:
+                mm, usable = _open_view(path)
+            except FileNotFoundError:
+                continue
+            if mm is not None:
+                views.append((mm, usable))
+    return views
+
+
+def iter_raw(db_file, views=None):
+    """
+    批次解包整個資料庫 (所有分段，依寫入順序)，逐筆產生原始 tuple:
+    (name_bytes, level_id, time_spent, stars, timestamp)
+    所有分段在同一把鎖內一次 mmap，之後即使壓縮器換掉檔案，已映射的內容仍然有效。
+    views: 呼叫端已經用 map_segments 取得的分段 (需要與其他檔案在同一把鎖內一起讀取時)，讀完會自動關閉
+    """
+    if views is None:
+        views = map_segments(db_file)
+    try:
+        for mm, usable in views:
+            yield from _iter_view(mm, usable)
+    finally:
+        # 提前結束時關閉尚未讀取的 mmap
+        for mm, _ in views:
+            if not mm.closed:
+                mm.close()
+
+
+def iter_records(db_file, views=None):
+    """與 iter_raw 相同，但把名字解碼成 str，產生 ScoreRecord"""
+    names = {} # 玩家名字大量重複，快取解碼結果
+    for name_b, lvl, t, stars, ts in iter_raw(db_file, views):
+        name = names.get(name_b)
+        if name is None:
+            name = names[name_b] = name_b.decode('utf-8', errors='ignore').rstrip('\x00')
+        yield ScoreRecord(name, lvl, t, stars, ts)
+
+
+class ScoreTable:
+    """
+    欄式 (Columnar) 資料表：每個欄位直接從 mmap 以固定間隔切片 (stride slice) 複製成 array 欄位，
+    解包時不會逐筆建立 tuple；關卡篩選用 itertools.compress 走完整欄 (迴圈在 C 裡)。
+    每位玩家最佳成績仍需要一次分組 (每列一次 dict 查詢)，但整張表只掃一次，所有關卡一起算。
+    """
+
+    # 各欄位在一筆紀錄中的位置 (原生對齊："16sIfI" 共 28 bytes，d 前面補 4 bytes 對齊到 32)
+    _NAME = (0, 16)
+    _LEVEL = (16, 4)
+    _TIME = (20, 4)
+    _STARS = (24, 4)
+    _TIMESTAMP = (RECORD_SIZE - 8, 8)
+
+    def __init__(self, names, levels, times, stars, timestamps):
+        self.names = names # [16 bytes 的名字, ...]
+        self.levels = levels # array("I")
+        self.times = times # array("f")
+        self.stars = stars # array("I")
+        self.timestamps = timestamps # array("d")
+
+    @classmethod
+    def load(cls, *db_files):
+        """讀取一或多個資料庫檔案 (含分段，例如同一個資料庫的所有分片)"""
+        table = cls([], array("I"), array("f"), array("I"), array("d"))
+        for db_file in db_files:
+            for mm, usable in map_segments(db_file):
+                try:
+                    table._extend(mm, usable)
+                finally:
+                    mm.close()
+        return table
+
+    @staticmethod
+    def _column(mm, usable, field):
+        """把每筆紀錄的同一個欄位複製成連續的 bytes (每個 byte 位置一次 C 層級的間隔切片)"""
+        offset, width = field
+        out = bytearray(usable // RECORD_SIZE * width)
+        for k in range(width):
+            out[k::width] = mm[offset + k:usable:RECORD_SIZE]
+        return out
+
+    def _extend(self, mm, usable):
+        names = bytes(self._column(mm, usable, self._NAME))
+        ends = range(16, len(names) + 16, 16)
+        self.names.extend(map(names.__getitem__, map(slice, range(0, len(names), 16), ends)))
+        self.levels.frombytes(self._column(mm, usable, self._LEVEL))
+        self.times.frombytes(self._column(mm, usable, self._TIME))
+        self.stars.frombytes(self._column(mm, usable, self._STARS))
+        self.timestamps.frombytes(self._column(mm, usable, self._TIMESTAMP))
+
+    def __len__(self):
+        return len(self.levels)
+
+    def level_rows(self, level_id):
+        """回傳指定關卡的列號"""
+        return list(compress(range(len(self.levels)), map(level_id.__eq__, self.levels)))
+
+    def best_per_user(self, level_id=None):
+        """
+        每位玩家在每關的最佳成績 (同秒數取較早寫入的一筆)，依 (關卡, 時間) 排序。
+        level_id=None 時一次算出所有關卡。回傳 ScoreRecord 列表。
+        """
+        levels, names, times = self.levels, self.names, self.times
+        if level_id is None:
+            rows = range(len(levels))
+            keys = zip(levels, names)
+        else:
+            rows = self.level_rows(level_id)
+            keys = zip(map(levels.__getitem__, rows), map(names.__getitem__, rows))
+        best = {} # (level_id, name_bytes) -> 列號
+        for key, i in zip(keys, rows):
+            j = best.get(key)
+            if j is None or times[i] < times[j]:
+                best[key] = i
+
+        order = sorted(zip(map(levels.__getitem__, best.values()), map(times.__getitem__, best.values()),
+                           best.values()))
+        return [self.record(i) for _, _, i in order]
+
+    def record(self, i) -> ScoreRecord:
+        name = self.names[i].decode('utf-8', errors='ignore').rstrip('\x00')
+        return ScoreRecord(name, self.levels[i], self.times[i], self.stars[i], self.timestamps[i])
@@ -0,0 +1,74 @@
+# 檔案名稱: server/db_segments.py
+import os
+import re
+import threading
+
+# --- 分段檔案 (Log-Structured Segments) ---
+# 目前正在寫入的檔案永遠是 db_file 本身 (active segment)，
+# 當它超過大小上限時，會被改名為 db_file.000001、db_file.000002 ... (sealed segment)，
+# 然後重新建立一個空的 db_file 繼續寫。sealed segment 之後不會再被追加，只會被壓縮器整批重寫。
+# 讀取順序: sealed (依編號由小到大) -> active，也就是寫入的時間順序。
+
+_SEQ_DIGITS = 6
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def segment_path(db_file, seq):
+    return f"{db_file}.{seq:0{_SEQ_DIGITS}d}"
+
+
+def segment_lock(db_file):
+    """
+    同一個 db_file 在整個行程內共用的鎖。
+    換檔 (rollover)、壓縮後換檔、以及讀取端「一次打開所有分段」都必須持有這把鎖，
+    讀取端才不會看到換到一半的檔案組合。
+    """
+    key = os.path.abspath(db_file)
+    with _locks_guard:
+        lock = _locks.get(key)
+        if lock is None:
+            lock = _locks[key] = threading.RLock()
+        return lock
+
+
+def list_sealed(db_file):
+    """列出所有 sealed segment，回傳 [(seq, path), ...] (依編號排序)"""
+    directory = os.path.dirname(os.path.abspath(db_file))
+    base = os.path.basename(db_file)
+    pattern = re.compile(re.escape(base) + r"\.(\d{%d})$" % _SEQ_DIGITS)
+
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return [] # 例如唯讀副本還沒有任何分片目錄
+    segments = []
+    for name in names:
+        m = pattern.match(name)
+        if m:
+            segments.append((int(m.group(1)), segment_path(db_file, int(m.group(1)))))
+    segments.sort()
+    return segments
+
+
+def segment_files(db_file):
+    """依寫入順序列出所有分段檔案 (sealed... + active)"""
+    files = [path for _, path in list_sealed(db_file)]
+    if os.path.exists(db_file):
+        files.append(db_file)
+    return files
+
+
+def seal_active(db_file):
+    """
+    把 active segment 改名成下一個 sealed segment，並建立新的空 active 檔。
+    呼叫前必須先關閉寫入中的檔案。回傳新 sealed segment 的路徑。
+    """
+    with segment_lock(db_file):
+        sealed = list_sealed(db_file)
+        next_seq = sealed[-1][0] + 1 if sealed else 1
+        path = segment_path(db_file, next_seq)
+        os.replace(db_file, path)
+        with open(db_file, "wb"):
+            pass
+    return path
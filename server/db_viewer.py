@@ -1,42 +1,73 @@
 # 檔案名稱: server/db_viewer.py
-import struct
+import argparse
+import glob
 import os
+import sys
 import time
 
-def view_database(db_file="steadyhand.db"):
-    if not os.path.exists(db_file):
-        print(f"錯誤: 找不到資料庫檔案 {db_file}")
+# 加入專案根目錄，讓直接執行此檔案時也能 import server 底下的模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server.db_engine import SHARD_NONE, SHARD_LEVEL, SHARD_HASH, shard_dir, shard_file, shard_key, shard_keys
+from server.db_scan import ScoreTable, iter_records
+
+def print_row(r):
+    date_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(r.timestamp))
+    print(f"{r.name:<16} | {r.level:<3} | {r.time:<8.2f} | {r.stars:<5} | {date_str}")
+
+def database_files(db_file, shard_mode=SHARD_NONE, shard_buckets=16, level_id=None):
+    """要讀取的檔案 (分片模式下是每個分片檔；指定關卡時只讀該關所屬的分片)"""
+    if shard_mode == SHARD_NONE:
+        return [db_file]
+    keys = shard_keys(db_file, shard_mode, shard_buckets)
+    if level_id is not None:
+        keys = [key for key in keys if key == shard_key(level_id, shard_mode, shard_buckets)]
+    return [shard_file(db_file, shard_mode, shard_buckets, key) for key in keys]
+
+def view_database(db_file="steadyhand.db", level_id=None, best_only=False, shard_mode=SHARD_NONE, shard_buckets=16):
+    if shard_mode == SHARD_NONE:
+        sharded = sorted(glob.glob(glob.escape(db_file) + ".level") + glob.glob(glob.escape(db_file) + ".hash*"))
+        # 分片模式的資料不在 db_file 裡 (db_migrate 拆分後原始檔案保持不變)，只看 db_file 會漏掉拆分後寫入的資料
+        hint = f"{db_file} 已拆成分片 ({', '.join(sharded)})，請加上 --shard-mode level 或 --shard-mode hash --buckets N"
+        if not os.path.exists(db_file):
+            print(f"錯誤: {hint}" if sharded else f"錯誤: 找不到資料庫檔案 {db_file}")
+            return
+        if sharded:
+            print(f"警告: {hint}")
+    elif not os.path.isdir(shard_dir(db_file, shard_mode, shard_buckets)):
+        print(f"錯誤: 找不到分片目錄 {shard_dir(db_file, shard_mode, shard_buckets)}")
         return
+    files = database_files(db_file, shard_mode, shard_buckets, level_id)
 
-    # 必須與 db_engine.py 使用完全相同的格式
-    fmt = "16sIfId"
-    record_size = struct.calcsize(fmt)
-    
     print(f"{'USER':<16} | {'LV':<3} | {'TIME':<8} | {'STARS':<5} | {'DATE'}")
     print("-" * 65)
 
-    with open(db_file, "rb") as f:
-        count = 0
-        while True:
-            chunk = f.read(record_size)
-            if not chunk:
-                break
-            
-            try:
-                # 解包二進位數據
-                name_b, lvl, t, stars, ts = struct.unpack(fmt, chunk)
-                
-                # 清理數據 (去除 \x00)
-                name = name_b.decode('utf-8').rstrip('\x00')
-                date_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))
-                
-                print(f"{name:<16} | {lvl:<3} | {t:<8.2f} | {stars:<5} | {date_str}")
+    count = 0
+    if best_only:
+        # 每位玩家最佳成績：欄式載入後一次分組算出所有 (關卡, 玩家)，再整批排序
+        for r in ScoreTable.load(*files).best_per_user(level_id):
+            print_row(r)
+            count += 1
+    else:
+        # 依寫入順序列出原始紀錄 (mmap 批次解包，分片模式下逐個分片)
+        for path in files:
+            for r in iter_records(path):
+                if level_id is not None and r.level != level_id:
+                    continue
+                print_row(r)
                 count += 1
-            except struct.error:
-                print("[Error] 讀取到損壞的數據區塊")
 
     print("-" * 65)
     print(f"總計: {count} 筆資料")
 
 if __name__ == "__main__":
-    view_database()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="SteadyHand 資料庫檢視工具")
+    parser.add_argument("db_file", nargs="?", default="steadyhand.db")
+    parser.add_argument("--level", type=int, default=None, help="只顯示指定關卡")
+    parser.add_argument("--best", action="store_true", help="每位玩家只顯示最佳成績 (依時間排序)")
+    parser.add_argument("--shard-mode", choices=["none", SHARD_LEVEL, SHARD_HASH], default="none",
+                        help="與 Server 的 DB_SHARD_MODE 相同")
+    parser.add_argument("--buckets", type=int, default=16, help="hash 模式的桶數 (DB_SHARD_BUCKETS)")
+    args = parser.parse_args()
+    view_database(args.db_file, args.level, args.best,
+                  None if args.shard_mode == "none" else args.shard_mode, args.buckets)
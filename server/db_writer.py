@@ -0,0 +1,198 @@
+# 檔案名稱: server/db_writer.py
+import os
+import sys
+import threading
+import time
+
+# 加入專案根目錄，讓直接執行此檔案時也能 import server 底下的模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server.db_segments import seal_active
+from server.log import get_logger
+
+log = get_logger("db")
+
+# --- fsync 策略 (Durability) ---
+# never:    寫入作業系統緩衝區就算完成 (與舊版 open/write/close 相同，不呼叫 fsync)
+# interval: 累積 N 毫秒或 N 筆後才 fsync 一次，完成通知會等到 fsync 之後
+# always:   每一批寫入後都 fsync
+SYNC_NEVER = "never"
+SYNC_INTERVAL = "interval"
+SYNC_ALWAYS = "always"
+SYNC_MODES = (SYNC_NEVER, SYNC_INTERVAL, SYNC_ALWAYS)
+
+
+class WriteTicket:
+    """
+    寫入完成通知 (add_score 的回傳值)
+    呼叫 wait() 會阻塞到這筆紀錄依照 fsync 策略寫入完成為止。
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.error = None
+
+    def _finish(self, error=None):
+        self.error = error
+        self._event.set()
+
+    def done(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout=None) -> bool:
+        """等待寫入完成，成功回傳 True；逾時或寫入失敗回傳 False"""
+        if not self._event.wait(timeout):
+            return False
+        return self.error is None
+
+
+class GroupCommitWriter:
+    """
+    批次寫入器 (Group Commit)
+    所有寫入請求先放進佇列，由專屬的背景執行緒一次把整批 bytes 寫進檔案，
+    檔案在整個生命週期只開啟一次，不再每筆紀錄 open/close。
+    一個寫入器可以同時負責多個檔案 (SteadyHandDB 的所有分片共用一個)：submit() 指定要寫到哪個檔案，
+    檔案在第一次寫入時才開啟，分片再多也只有一個寫入執行緒。
+    若設定 segment_max_bytes，active segment 寫滿後會自動換檔 (見 db_segments.py)。
+    """
+
+    def __init__(self, db_file=None, sync_mode=SYNC_NEVER, sync_interval_ms=50, sync_batch=256,
+                 segment_max_bytes=None):
+        if sync_mode not in SYNC_MODES:
+            raise ValueError(f"Unknown sync mode: {sync_mode} (options: {', '.join(SYNC_MODES)})")
+
+        self.db_file = db_file # submit() 沒有指定檔案時寫到這裡
+        self.sync_mode = sync_mode
+        self.sync_interval = sync_interval_ms / 1000.0
+        self.sync_batch = sync_batch
+        self.segment_max_bytes = segment_max_bytes
+
+        self.cond = threading.Condition()
+        self.pending = []      # [(db_file, data, ticket), ...] 尚未寫入的紀錄
+        self.closing = False
+
+        self.files = {}        # db_file -> 開啟中的檔案 (只有寫入執行緒會使用)
+        if db_file is not None:
+            self.files[db_file] = open(db_file, "ab") # 'ab' = Append Binary
+        self.thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, data: bytes, db_file=None) -> WriteTicket:
+        """把一筆紀錄放進寫入佇列 (不阻塞)；同一個檔案的紀錄依送出的順序寫入"""
+        ticket = WriteTicket()
+        with self.cond:
+            if self.closing:
+                raise RuntimeError("Writer is closed")
+            self.pending.append((db_file or self.db_file, data, ticket))
+            self.cond.notify()
+        return ticket
+
+    def close(self):
+        """寫完佇列中所有紀錄後關閉檔案"""
+        with self.cond:
+            if self.closing:
+                return
+            self.closing = True
+            self.cond.notify()
+        self.thread.join()
+
+    def _file(self, db_file):
+        f = self.files.get(db_file)
+        if f is None:
+            f = self.files[db_file] = open(db_file, "ab")
+        return f
+
+    def _sync(self, db_file, tickets):
+        try:
+            os.fsync(self.files[db_file].fileno())
+        except OSError as e:
+            log.error(f"[DB] Error: fsync failed: {e}")
+            for t in tickets: t._finish(e)
+            return
+        for t in tickets: t._finish()
+
+    def _rollover(self, db_file):
+        """
+        active segment 已滿：關閉、改名為 sealed segment、開新檔
+        開新檔失敗 (例如磁碟滿、開啟的檔案太多) 時不丟出例外：寫入執行緒不能停，
+        這個檔案下一次寫入時會在 _file() 重新開啟，仍然失敗就讓那一批 ticket 直接失敗。
+        """
+        self.files.pop(db_file).close()
+        try:
+            path = seal_active(db_file)
+            log.info(f"[DB] Segment sealed: {path}")
+        except OSError as e:
+            log.error(f"[DB] Error: segment rollover failed: {e}")
+        try:
+            self.files[db_file] = open(db_file, "ab")
+        except OSError as e:
+            log.error(f"[DB] Error: cannot reopen {db_file} after rollover: {e}")
+
+    def _run(self):
+        unsynced = {}          # db_file -> 已寫入但還在等 fsync 的 tickets (interval 模式)
+        unsynced_since = 0.0
+
+        while True:
+            with self.cond:
+                while not self.pending and not self.closing:
+                    if not unsynced:
+                        self.cond.wait()
+                        continue
+                    remaining = unsynced_since + self.sync_interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                batch, self.pending = self.pending, []
+                closing = self.closing
+
+            # 同一個檔案的紀錄合併成一次 write
+            by_file = {}
+            for db_file, data, ticket in batch:
+                datas, tickets = by_file.setdefault(db_file, ([], []))
+                datas.append(data)
+                tickets.append(ticket)
+
+            for db_file, (datas, tickets) in by_file.items():
+                try:
+                    f = self._file(db_file)
+                    f.write(b"".join(datas))
+                    f.flush()
+                except OSError as e:
+                    log.error(f"[DB] Error: write failed: {e}")
+                    for t in tickets: t._finish(e)
+                    continue
+
+                if self.sync_mode == SYNC_NEVER:
+                    for t in tickets: t._finish()
+                elif self.sync_mode == SYNC_ALWAYS:
+                    self._sync(db_file, tickets)
+                else:
+                    if not unsynced:
+                        unsynced_since = time.monotonic()
+                    unsynced.setdefault(db_file, []).extend(tickets)
+
+            if unsynced and (closing
+                             or sum(len(tickets) for tickets in unsynced.values()) >= self.sync_batch
+                             or time.monotonic() - unsynced_since >= self.sync_interval):
+                for db_file, tickets in unsynced.items():
+                    self._sync(db_file, tickets)
+                unsynced = {}
+
+            if self.segment_max_bytes:
+                for db_file in by_file:
+                    f = self.files.get(db_file)
+                    if f is None or f.tell() < self.segment_max_bytes:
+                        continue
+                    # 換檔前先把這個檔案等待中的 fsync 做完 (interval 模式)
+                    tickets = unsynced.pop(db_file, None)
+                    if tickets:
+                        self._sync(db_file, tickets)
+                    self._rollover(db_file)
+
+            if closing:
+                with self.cond:
+                    if self.pending:
+                        continue
+                for f in self.files.values():
+                    f.close()
+                return
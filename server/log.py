@@ -0,0 +1,100 @@
+# 檔案名稱: server/log.py
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+# --- Server 紀錄 ---
+# Server 各模組用 get_logger(名稱) 取得 logger，訊息沿用 "[Server] ..." 的寫法。
+# setup() 之後，寫紀錄只是把 LogRecord 放進佇列 (QueueHandler)，由背景執行緒 (QueueListener) 寫到 stdout：
+# stdout 是 pipe 或很慢的終端機時，event loop 與 DB 執行緒不會卡在 print / stdout 的鎖上。
+# 佇列滿了 (輸出跟不上) 就丟掉紀錄並計數，不讓處理請求的執行緒等待。
+#
+# 每個請求都會產生的紀錄 (新連線、寫入成績、回覆排行榜...) 寫到 access_log：
+# 可以只留下一部分 (sample) 或完全關掉 (quiet)，警告與錯誤不受影響。
+
+ROOT = "steadyhand"
+QUEUE_SIZE = 10000
+
+
+def get_logger(name) -> logging.Logger:
+    return logging.getLogger(f"{ROOT}.{name}")
+
+
+access_log = get_logger("access")
+
+
+class SampleFilter(logging.Filter):
+    """只讓 rate (0~1) 比例的紀錄通過 (隨機抽樣)，WARNING 以上一律保留"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler = None
+_listener = None
+
+
+def setup(level="INFO", sample=1.0, quiet=False, stream=None):
+    """
+    設定 Server 紀錄 (每個行程各自呼叫一次，重複呼叫會換掉舊的設定)
+    - level: 低於此等級的紀錄直接丟棄 ("DEBUG" / "INFO" / "WARNING" / "ERROR")
+    - sample: access_log 只保留這個比例 (1.0 = 全部)
+    - quiet: True 時 access_log 只輸出警告與錯誤
+    """
+    global _handler, _listener
+    shutdown()
+
+    log_queue = queue.Queue(QUEUE_SIZE)
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    _handler = _DroppingQueueHandler(log_queue)
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+
+    root = logging.getLogger(ROOT)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    root.propagate = False
+
+    for f in list(access_log.filters):
+        access_log.removeFilter(f)
+    access_log.setLevel(logging.WARNING if quiet else logging.NOTSET)
+    if sample < 1.0:
+        access_log.addFilter(SampleFilter(sample))
+
+
+def shutdown():
+    """把佇列裡剩下的紀錄寫完，停止背景執行緒"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def dropped() -> int:
+    """因為佇列已滿而丟掉的紀錄數"""
+    return _handler.dropped if _handler is not None else 0
+
+
+atexit.register(shutdown)
@@ -1,19 +1,44 @@
 # 檔案名稱: server/main.py
-import socket
-import threading
-import json
+import asyncio
+import multiprocessing
+import signal
 import sys
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # 嘗試加入專案根目錄，以便 import 其他模組
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from server.db_engine import SteadyHandDB
-from server.protocol import SteadyHandProtocol, CMD_UPLOAD_SCORE, CMD_GET_LEADERBOARD, CMD_ERROR
+from server.db_engine import SteadyHandDB, check_score
+from server.db_index import WINDOW_ALL, SNAPSHOT_DEPTH, bucket_of
+from server.response_cache import ResponseCache
+from server.push_hub import SubscriptionHub
+from server.workers import WorkerDB, writer_main
+from server.replication import ReplicationLog, ReplicationPrimary, ReplicaDB, ReplicaFollower
+from shp.partition import PartitionMap, WRONG_NODE
+from server.metrics import ServerMetrics, RequestTiming, MetricsDumper
+from server.log import get_logger, access_log, setup as setup_logging, dropped as dropped_logs
+from shp.protocol import (SteadyHandProtocol, FrameDecoder, FrameTooLarge, BinaryCodec, CMD_UPLOAD_SCORE, CMD_GET_LEADERBOARD,
+                          CMD_GET_RANK, CMD_GET_AROUND, CMD_GET_LEVEL_STATS, CMD_UPLOAD_BATCH,
+                          CMD_GET_LEADERBOARDS, CMD_SUBSCRIBE, CMD_UNSUBSCRIBE, CMD_PUSH_LEADERBOARD, CMD_ERROR,
+                          CMD_REPLICATE, CMD_REPL_STATUS, CMD_GET_PARTITION_MAP, CMD_STATS,
+                          FLAG_CLOSE, FLAG_BINARY, FLAG_NOT_MODIFIED, MAX_BATCH, max_request_payload)
 
 # [新增] 伺服器端簡易 .env 讀取器 (為了不依賴 steadyhand 套件)
 def load_server_env(filepath=".env"):
-    config = {"HOST": "0.0.0.0", "PORT": "9999"} # 預設值
+    config = {"HOST": "0.0.0.0", "PORT": "9999", # 預設值
+              "DB_SYNC_MODE": "never", "DB_SYNC_INTERVAL_MS": "50", "DB_SYNC_BATCH": "256",
+              "DB_SEGMENT_MB": "64", "DB_COMPACT_INTERVAL": "60", "DB_HISTORY_DAYS": "7",
+              "DB_SHARD_MODE": "none", "DB_SHARD_BUCKETS": "16", "DB_MAX_LEVEL_SHARDS": "256",
+              "RESPONSE_CACHE_SIZE": "1024",
+              "SERVER_BACKLOG": "1024", "MAX_CONNECTIONS": "10000", "DB_WORKERS": "8",
+              "IDLE_TIMEOUT": "60", "MAX_PIPELINE": "32", "PUSH_COALESCE_MS": "100",
+              "READ_TIMEOUT": "10", "MAX_QUEUE": "1024", "MAX_WRITE_BUFFER_KB": "1024",
+              "SERVER_WORKERS": "1", "REPLICA_OF": "", "REPL_LOG_SIZE": "65536",
+              "CLUSTER_NODES": "", "CLUSTER_NODE_ID": "0", "CLUSTER_STATIC": "",
+              "METRICS_FILE": "", "METRICS_INTERVAL": "60",
+              "LOG_LEVEL": "INFO", "LOG_SAMPLE": "1.0", "LOG_QUIET": "False"}
     if os.path.exists(filepath):
         print(f"[Server] Loading config from {filepath}")
         with open(filepath, "r") as f:
@@ -22,9 +47,12 @@ def load_server_env(filepath=".env"):
                 if not line or line.startswith("#"): continue
                 if "=" in line:
                     k, v = line.split("=", 1)
-                    # 我們只關心 PORT，HOST 通常固定 0.0.0.0
-                    if k.strip() == "SERVER_PORT":
+                    k = k.strip()
+                    # 我們只關心 PORT 與 DB 設定，HOST 通常固定 0.0.0.0
+                    if k == "SERVER_PORT":
                         config["PORT"] = v.strip()
+                    elif k in config:
+                        config[k] = v.strip()
     return config
 
 # 載入設定
@@ -32,87 +60,768 @@ env_config = load_server_env()
 HOST = "0.0.0.0" # Server 永遠監聽所有介面
 PORT = int(env_config["PORT"])
 DB_FILE = "steadyhand.db"
+DB_SYNC_MODE = env_config["DB_SYNC_MODE"]
+DB_SYNC_INTERVAL_MS = int(env_config["DB_SYNC_INTERVAL_MS"])
+DB_SYNC_BATCH = int(env_config["DB_SYNC_BATCH"])
+DB_SEGMENT_BYTES = int(float(env_config["DB_SEGMENT_MB"]) * 1024 * 1024)
+DB_COMPACT_INTERVAL = float(env_config["DB_COMPACT_INTERVAL"])
+DB_HISTORY_DAYS = float(env_config["DB_HISTORY_DAYS"])
+DB_SHARD_MODE = None if env_config["DB_SHARD_MODE"].lower() == "none" else env_config["DB_SHARD_MODE"].lower()
+DB_SHARD_BUCKETS = int(env_config["DB_SHARD_BUCKETS"])
+DB_MAX_LEVEL_SHARDS = int(env_config["DB_MAX_LEVEL_SHARDS"]) # level 模式下最多幾個關卡 (每關一個檔案)
+RESPONSE_CACHE_SIZE = int(env_config["RESPONSE_CACHE_SIZE"])
+SERVER_BACKLOG = int(env_config["SERVER_BACKLOG"])      # listen() 的 accept queue 長度
+MAX_CONNECTIONS = int(env_config["MAX_CONNECTIONS"])    # 同時連線上限，超過的直接回覆忙碌
+DB_WORKERS = int(env_config["DB_WORKERS"])              # 執行 DB 操作的執行緒數
+IDLE_TIMEOUT = float(env_config["IDLE_TIMEOUT"])        # 連線閒置幾秒後由 Server 關閉
+MAX_PIPELINE = int(env_config["MAX_PIPELINE"])          # 單一連線同時處理中的請求上限
+PUSH_COALESCE_MS = int(env_config["PUSH_COALESCE_MS"])  # 訂閱推播合併多少毫秒內的寫入
+READ_TIMEOUT = float(env_config["READ_TIMEOUT"])        # 封包開始傳送後必須在幾秒內傳完
+MAX_QUEUE = int(env_config["MAX_QUEUE"])                # 交給執行緒池 (執行中 + 排隊中) 的請求上限，超過就回覆忙碌
+MAX_WRITE_BUFFER = int(env_config["MAX_WRITE_BUFFER_KB"]) * 1024 # 單一連線未送出的回覆上限，超過代表對方不讀取
+SERVER_WORKERS = int(env_config["SERVER_WORKERS"])      # >1 時啟用多行程模式 (SO_REUSEPORT + 單一寫入行程)
+REPLICA_OF = env_config["REPLICA_OF"]                   # "host:port" 時以唯讀 Follower 身分複寫該 Primary
+REPL_LOG_SIZE = int(env_config["REPL_LOG_SIZE"])        # Primary 保留多少筆最近的寫入給 Follower 續傳
+CLUSTER_NODES = env_config["CLUSTER_NODES"]             # "host:port,host:port,..." 時啟用叢集模式 (依關卡分區)
+CLUSTER_NODE_ID = int(env_config["CLUSTER_NODE_ID"])    # 這個節點在 CLUSTER_NODES 中的編號 (從 0 開始)
+CLUSTER_STATIC = env_config["CLUSTER_STATIC"]           # 指定關卡區間的節點，例如 "1-10:0,11-20:1"；其餘用一致性雜湊
+METRICS_FILE = env_config["METRICS_FILE"]               # 非空時定期把指標 (CMD_STATS 的內容) 附加到這個檔案
+METRICS_INTERVAL = float(env_config["METRICS_INTERVAL"]) # 幾秒寫一次
+LOG_LEVEL = env_config["LOG_LEVEL"]                     # DEBUG / INFO / WARNING / ERROR
+LOG_SAMPLE = float(env_config["LOG_SAMPLE"])            # 每個請求都會產生的紀錄只保留這個比例 (0~1)
+LOG_QUIET = env_config["LOG_QUIET"].lower() in ("1", "true", "yes") # 不輸出每個請求的紀錄
+
+log = get_logger("server")
+
+def db_options():
+    """SteadyHandDB 的建構參數 (單行程、寫入行程與 worker 共用)"""
+    return dict(sync_mode=DB_SYNC_MODE, sync_interval_ms=DB_SYNC_INTERVAL_MS, sync_batch=DB_SYNC_BATCH,
+                segment_max_bytes=DB_SEGMENT_BYTES, compact_interval=DB_COMPACT_INTERVAL,
+                history_days=DB_HISTORY_DAYS, shard_mode=DB_SHARD_MODE, shard_buckets=DB_SHARD_BUCKETS,
+                max_level_shards=DB_MAX_LEVEL_SHARDS)
+
+def log_options():
+    """server.log.setup() 的參數 (每個行程各自設定)"""
+    return dict(level=LOG_LEVEL, sample=LOG_SAMPLE, quiet=LOG_QUIET)
+
+# --- 請求參數檢查 ---
+# 格式正確但內容型別不對的請求 (例如 "user": 5) 一律回覆 "Bad payload"，不讓錯誤跑到 DB 裡變成 "Internal error"
+MAX_NAME_CHARS = 64 # 查詢用的玩家名字長度上限 (寫入時只保留前 16 bytes，更長的名字不可能有紀錄)
+
+def check_level(lvl):
+    """關卡必須是 uint32 範圍內的整數 (與 check_score 相同)，回傳 lvl"""
+    if isinstance(lvl, bool) or not isinstance(lvl, int) or not 0 <= lvl <= 0xFFFFFFFF:
+        raise ValueError("Bad payload")
+    return lvl
+
+def check_levels(levels):
+    """關卡列表 (多關查詢、訂閱)：必須是 list，每一項都符合 check_level，回傳 levels"""
+    if not isinstance(levels, list):
+        raise ValueError("Bad payload")
+    for lvl in levels:
+        check_level(lvl)
+    return levels
+
+def check_user(user):
+    """查詢用的玩家名字必須是字串且不超過 MAX_NAME_CHARS 個字，回傳 user"""
+    if not isinstance(user, str) or len(user) > MAX_NAME_CHARS:
+        raise ValueError("Bad payload")
+    return user
+
+def clamped_int(value, lo, hi):
+    """數量類的參數 (limit / k)：必須是數字，超出範圍時夾在 lo ~ hi 之間"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != value: # value != value: NaN
+        raise ValueError("Bad payload")
+    return int(max(lo, min(value, hi)))
+
+class ShpConnection(asyncio.BufferedProtocol):
+    """
+    單一 Client 連線 (跑在 event loop 上，不佔用執行緒)
+    event loop 直接把資料 recv_into 到 FrameDecoder 預先配置的 buffer，每湊滿一個完整的 SHP 封包就交給 Server 處理。
+    連線會一直保持開啟，可以連續送出多個請求 (pipelining)；回覆帶著請求的 REQ_ID，
+    完成順序不一定與請求順序相同。
+    - 同時處理中的請求達到 MAX_PIPELINE，或回覆塞在傳送緩衝區送不出去時暫停讀取，之後再繼續
+    - 閒置超過 IDLE_TIMEOUT 秒 (沒有收到資料、沒有處理中的請求也沒有訂閱) 就關閉連線
+    - 收到帶 FLAG_CLOSE 的請求後不再接受新請求，處理完手上的請求就關閉連線
+    - 資源上限 (對付 slowloris 或不正常的 Client)：
+      封包 PAYLOAD 超過該指令的上限 (max_request_payload) 時回覆 CMD_ERROR 並關閉連線，不替它配置 buffer；
+      封包收到一半後 READ_TIMEOUT 秒內沒收完就關閉連線；
+      未送出的回覆 (例如不讀取的訂閱者) 超過 MAX_WRITE_BUFFER 時直接斷線
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.decoder = FrameDecoder(max_payload=max_request_payload)
+        self.in_flight = 0        # 已收到、尚未回覆的請求數
+        self.paused = False
+        self.closing = False      # 收到 FLAG_CLOSE (或已被拒絕)，不再處理新請求
+        self.rejected = False
+        self.idle_handle = None
+        self.read_handle = None   # 封包收到一半時的 READ_TIMEOUT 計時
+        self.subscriptions = set() # 訂閱中的關卡 (由 SubscriptionHub 維護)
+        self.replicating = False   # 這是 Follower 的複寫連線 (由 ReplicationPrimary 持續送出紀錄)
+        self.writable = asyncio.Event() # 傳送緩衝區未滿 (transport 的 pause_writing / resume_writing)
+        self.writable.set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.server.active_connections >= MAX_CONNECTIONS:
+            # 超過連線上限：回覆錯誤後立刻斷線
+            self.rejected = self.closing = True
+            self.server.metrics.reject("max_connections")
+            transport.write(SteadyHandProtocol.pack_packet(CMD_ERROR, {"status": "error", "msg": "Server busy"}))
+            transport.close()
+            return
+        self.server.active_connections += 1
+        self._reset_idle_timer()
+        access_log.info("[Server] New connection from %s", transport.get_extra_info('peername'))
+
+    def connection_lost(self, exc):
+        self.closing = True
+        self.writable.set() # 叫醒等待 drain() 的 coroutine
+        if self.idle_handle is not None:
+            self.idle_handle.cancel()
+            self.idle_handle = None
+        if self.read_handle is not None:
+            self.read_handle.cancel()
+            self.read_handle = None
+        if not self.rejected:
+            self.server.active_connections -= 1
+            self.server.hub.unsubscribe(self)
+
+    def pause_writing(self):
+        self.writable.clear()
+
+    def resume_writing(self):
+        self.writable.set()
+        if self.paused and self._can_read() and not self.transport.is_closing():
+            self.paused = False
+            self.transport.resume_reading()
+            self._process_buffer()
+
+    async def drain(self):
+        """等到傳送緩衝區有空間 (大量連續送出時使用，例如複寫快照)"""
+        await self.writable.wait()
+
+    def get_buffer(self, sizehint):
+        return self.decoder.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        self.decoder.buffer_updated(nbytes)
+        if self.closing:
+            # 不再處理新請求，也不再讀取 (收到的資料不會一直堆在 buffer 裡)
+            self.transport.pause_reading()
+            return
+        self._reset_idle_timer()
+        self._process_buffer()
+
+    def _can_read(self):
+        return self.in_flight < MAX_PIPELINE and self.writable.is_set()
+
+    def _process_buffer(self):
+        """把 buffer 裡完整的封包一個個取出來處理，並依 buffer 裡是否還有半個封包設定 READ_TIMEOUT"""
+        self._process_frames()
+        if self.decoder.has_partial() and not self.paused and not self.closing:
+            if self.read_handle is None:
+                self.read_handle = asyncio.get_running_loop().call_later(READ_TIMEOUT, self._read_timeout)
+        elif self.read_handle is not None:
+            self.read_handle.cancel()
+            self.read_handle = None
+
+    def _process_frames(self):
+        while not self.closing:
+            if not self._can_read():
+                # 手上請求太多或回覆送不出去 (對方沒在讀)，先停止讀取 socket，之後再繼續
+                if not self.paused:
+                    self.paused = True
+                    self.transport.pause_reading()
+                return
+
+            try:
+                frame = self.decoder.next_frame()
+            except FrameTooLarge as e:
+                # 之後的資料已經無法對齊封包邊界：回覆錯誤，處理完手上的請求就關閉連線
+                log.warning(f"[Server] Rejected oversized request from {self.transport.get_extra_info('peername')}: {e}")
+                self.server.metrics.reject("too_large")
+                self._send(CMD_ERROR, e.request_id, SteadyHandProtocol.encode_payload(
+                    {"status": "error", "msg": f"Payload too large (max {e.limit} bytes)"}))
+                self.closing = True
+                self.transport.pause_reading()
+                self._maybe_close()
+                return
+            if frame is None:
+                return # 封包還沒收完
+            cmd, flags, req_id, body = frame
+            timing = RequestTiming()
+            size_in = SteadyHandProtocol.HEADER_SIZE + len(body)
+
+            if flags & FLAG_CLOSE:
+                self.closing = True
+            binary = bool(flags & FLAG_BINARY)
+
+            try:
+                # body 是指向 decoder buffer 的 view，必須在這裡就解碼完
+                if binary:
+                    payload = BinaryCodec.decode_request(cmd, body)
+                else:
+                    payload = SteadyHandProtocol.decode_payload(body)
+                if not isinstance(payload, dict):
+                    # 合法的 JSON 但不是物件 (例如 list)：所有指令都以 payload.get() 讀取參數，
+                    # 在這裡就擋下，部分指令直接在 event loop 上處理，例外會讓整條連線斷掉
+                    raise ValueError("Payload is not an object")
+            except ValueError: # 包含 JSONDecodeError 與 UnicodeDecodeError
+                # 錯誤一律用 JSON 回覆 (不帶 FLAG_BINARY)，Client 可以據此改用 JSON
+                log.warning("[Server] Payload Decode Error")
+                self.server.metrics.reject("bad_payload")
+                sent = self._send(CMD_ERROR, req_id, SteadyHandProtocol.encode_payload(
+                    {"status": "error", "msg": "Bad payload"}))
+                self.server.metrics.record(cmd, size_in, sent, timing, error=True)
+                self._maybe_close()
+                continue
+
+            # 只動記憶體中資料的指令直接在 event loop 上處理
+            if cmd in (CMD_SUBSCRIBE, CMD_UNSUBSCRIBE):
+                body = self.server.handle_subscription(self, cmd, payload)
+            elif cmd == CMD_GET_PARTITION_MAP:
+                body = SteadyHandProtocol.encode_payload(self.server.partition_info())
+            elif cmd == CMD_REPL_STATUS:
+                body = SteadyHandProtocol.encode_payload({"status": "ok", "data": self.server.replication_status()})
+            elif cmd == CMD_STATS:
+                body = self.server.stats_response(payload)
+            else:
+                body = None
+            if body is not None:
+                timing.mark("encode")
+                self.server.metrics.record(cmd, size_in, self._send(cmd, req_id, body), timing)
+                self._maybe_close()
+                continue
+            if cmd == CMD_REPLICATE:
+                # 之後這條連線只用來串流紀錄給 Follower
+                self.server.start_replication(self, req_id, payload)
+                return
+
+            self.in_flight += 1
+            asyncio.ensure_future(self.respond(cmd, req_id, payload, binary, timing, size_in))
+
+    async def respond(self, cmd, req_id, payload, binary, timing, size_in):
+        try:
+            body = await self.server.handle_request_async(cmd, payload, binary, timing)
+            flags = FLAG_BINARY if binary else 0
+            if body is None:
+                sent = self._send(cmd, req_id, b"", flags | FLAG_NOT_MODIFIED)
+            else:
+                sent = self._send(cmd, req_id, body, flags)
+            self.server.metrics.record(cmd, size_in, sent, timing)
+        except ServerBusy:
+            self.server.metrics.reject("busy")
+            sent = self._send(CMD_ERROR, req_id, SteadyHandProtocol.encode_payload(
+                {"status": "error", "msg": "Server busy"}))
+            self.server.metrics.record(cmd, size_in, sent, timing, error=True)
+        except Exception as e:
+            log.error(f"[Server] Error: {e}")
+            sent = self._send(CMD_ERROR, req_id, SteadyHandProtocol.encode_payload(
+                {"status": "error", "msg": "Internal error"}))
+            self.server.metrics.record(cmd, size_in, sent, timing, error=True)
+        finally:
+            self.in_flight -= 1
+            if not self.transport.is_closing():
+                if self.paused and self._can_read():
+                    self.paused = False
+                    self.transport.resume_reading()
+                    self._process_buffer() # buffer 裡可能還有暫停前收到的封包
+                self._maybe_close()
+                self._reset_idle_timer()
+
+    def push(self, body):
+        """送出 Server 主動推播的封包 (REQ_ID 0)"""
+        self._send(CMD_PUSH_LEADERBOARD, 0, body)
+
+    def _send(self, cmd, req_id, body, flags=0) -> int:
+        """送出一個封包，回傳送出的 bytes 數 (連線已關閉時為 0)"""
+        if self.transport.is_closing():
+            return 0
+        self.transport.write(SteadyHandProtocol.pack_header(cmd, len(body), req_id, flags) + body)
+        if self.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+            # 對方一直不讀取 (回覆與推播越堆越多)，直接斷線
+            log.warning(f"[Server] Dropping slow connection {self.transport.get_extra_info('peername')}")
+            self.server.metrics.reject("slow_client")
+            self.closing = True
+            self.transport.abort()
+        return SteadyHandProtocol.HEADER_SIZE + len(body)
+
+    def _maybe_close(self):
+        # Client 要求關閉：等手上的請求都回覆完再關
+        if self.closing and self.in_flight == 0:
+            self.transport.close()
+
+    def _reset_idle_timer(self):
+        if self.idle_handle is not None:
+            self.idle_handle.cancel()
+        self.idle_handle = asyncio.get_running_loop().call_later(IDLE_TIMEOUT, self._idle_timeout)
+
+    def _read_timeout(self):
+        self.read_handle = None
+        if self.closing or not self.decoder.has_partial():
+            return
+        log.warning(f"[Server] Closing connection {self.transport.get_extra_info('peername')}: "
+                    f"request not completed within {READ_TIMEOUT}s")
+        self.server.metrics.reject("read_timeout")
+        self._send(CMD_ERROR, 0, SteadyHandProtocol.encode_payload({"status": "error", "msg": "Request timeout"}))
+        self.closing = True
+        self.transport.close()
+
+    def _idle_timeout(self):
+        self.idle_handle = None
+        if self.in_flight > 0 or self.subscriptions or self.replicating:
+            # 還有請求在處理 (例如等待寫入)、正在等推播或是複寫連線，不算閒置；之後收到資料會重新計時
+            return
+        access_log.info("[Server] Closing idle connection %s", self.transport.get_extra_info('peername'))
+        self.closing = True
+        self.transport.close()
+
+
+class ServerBusy(Exception):
+    """執行緒池的佇列已滿 (MAX_QUEUE)，請求被拒絕"""
+
 
 class SteadyHandServer:
-    def __init__(self):
-        self.db = SteadyHandDB(DB_FILE)
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server_socket.bind((HOST, PORT))
-        self.server_socket.listen(5)
-        print(f"[Server] Listening on {HOST}:{PORT}")
+    def __init__(self, db=None, worker_id=None):
+        """
+        db: 預設開啟自己的 SteadyHandDB (設定 REPLICA_OF 時是 ReplicaDB)；多行程模式的 worker 傳入 WorkerDB
+        worker_id: 多行程模式下的 worker 編號 (用 SO_REUSEPORT 與其他 worker 共用 port)
+        """
+        self.worker_id = worker_id
+
+        # 複寫: 設定 REPLICA_OF 時是唯讀的 Follower，排行榜由 Primary 串流來的紀錄建立；
+        # 否則自己就是 Primary，在寫入鎖內記下每筆寫入給 Follower 續傳 (多行程模式的 worker 沒有完整的寫入紀錄，不提供複寫)
+        self.follower = None
+        self.replication = None # ReplicationPrimary，event loop 建立後才初始化
+        if db is None and REPLICA_OF:
+            db = ReplicaDB(DB_FILE, **db_options())
+            host, _, port = REPLICA_OF.rpartition(":")
+            self.follower = ReplicaFollower(db, (host, int(port)))
+        elif db is None:
+            db = SteadyHandDB(DB_FILE, **db_options())
+            db.replication_log = ReplicationLog(REPL_LOG_SIZE)
+        self.db = db
+
+        # 叢集模式: 只處理分區表指派給這個節點的關卡
+        self.partition = PartitionMap.parse(CLUSTER_NODES, CLUSTER_STATIC) if CLUSTER_NODES else None
+        self.node_id = CLUSTER_NODE_ID if self.partition is not None else None
+
+        # 排行榜回應快取：某關有新成績時清掉該關所有快取
+        self.response_cache = ResponseCache(RESPONSE_CACHE_SIZE)
+        self.db.add_listener(lambda record: self.response_cache.invalidate_level(record.level))
+
+        # 會阻塞的 DB 操作 (例如等待寫入完成) 交給固定大小的執行緒池，event loop 本身不會被卡住
+        self.executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db-worker")
+        self.active_connections = 0
+        self.queued = 0 # 交給執行緒池、尚未完成的請求數 (只在 event loop 上增減)
+
+        # 指標 (CMD_STATS)，設定 METRICS_FILE 時另外定期寫入檔案
+        self.metrics = ServerMetrics()
+        self.dumper = MetricsDumper(METRICS_FILE, METRICS_INTERVAL, self.stats) if METRICS_FILE else None
+        self.hub = None # 排行榜訂閱，event loop 建立後才初始化
 
     def start(self):
         try:
-            while True:
-                client_sock, addr = self.server_socket.accept()
-                print(f"[Server] New connection from {addr}")
-                client_handler = threading.Thread(
-                    target=self.handle_client,
-                    args=(client_sock,)
-                )
-                client_handler.start()
+            asyncio.run(self.serve())
         except KeyboardInterrupt:
-            print("[Server] Shutting down...")
+            log.info("[Server] Shutting down...")
         finally:
-            self.server_socket.close()
+            if self.follower is not None:
+                self.follower.stop()
+            if self.dumper is not None:
+                self.dumper.stop()
+            self.executor.shutdown(wait=True)
+            self.db.close()
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        self.hub = SubscriptionHub(loop, self.push_payload, PUSH_COALESCE_MS / 1000.0)
+        self.db.add_listener(lambda record: self.hub.notify(record.level))
+        if self.db.replication_log is not None:
+            self.replication = ReplicationPrimary(self.db, self.executor)
+            self.db.add_listener(lambda record: self.replication.notify())
+        if self.follower is not None:
+            self.follower.start()
+        if self.dumper is not None:
+            self.dumper.start()
+
+        server = await loop.create_server(
+            lambda: ShpConnection(self), HOST, PORT,
+            backlog=SERVER_BACKLOG, reuse_address=True, reuse_port=self.worker_id is not None
+        )
+        worker_desc = "" if self.worker_id is None else f"[worker {self.worker_id}, pid {os.getpid()}] "
+        log.info(f"[Server] {worker_desc}Listening on {HOST}:{PORT} (backlog={SERVER_BACKLOG}, "
+                 f"max_connections={MAX_CONNECTIONS}, db_workers={DB_WORKERS}, "
+                 f"idle_timeout={IDLE_TIMEOUT}s, read_timeout={READ_TIMEOUT}s, max_pipeline={MAX_PIPELINE}, "
+                 f"max_queue={MAX_QUEUE})")
+        if self.follower is not None:
+            log.info(f"[Server] Read-only replica of {REPLICA_OF}")
+        if self.partition is not None:
+            log.info(f"[Server] Cluster node {self.node_id} of {len(self.partition.nodes)} ({CLUSTER_NODES})")
+        async with server:
+            await server.serve_forever()
 
-    def recv_all(self, sock, count):
-        buf = b''
-        while len(buf) < count:
+    async def handle_request_async(self, cmd, payload, binary=False, timing=None):
+        """
+        在 event loop 上處理請求：版本沒變或快取命中直接回覆，其他交給執行緒池
+        回傳編碼好的回應 payload；回傳 None 代表「沒有變動」(回覆 FLAG_NOT_MODIFIED 空封包)
+        timing (RequestTiming) 會記下排隊、DB 與編碼各花了多少時間
+        """
+        if cmd == CMD_GET_LEADERBOARD:
             try:
-                newbuf = sock.recv(count - len(buf))
-                if not newbuf: return None
-                buf += newbuf
-            except:
-                return None
-        return buf
-
-    def handle_client(self, conn):
+                self._check_partition(cmd, payload)
+                key = self._leaderboard_key(payload, binary)
+                if "version" in payload and payload["version"] == self.db.get_leaderboard_version(key[0], key[2]):
+                    return None
+                body = self.response_cache.get(key)
+            except (ValueError, TypeError):
+                body = None # 參數有誤，交給 handle_request 回覆錯誤訊息
+            if body is not None:
+                return body
+
+        if self.queued >= MAX_QUEUE:
+            # 執行緒池忙不過來：立刻拒絕，不讓排隊的請求無限制地增加
+            raise ServerBusy()
+        self.queued += 1
         try:
-            while True:
-                header_data = self.recv_all(conn, SteadyHandProtocol.HEADER_SIZE)
-                if not header_data: break
-                
-                cmd, length = SteadyHandProtocol.unpack_header(header_data)
-                body_data = self.recv_all(conn, length)
-                if not body_data: break
-                
-                try:
-                    payload = json.loads(body_data.decode('utf-8'))
-                except json.JSONDecodeError:
-                    print("[Server] JSON Decode Error")
-                    continue
-
-                response_payload = {}
-                
-                if cmd == CMD_UPLOAD_SCORE:
-                    user = payload.get("user", "Unknown")
-                    lvl = payload.get("level", 1)
-                    time_val = payload.get("time", 999.0)
-                    stars = payload.get("stars", 0)
-                    self.db.add_score(user, lvl, time_val, stars)
-                    response_payload = {"status": "ok", "msg": "Score saved"}
-                    print(f"[Server] Saved score for {user}")
-
-                elif cmd == CMD_GET_LEADERBOARD:
-                    lvl = payload.get("level", 1)
-                    top_scores = self.db.get_leaderboard(lvl)
-                    response_payload = {"status": "ok", "data": top_scores}
-                    print(f"[Server] Sent leaderboard for Lv.{lvl}")
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, self.handle_request, cmd, payload, binary, timing)
+        finally:
+            self.queued -= 1
 
-                else:
-                    response_payload = {"status": "error", "msg": "Unknown CMD"}
+    def handle_request(self, cmd, payload, binary=False, timing=None) -> bytes:
+        """
+        處理一個請求，回傳編碼好的回應 payload (Header 由連線依 REQ_ID 另外加上)
+        binary=True 時用 BinaryCodec 編碼 (請求本身也是二進位)，否則用 JSON
+        """
+        if timing is None:
+            timing = RequestTiming()
+        timing.mark("queue")
+        try:
+            self._check_partition(cmd, payload)
+            if cmd == CMD_GET_LEADERBOARD:
+                return self.leaderboard_response(payload, binary, timing)
+            response_payload = self.dispatch(cmd, payload)
+        except (ValueError, TypeError) as e:
+            # 參數錯誤 (例如未知的 window)，回覆錯誤訊息
+            response_payload = {"status": "error", "msg": str(e)}
+        timing.mark("db")
+        timing.error = response_payload["status"] != "ok"
+        if binary:
+            body = BinaryCodec.encode_response(response_payload["status"] == "ok", response_payload.get("msg", ""))
+        else:
+            body = SteadyHandProtocol.encode_payload(response_payload)
+        timing.mark("encode")
+        return body
+
+    def leaderboard_response(self, payload, binary=False, timing=None) -> bytes:
+        """
+        排行榜回應 (走預先編碼的快取)
+        命中時只是一次 dict 查詢；沒命中才查 DB、編碼 (JSON 或二進位)，然後放進快取。
+        快取的是 payload bytes，每個請求的 REQ_ID 不同，Header 在送出時才加上。
+        """
+        key = self._leaderboard_key(payload, binary)
+        lvl, limit, window, _, _ = key
 
-                resp_packet = SteadyHandProtocol.pack_packet(cmd, response_payload)
-                conn.sendall(resp_packet)
-                break 
+        body = self.response_cache.get(key)
+        if body is None:
+            if timing is None:
+                timing = RequestTiming()
+            generation = self.response_cache.generation(lvl)
+            version = self.db.get_leaderboard_version(lvl, window) # 先取版本號再讀內容
+            if binary:
+                # 二進位直接打包索引裡的紀錄，不經過字典與 JSON
+                records = self.db.get_leaderboard_records(lvl, limit, window)
+                timing.mark("db")
+                body = BinaryCodec.encode_response(True, records=records, version=version)
+            else:
+                top_scores = self.db.get_leaderboard(lvl, limit, window)
+                timing.mark("db")
+                body = SteadyHandProtocol.encode_payload({"status": "ok", "version": version, "data": top_scores})
+            timing.mark("encode")
+            self.response_cache.put(key, body, generation)
 
+        access_log.info("[Server] Sent leaderboard for Lv.%s (%s)", lvl, window)
+        return body
+
+    @staticmethod
+    def _leaderboard_key(payload, binary=False):
+        lvl = payload.get("level", 1)
+        window = payload.get("window", WINDOW_ALL)
+        limit = max(1, min(int(payload.get("limit", 5)), SNAPSHOT_DEPTH))
+        # 時間視窗榜把「第幾期」放進 key，換期後舊的快取自然不會再被命中
+        period = 0 if window == WINDOW_ALL else bucket_of(window, time.time())
+        # 同一份排行榜的 JSON 與二進位版本分開快取
+        return (lvl, limit, window, period, binary)
+
+    def handle_subscription(self, conn, cmd, payload) -> bytes:
+        """(event loop) 訂閱 / 取消訂閱，回覆目前訂閱中的關卡"""
+        try:
+            levels = payload.get("levels", [] if cmd == CMD_SUBSCRIBE else None)
+            # 關卡必須是整數列表 (取消訂閱時 None = 全部)：這裡跑在 event loop 上，
+            # 其他型別會讓推播與分區檢查在之後才出錯
+            if levels is not None:
+                check_levels(levels)
+            if cmd == CMD_SUBSCRIBE:
+                self._check_partition(cmd, payload)
+                if len(conn.subscriptions | set(levels)) > MAX_BATCH:
+                    raise ValueError(f"Too many subscriptions (max {MAX_BATCH})")
+                limit = clamped_int(payload.get("limit", 5), 1, SNAPSHOT_DEPTH)
+                self.hub.subscribe(conn, levels, limit)
+            else:
+                self.hub.unsubscribe(conn, levels)
+            response_payload = {"status": "ok", "levels": sorted(conn.subscriptions)}
+        except (ValueError, TypeError) as e:
+            response_payload = {"status": "error", "msg": str(e)}
+        return SteadyHandProtocol.encode_payload(response_payload)
+
+    def _check_partition(self, cmd, payload):
+        """(叢集模式) 請求涉及的關卡都必須屬於這個節點，否則丟出 ValueError (Client 收到後會重新取得分區表)"""
+        if self.partition is None:
+            return
+        if cmd == CMD_UPLOAD_BATCH:
+            scores = payload.get("scores", [])
+            if not isinstance(scores, list) or not all(isinstance(s, dict) for s in scores):
+                raise ValueError("Bad payload")
+            levels = check_levels([s.get("level", 1) for s in scores])
+        elif cmd in (CMD_GET_LEADERBOARDS, CMD_SUBSCRIBE):
+            levels = check_levels(payload.get("levels", []))
+        elif cmd in (CMD_UPLOAD_SCORE, CMD_GET_LEADERBOARD, CMD_GET_RANK, CMD_GET_AROUND, CMD_GET_LEVEL_STATS):
+            levels = [check_level(payload.get("level", 1))]
+        else:
+            return
+        for lvl in levels:
+            owner = self.partition.owner(lvl)
+            if owner != self.node_id:
+                raise ValueError(f"{WRONG_NODE}: level {lvl} belongs to node {owner}")
+
+    def partition_info(self) -> dict:
+        """分區表 (非叢集模式時 node 與 map 都是 None，Client 照舊把所有請求送到同一台 Server)"""
+        if self.partition is None:
+            return {"status": "ok", "node": None, "map": None}
+        return {"status": "ok", "node": self.node_id, "map": self.partition.to_dict()}
+
+    def start_replication(self, conn, req_id, payload):
+        """(event loop) Follower 要求複寫：之後這條連線持續收到 CMD_REPL_RECORDS"""
+        if self.replication is None:
+            conn._send(CMD_ERROR, req_id, SteadyHandProtocol.encode_payload(
+                {"status": "error", "msg": "Replication not available on this server"}))
+            conn.closing = True
+            conn._maybe_close()
+            return
+        conn.replicating = True
+        conn.closing = True # 不再處理這條連線送來的其他請求
+        asyncio.ensure_future(self._replicate(conn, req_id, payload))
+
+    async def _replicate(self, conn, req_id, payload):
+        try:
+            await self.replication.stream(conn, req_id, str(payload.get("epoch", "")), int(payload.get("lsn", 0)))
         except Exception as e:
-            print(f"[Server] Error: {e}")
+            log.error(f"[Replication] Error: {e}")
         finally:
-            conn.close()
+            conn.transport.close()
+
+    def replication_status(self) -> dict:
+        """(event loop) 複寫狀態：Primary 回報每個 Follower 送到哪裡，Follower 回報落後多少"""
+        if self.follower is not None:
+            return self.follower.status()
+        if self.replication is not None:
+            return self.replication.status()
+        return {"role": "none"}
+
+    def stats(self) -> dict:
+        """目前的指標 (多行程模式下只包含這個 worker 自己的數字)"""
+        return {
+            "worker": self.worker_id,
+            "pid": os.getpid(),
+            "connections": self.active_connections,
+            "queued": self.queued,
+            "log_dropped": dropped_logs(),
+            **self.metrics.snapshot(),
+            "response_cache": {"entries": len(self.response_cache.entries),
+                               "hits": self.response_cache.hits, "misses": self.response_cache.misses},
+            "db": self.db.metrics.snapshot(),
+        }
+
+    def stats_response(self, payload) -> bytes:
+        """(event loop) CMD_STATS：回傳目前的指標，reset=True 時回傳後歸零 (方便比較調整前後)"""
+        data = self.stats()
+        if payload.get("reset"):
+            self.metrics.reset()
+            self.db.metrics.reset()
+            log.info("[Server] Metrics reset")
+        return SteadyHandProtocol.encode_payload({"status": "ok", "data": data})
+
+    def push_payload(self, level_id, limit):
+        """推播內容: 回傳 (前 limit 名, 編碼好的 payload)，只讀快照不需要鎖"""
+        version = self.db.get_leaderboard_version(level_id) # 先取版本號再讀內容
+        rows = self.db.get_leaderboard(level_id, limit)
+        return rows, SteadyHandProtocol.encode_payload({"level": level_id, "version": version, "data": rows})
+
+    @staticmethod
+    def _unconfirmed_upload(tickets, user, failed_msg):
+        """
+        上傳的 ticket 沒有在時限內全部成功時的回覆
+        - 有 ticket 寫入失敗: 回覆錯誤 failed_msg (Client 之後重送)
+        - 只是還沒寫完 (逾時): 紀錄已經在排行榜上，寫入器之後仍會寫進檔案，
+          回覆成功但標明 durable=False；若回覆失敗，Client 重送就會多出一筆重複的嘗試
+        """
+        if any(t.done() and t.error is not None for t in tickets):
+            log.warning(f"[Server] Failed to save score for {user}")
+            return {"status": "error", "msg": failed_msg}
+        log.warning(f"[Server] Score for {user} accepted, durability pending (write not confirmed in time)")
+        return {"status": "ok", "msg": "Score accepted, durability pending", "durable": False}
+
+    def dispatch(self, cmd, payload):
+        """依指令處理請求，回傳要送回 Client 的 payload (dict)"""
+        if cmd == CMD_UPLOAD_SCORE:
+            user = payload.get("user", "Unknown")
+            lvl = payload.get("level", 1)
+            time_val = payload.get("time", 999.0)
+            stars = payload.get("stars", 0)
+            # 不合法的欄位 (例如 NaN 秒數) 在這裡就回覆 "Bad payload"，不會送到 DB (或寫入行程)
+            if not isinstance(user, str):
+                raise ValueError("Bad payload")
+            check_score(lvl, time_val, stars)
+            ticket = self.db.add_score(user, lvl, time_val, stars)
+            # 等到紀錄依 fsync 策略寫入完成才回覆成功
+            if ticket.wait(timeout=5.0):
+                access_log.info("[Server] Saved score for %s", user)
+                return {"status": "ok", "msg": "Score saved"}
+            return self._unconfirmed_upload([ticket], user, "Score not saved")
+
+        elif cmd == CMD_UPLOAD_BATCH:
+            user = payload.get("user", "Unknown")
+            scores = payload.get("scores", [])
+            if not isinstance(user, str) or not isinstance(scores, list) \
+                    or not all(isinstance(s, dict) for s in scores):
+                raise ValueError("Bad payload")
+            if len(scores) > MAX_BATCH:
+                raise ValueError(f"Too many scores in one batch (max {MAX_BATCH})")
+            rows = [(s.get("level", 1), s.get("time", 999.0), s.get("stars", 0)) for s in scores]
+            for row in rows:
+                check_score(*row)
+            tickets = self.db.add_scores(user, rows)
+            # 每個分片一張 ticket，全部寫入完成才回覆成功
+            deadline = time.monotonic() + 5.0
+            if all(t.wait(timeout=max(0.0, deadline - time.monotonic())) for t in tickets):
+                access_log.info("[Server] Saved %d scores for %s", len(rows), user)
+                return {"status": "ok", "msg": "Scores saved", "saved": len(rows)}
+            response = self._unconfirmed_upload(tickets, user, "Scores not saved")
+            if response["status"] == "ok":
+                response["saved"] = len(rows)
+            return response
+
+        elif cmd == CMD_GET_LEADERBOARDS:
+            levels = check_levels(payload.get("levels", []))
+            if len(levels) > MAX_BATCH:
+                raise ValueError(f"Too many levels in one request (max {MAX_BATCH})")
+            window = payload.get("window", WINDOW_ALL)
+            limit = clamped_int(payload.get("limit", 5), 1, SNAPSHOT_DEPTH)
+            known = payload.get("versions", {})
+            # { "level_id": 版本號 }：Client 看過的版本
+            if not isinstance(known, dict) or not all(
+                    isinstance(v, int) and not isinstance(v, bool) for v in known.values()):
+                raise ValueError("Bad payload")
+            # 先取版本號再讀內容；Client 手上已是最新版本的關卡不回傳內容
+            # (JSON 物件的 key 只能是字串)
+            versions = {str(lvl): self.db.get_leaderboard_version(lvl, window) for lvl in levels}
+            changed = [lvl for lvl in levels if known.get(str(lvl)) != versions[str(lvl)]]
+            boards = self.db.get_leaderboards(changed, limit, window)
+            access_log.info("[Server] Sent %d/%d leaderboards (%s)", len(boards), len(levels), window)
+            return {"status": "ok", "versions": versions,
+                    "data": {str(lvl): rows for lvl, rows in boards.items()}}
+
+        elif cmd == CMD_GET_RANK:
+            lvl = check_level(payload.get("level", 1))
+            user = check_user(payload.get("user", "Unknown"))
+            window = payload.get("window", WINDOW_ALL)
+            # 沒有紀錄時 data 為 None
+            return {"status": "ok", "data": self.db.get_rank(lvl, user, window)}
+
+        elif cmd == CMD_GET_AROUND:
+            lvl = check_level(payload.get("level", 1))
+            user = check_user(payload.get("user", "Unknown"))
+            k = clamped_int(payload.get("k", 5), 0, 50)
+            window = payload.get("window", WINDOW_ALL)
+            return {"status": "ok", "data": self.db.get_around(lvl, user, k, window)}
+
+        elif cmd == CMD_GET_LEVEL_STATS:
+            lvl = check_level(payload.get("level", 1))
+            user = payload.get("user")
+            if user is not None:
+                check_user(user)
+            return {"status": "ok", "data": self.db.get_stats(lvl, user)}
+
+        return {"status": "error", "msg": "Unknown CMD"}
+
+
+def run_worker(worker_id, requests, inbox, loaded):
+    """多行程模式: worker 行程的進入點"""
+    # 關閉由主行程統一處理: 忽略 Ctrl+C，收到 SIGTERM 時與單行程模式按 Ctrl+C 一樣正常結束
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+    setup_logging(**log_options())
+    db = WorkerDB(worker_id, requests, inbox, DB_FILE, **db_options())
+    # 等所有 worker 都建好索引才開始接受連線，避免有 worker 在掃描檔案時收到同一筆紀錄的廣播
+    loaded.wait()
+    SteadyHandServer(db, worker_id).start()
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def start_multiprocess(workers):
+    """
+    多行程模式: 一個寫入行程 + workers 個 worker 行程 (各自 accept 同一個 port)
+    讀取吞吐量隨 CPU 核心數增加；所有寫入仍由寫入行程依序處理。
+    """
+    ctx = multiprocessing.get_context("spawn")
+    requests = ctx.Queue()
+    inboxes = [ctx.Queue() for _ in range(workers)]
+    writer_ready = ctx.Event()
+    loaded = ctx.Barrier(workers)
+
+    writer = ctx.Process(target=writer_main, args=(DB_FILE, db_options(), requests, inboxes, writer_ready, log_options()),
+                         name="shp-writer")
+    writer.start()
+    # 寫入行程先完成初始化 (建立檔案與分片目錄)，worker 才開始掃描
+    while not writer_ready.wait(0.5):
+        if not writer.is_alive():
+            log.error("[Server] DB writer process failed to start")
+            return
+
+    procs = [ctx.Process(target=run_worker, args=(i, requests, inboxes[i], loaded), name=f"shp-worker-{i}")
+             for i in range(workers)]
+    for proc in procs:
+        proc.start()
+    log.info(f"[Server] Started {workers} workers + 1 DB writer process")
+
+    try:
+        for proc in procs:
+            proc.join()
+    except KeyboardInterrupt:
+        log.info("[Server] Shutting down workers...")
+    finally:
+        # 先停 worker (處理完手上的請求)，再讓寫入行程把剩下的寫入做完後關閉
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+        for proc in procs:
+            proc.join()
+        requests.put(None)
+        writer.join()
+
 
 if __name__ == "__main__":
-    server = SteadyHandServer()
-    server.start()
\ No newline at end of file
+    setup_logging(**log_options())
+    if SERVER_WORKERS > 1 and not REPLICA_OF:
+        start_multiprocess(SERVER_WORKERS)
+    else:
+        server = SteadyHandServer()
+        server.start()
\ No newline at end of file
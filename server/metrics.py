@@ -0,0 +1,292 @@
+# 檔案名稱: server/metrics.py
+import bisect
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+# 加入專案根目錄，讓直接執行此檔案時也能 import server 底下的模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server.log import get_logger
+from shp.protocol import SteadyHandProtocol, FrameDecoder, CMD_STATS, COMMAND_NAMES
+
+# --- Server 指標 ---
+# 每種指令的請求數、錯誤數、收送 bytes 與延遲直方圖 (分成 queue / db / encode / total 四段)，
+# 加上 DB 的掃描筆數與寫入鎖等待時間。透過 CMD_STATS 查詢，也可以定期附加到檔案 (一行一份 JSON)，
+# 調整設定前後各取一次就能比較。
+# 用法: python server/metrics.py [host=127.0.0.1] [port=9999] [--reset]
+
+log = get_logger("metrics")
+
+
+class LatencyHistogram:
+    """
+    延遲直方圖 (固定的對數刻度格子，記錄 O(log 格數)，不保留每個樣本)
+    分位數以「落在哪一格」估計，回報該格的上界。本身不加鎖，由使用者負責同步。
+    """
+
+    # 各格上界 (秒)，最後再多一格代表超過 10 秒
+    BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+              0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other: "LatencyHistogram"):
+        """加上另一個直方圖的樣本"""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        if other.max > self.max:
+            self.max = other.max
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return self.BOUNDS[i] if i < len(self.BOUNDS) else self.max
+        return self.max
+
+    def to_dict(self) -> dict:
+        ms = lambda s: round(s * 1000.0, 3)
+        buckets = {f"<={ms(b)}ms": n for b, n in zip(self.BOUNDS, self.counts) if n}
+        if self.counts[-1]:
+            buckets[f">{ms(self.BOUNDS[-1])}ms"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "mean_ms": ms(self.total / self.count) if self.count else 0.0,
+            "max_ms": ms(self.max),
+            "p50_ms": ms(self.quantile(0.50)),
+            "p90_ms": ms(self.quantile(0.90)),
+            "p99_ms": ms(self.quantile(0.99)),
+            "buckets": buckets,
+        }
+
+
+class RequestTiming:
+    """
+    一個請求各階段花的時間 (秒)，由處理請求的程式呼叫 mark(階段) 累計「距離上一次 mark 的時間」
+    - queue:  收到封包後，到執行緒池開始處理前 (排隊)
+    - db:     查詢 / 寫入資料庫 (含等待寫入完成)
+    - encode: 把回應編碼成 JSON 或二進位
+    """
+    __slots__ = ("start", "last", "queue", "db", "encode", "error")
+
+    def __init__(self):
+        self.start = self.last = time.perf_counter()
+        self.queue = self.db = self.encode = 0.0
+        self.error = False
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        setattr(self, stage, getattr(self, stage) + now - self.last)
+        self.last = now
+
+
+class _CommandMetrics:
+    __slots__ = ("requests", "errors", "bytes_in", "bytes_out", "queue", "db", "encode", "total")
+
+    def __init__(self):
+        self.requests = self.errors = self.bytes_in = self.bytes_out = 0
+        self.queue = LatencyHistogram()
+        self.db = LatencyHistogram()
+        self.encode = LatencyHistogram()
+        self.total = LatencyHistogram()
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests, "errors": self.errors,
+            "bytes_in": self.bytes_in, "bytes_out": self.bytes_out,
+            "latency": {"queue": self.queue.to_dict(), "db": self.db.to_dict(),
+                        "encode": self.encode.to_dict(), "total": self.total.to_dict()},
+        }
+
+
+class ServerMetrics:
+    """每種指令的計數與延遲，以及被拒絕的請求 / 連線 (event loop 與執行緒池都會寫入，用一把鎖保護)"""
+
+    REJECT_REASONS = ("busy", "too_large", "read_timeout", "slow_client", "bad_payload", "max_connections")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._clear()
+
+    def reset(self):
+        with self.lock:
+            self._clear()
+
+    def _clear(self):
+        self.since = time.time()
+        self.commands = {}   # cmd_id -> _CommandMetrics
+        self.rejected = dict.fromkeys(self.REJECT_REASONS, 0)
+
+    def record(self, cmd, bytes_in, bytes_out, timing: RequestTiming, error=False):
+        total = time.perf_counter() - timing.start
+        with self.lock:
+            m = self.commands.get(cmd)
+            if m is None:
+                m = self.commands[cmd] = _CommandMetrics()
+            m.requests += 1
+            if error or timing.error:
+                m.errors += 1
+            m.bytes_in += bytes_in
+            m.bytes_out += bytes_out
+            m.queue.record(timing.queue)
+            m.db.record(timing.db)
+            m.encode.record(timing.encode)
+            m.total.record(total)
+
+    def reject(self, reason):
+        with self.lock:
+            self.rejected[reason] += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "since": self.since,
+                "seconds": round(time.time() - self.since, 3),
+                "commands": {COMMAND_NAMES.get(cmd, str(cmd)): m.to_dict() for cmd, m in sorted(self.commands.items())},
+                "rejected": dict(self.rejected),
+            }
+
+
+class _DBThreadMetrics:
+    """單一執行緒自己的查詢計數 (只有該執行緒會寫入，不需要鎖)"""
+    __slots__ = ("generation", "rows_read", "lock_wait")
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.rows_read = 0
+        self.lock_wait = LatencyHistogram()
+
+
+class DBMetrics:
+    """
+    SteadyHandDB 的指標
+    - scanned: 啟動時掃描檔案建立索引的筆數與耗時
+    - rows_read: 查詢讀出的紀錄筆數 (排行榜、名次、前後名次)
+    - lock_wait: 等待分片寫入鎖的時間
+    rows_read / lock_wait 在每次查詢與寫入時都會更新：每個執行緒各自累計在自己的計數器 (threading.local)，
+    snapshot() 時才合併，不會讓不同分片的寫入、或無鎖的快照讀取又去搶同一把鎖。
+    reset() 只換掉世代編號，各執行緒下次記錄時發現世代不同就換一份新的計數器。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock() # 只保護 scanned 與計數器清單 (新執行緒第一次記錄、snapshot、reset)
+        self.scanned = 0
+        self.scan_seconds = 0.0
+        self._local = threading.local()
+        self._generation = 0
+        self._threads = []   # 這一代所有執行緒的 _DBThreadMetrics
+
+    def reset(self):
+        """清除查詢相關的計數 (啟動掃描的結果保留)"""
+        with self.lock:
+            self._generation += 1
+            self._threads = []
+
+    def _mine(self) -> _DBThreadMetrics:
+        mine = getattr(self._local, "metrics", None)
+        if mine is None or mine.generation != self._generation:
+            with self.lock:
+                mine = self._local.metrics = _DBThreadMetrics(self._generation)
+                self._threads.append(mine)
+        return mine
+
+    def record_scan(self, records, seconds):
+        with self.lock:
+            self.scanned += records
+            self.scan_seconds += seconds
+
+    def record_rows(self, rows):
+        self._mine().rows_read += rows
+
+    def record_lock_wait(self, seconds):
+        self._mine().lock_wait.record(seconds)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            threads = list(self._threads)
+            scanned, scan_seconds = self.scanned, self.scan_seconds
+        # 其他執行緒可能正在更新自己的計數器，合併出的數字可能少算最後幾筆，不影響趨勢
+        lock_wait = LatencyHistogram()
+        for t in threads:
+            lock_wait.merge(t.lock_wait)
+        return {
+            "scanned": scanned,
+            "scan_ms": round(scan_seconds * 1000.0, 3),
+            "rows_read": sum(t.rows_read for t in threads),
+            "lock_wait": lock_wait.to_dict(),
+        }
+
+
+class MetricsDumper:
+    """背景執行緒：每 interval 秒把 collect() 的結果 (加上時間) 以一行 JSON 附加到 path"""
+
+    def __init__(self, path, interval, collect):
+        self.path = path
+        self.interval = interval
+        self.collect = collect
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="metrics-dump", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.dump() # 關閉前再留一份最終的數字
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.dump()
+
+    def dump(self):
+        try:
+            line = json.dumps({"time": time.time(), **self.collect()})
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except Exception as e:
+            log.error(f"[Metrics] Dump failed: {e}")
+
+
+def fetch_stats(host="127.0.0.1", port=9999, reset=False, timeout=3.0) -> dict:
+    """向 Server 送出 CMD_STATS，回傳 data 欄位"""
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        payload = SteadyHandProtocol.encode_payload({"reset": True} if reset else {})
+        sock.sendall(SteadyHandProtocol.pack_header(CMD_STATS, len(payload), 1) + payload)
+        decoder = FrameDecoder()
+        while True:
+            frame = decoder.next_frame()
+            if frame is not None:
+                response = SteadyHandProtocol.decode_payload(frame[3])
+                if response.get("status") != "ok":
+                    raise RuntimeError(response.get("msg", "Stats request failed"))
+                return response["data"]
+            if decoder.recv_from(sock) == 0:
+                raise ConnectionError("Server closed the connection")
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if a != "--reset"]
+    stats = fetch_stats(args[0] if args else "127.0.0.1", int(args[1]) if len(args) > 1 else 9999,
+                        reset="--reset" in sys.argv)
+    print(json.dumps(stats, indent=2))
@@ -0,0 +1,73 @@
+# 檔案名稱: server/push_hub.py
+
+
+class SubscriptionHub:
+    """
+    排行榜訂閱與推播 (所有方法都在 event loop 執行緒上呼叫，只有 notify() 可以從任何執行緒呼叫)
+    - subscribers: { level_id: { conn: limit } }，conn 需提供 push(body: bytes)
+    - 有新成績時 notify(level_id) 只把該關標記為 dirty，coalesce 秒後一次處理：
+      同一段時間內的多筆寫入只會推播一次，而且只有前 limit 名真的變了才推播
+    - 推播內容由 encode(level_id, limit) 產生，回傳 (records, body)；
+      records 用來和上次推播的內容比較，body 是要送出的 payload
+    """
+
+    def __init__(self, loop, encode, coalesce=0.1):
+        self.loop = loop
+        self.encode = encode
+        self.coalesce = coalesce
+        self.subscribers = {}
+        self.last_sent = {}        # (level_id, limit) -> records，上次推播的前 limit 名
+        self.dirty = set()
+        self.flush_handle = None
+
+    def subscribe(self, conn, level_ids, limit):
+        """訂閱關卡，並立刻推送一次目前的排行榜"""
+        for level_id in level_ids:
+            self.subscribers.setdefault(level_id, {})[conn] = limit
+            conn.subscriptions.add(level_id)
+            records, body = self.encode(level_id, limit)
+            self.last_sent.setdefault((level_id, limit), records)
+            conn.push(body)
+
+    def unsubscribe(self, conn, level_ids=None):
+        """取消訂閱 (level_ids 為 None 時取消這條連線的所有訂閱)"""
+        for level_id in list(conn.subscriptions if level_ids is None else level_ids):
+            conn.subscriptions.discard(level_id)
+            conns = self.subscribers.get(level_id)
+            if conns is None:
+                continue
+            conns.pop(conn, None)
+            if not conns:
+                del self.subscribers[level_id]
+                for key in [k for k in self.last_sent if k[0] == level_id]:
+                    del self.last_sent[key]
+
+    def notify(self, level_id):
+        """(任何執行緒) 某關有新成績"""
+        self.loop.call_soon_threadsafe(self._mark_dirty, level_id)
+
+    def _mark_dirty(self, level_id):
+        if level_id not in self.subscribers:
+            return
+        self.dirty.add(level_id)
+        if self.flush_handle is None:
+            self.flush_handle = self.loop.call_later(self.coalesce, self._flush)
+
+    def _flush(self):
+        self.flush_handle = None
+        dirty, self.dirty = self.dirty, set()
+        for level_id in dirty:
+            conns = self.subscribers.get(level_id)
+            if not conns:
+                continue
+            # 依訂閱的名次數分組，同一種內容只編碼一次
+            by_limit = {}
+            for conn, limit in conns.items():
+                by_limit.setdefault(limit, []).append(conn)
+            for limit, targets in by_limit.items():
+                records, body = self.encode(level_id, limit)
+                if self.last_sent.get((level_id, limit)) == records:
+                    continue # 前 limit 名沒有變化
+                self.last_sent[(level_id, limit)] = records
+                for conn in targets:
+                    conn.push(body)
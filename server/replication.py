@@ -0,0 +1,361 @@
+# 檔案名稱: server/replication.py
+import asyncio
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+# 加入專案根目錄，讓直接執行此檔案時也能 import server 底下的模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server.db_compactor import decode_carried, encode_carried
+from server.db_engine import SteadyHandDB, shard_key
+from server.db_index import LeaderboardIndex, LevelStats, ScoreRecord
+from server.db_scan import RECORD_FORMAT, RECORD_SIZE
+from server.log import get_logger, access_log
+from shp.protocol import (SteadyHandProtocol, FrameDecoder, ReplicationCodec, CMD_REPLICATE, CMD_REPL_RECORDS,
+                          CMD_ERROR, FLAG_BINARY)
+
+# --- 複寫 (Log Shipping) ---
+# .db 本來就是只會追加的固定長度紀錄，Primary 把每次寫入的原始 bytes 依序編號 (LSN，從 1 開始) 後串流給 Follower。
+# - epoch: Primary 每次啟動時隨機產生，LSN 只在同一個 epoch 內有意義
+# - Primary 在記憶體保留最近 capacity 筆紀錄 (ring buffer)。Follower 重新連線時若 epoch 相同且缺少的紀錄還在
+#   ring 內，只補送缺少的部分；否則先送一份完整快照 (SteadyHandDB.replication_snapshot) 再接著串流
+# - Follower 只維護記憶體中的索引 (唯讀副本)，不寫本機檔案；重啟後會重新取得快照
+# - 串流閒置時 Primary 每 HEARTBEAT_SEC 秒送一次心跳，Follower 超過 FOLLOWER_TIMEOUT_SEC 秒沒收到任何資料就重新連線
+
+HEARTBEAT_SEC = 1.0
+FOLLOWER_TIMEOUT_SEC = 5.0
+LIVE_BATCH = 1024          # 每個 REPL_LIVE 封包最多幾筆紀錄
+SNAPSHOT_CHUNK = 4096      # 每個 REPL_SNAPSHOT 封包最多幾筆紀錄
+
+log = get_logger("replication")
+
+
+class ReplicationLog:
+    """
+    Primary 端的寫入紀錄 (由 SteadyHandDB 在寫入鎖內呼叫 append，見 db_engine.replication_log)
+    只保留最近 capacity 筆，更舊的 Follower 要改拿快照。
+    """
+
+    def __init__(self, capacity=65536):
+        self.epoch = os.urandom(8).hex()
+        self.capacity = capacity
+        self.lsn = 0                     # 最後一筆紀錄的序號
+        self.ring = [None] * capacity    # 序號 k 的紀錄放在 ring[(k - 1) % capacity]
+        self.lock = threading.Lock()
+
+    def append(self, data: bytes):
+        """記下一次寫入 (一筆或同一個分片的多筆紀錄)"""
+        with self.lock:
+            for offset in range(0, len(data), RECORD_SIZE):
+                self.ring[self.lsn % self.capacity] = data[offset:offset + RECORD_SIZE]
+                self.lsn += 1
+
+    def covers(self, lsn) -> bool:
+        """序號 lsn 之後的紀錄是否都還在 ring 內"""
+        with self.lock:
+            return max(0, self.lsn - self.capacity) <= lsn <= self.lsn
+
+    def read_from(self, lsn, limit=LIVE_BATCH):
+        """
+        讀取序號 lsn 之後最多 limit 筆紀錄，回傳 (最後一筆的序號, 原始 bytes)
+        需要的紀錄已經被覆蓋 (或 lsn 不屬於這個 epoch) 時回傳 None
+        """
+        with self.lock:
+            if not max(0, self.lsn - self.capacity) <= lsn <= self.lsn:
+                return None
+            end = min(self.lsn, lsn + limit)
+            return end, b"".join(self.ring[i % self.capacity] for i in range(lsn, end))
+
+
+class ReplicationPrimary:
+    """
+    (event loop) 把 ReplicationLog 串流給連上來的 Follower
+    每個 Follower 一個 coroutine：先視需要送快照，之後有新紀錄就送，閒置時送心跳。
+    """
+
+    def __init__(self, db, executor):
+        self.db = db
+        self.log = db.replication_log
+        self.executor = executor
+        self.loop = asyncio.get_running_loop()
+        self.followers = {}   # conn -> {"addr", "lsn"}，目前送到哪一筆
+        self.wakeups = {}     # conn -> asyncio.Event，有新紀錄時叫醒
+
+    def notify(self):
+        """(任何執行緒) 有新紀錄寫入"""
+        if self.wakeups:
+            self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        for event in self.wakeups.values():
+            event.set()
+
+    def status(self) -> dict:
+        return {
+            "role": "primary",
+            "epoch": self.log.epoch,
+            "lsn": self.log.lsn,
+            "followers": [{"addr": f["addr"], "lsn": f["lsn"], "lag_records": self.log.lsn - f["lsn"]}
+                          for f in self.followers.values()],
+        }
+
+    async def stream(self, conn, req_id, epoch, lsn):
+        """對一個 Follower 連線持續串流，直到連線關閉"""
+        addr = str(conn.transport.get_extra_info('peername'))
+        snapshot = epoch != self.log.epoch or not self.log.covers(lsn)
+        conn._send(CMD_REPLICATE, req_id, SteadyHandProtocol.encode_payload(
+            {"status": "ok", "epoch": self.log.epoch, "lsn": lsn, "snapshot": snapshot}))
+        access_log.info("[Replication] Follower %s connected (lsn %s, %s)", addr, lsn, "snapshot" if snapshot else "resume")
+
+        state = self.followers[conn] = {"addr": addr, "lsn": lsn}
+        wakeup = self.wakeups[conn] = asyncio.Event()
+        try:
+            if snapshot:
+                lsn = state["lsn"] = await self._send_snapshot(conn, req_id, addr)
+            while not conn.transport.is_closing():
+                wakeup.clear() # 先清除再讀，讀完之後才寫入的紀錄會再叫醒一次
+                found = self.log.read_from(lsn)
+                if found is None:
+                    # Follower 太慢，需要的紀錄已經被 ring buffer 覆蓋
+                    lsn = state["lsn"] = await self._send_snapshot(conn, req_id, addr)
+                    continue
+                end, data = found
+                if data:
+                    conn._send(CMD_REPL_RECORDS, req_id,
+                               ReplicationCodec.encode(ReplicationCodec.REPL_LIVE, end, self.log.lsn, data),
+                               FLAG_BINARY)
+                    lsn = state["lsn"] = end
+                    await conn.drain()
+                    continue
+                try:
+                    await asyncio.wait_for(wakeup.wait(), HEARTBEAT_SEC)
+                except asyncio.TimeoutError:
+                    conn._send(CMD_REPL_RECORDS, req_id,
+                               ReplicationCodec.encode(ReplicationCodec.REPL_LIVE, lsn, self.log.lsn), FLAG_BINARY)
+        finally:
+            del self.followers[conn]
+            del self.wakeups[conn]
+            access_log.info("[Replication] Follower %s disconnected (sent up to lsn %s)", addr, state["lsn"])
+
+    async def _send_snapshot(self, conn, req_id, addr):
+        """送出完整快照，回傳快照涵蓋到的序號"""
+        lsn, shard_views, carried = await self.loop.run_in_executor(self.executor, self.db.replication_snapshot)
+        total = sum(usable for views in shard_views for _, usable in views) // RECORD_SIZE
+        log.info(f"[Replication] Sending snapshot to {addr}: {total} records @ lsn {lsn}")
+        chunk_bytes = SNAPSHOT_CHUNK * RECORD_SIZE
+        try:
+            for views in shard_views:
+                for mm, usable in views:
+                    for offset in range(0, usable, chunk_bytes):
+                        if conn.transport.is_closing():
+                            return lsn
+                        chunk = mm[offset:min(offset + chunk_bytes, usable)] # mmap 切片會複製成 bytes
+                        conn._send(CMD_REPL_RECORDS, req_id,
+                                   ReplicationCodec.encode(ReplicationCodec.REPL_SNAPSHOT, lsn, self.log.lsn, chunk),
+                                   FLAG_BINARY)
+                        await conn.drain() # 等 socket 送得出去再讀下一塊，快照不會整份堆在記憶體裡
+        finally:
+            for views in shard_views:
+                for mm, _ in views:
+                    mm.close()
+        # 快照結束時附上統計檔 (被壓縮掉的嘗試與各關版本號)，Follower 的關卡統計與版本號才會與 Primary 相同
+        stats = SteadyHandProtocol.encode_payload(encode_carried(*carried))
+        conn._send(CMD_REPL_RECORDS, req_id,
+                   ReplicationCodec.encode(ReplicationCodec.REPL_SNAPSHOT_END, lsn, self.log.lsn, stats), FLAG_BINARY)
+        return lsn
+
+
+class ReplicaDB(SteadyHandDB):
+    """
+    Follower 使用的唯讀資料庫
+    - 啟動時照常讀取本機檔案 (若有)，收到 Primary 的快照後整批換掉
+    - 之後由 ReplicaFollower 呼叫 apply_record() 套用串流來的紀錄
+    - 上傳一律拒絕，請 Client 寫到 Primary
+    """
+
+    def __init__(self, db_file, **options):
+        super().__init__(db_file, read_only=True, **options)
+        self.staging = None     # 接收快照中: { shard_key: LeaderboardIndex }
+        self.staged_last = {}   # level_id -> 快照中該關最後一筆紀錄 (換上索引後用來通知 listeners)
+
+    def add_score(self, username: str, level_id: int, time_spent: float, stars: int):
+        raise ValueError("Read-only replica: upload scores to the primary")
+
+    def add_scores(self, username: str, scores):
+        raise ValueError("Read-only replica: upload scores to the primary")
+
+    def begin_snapshot(self):
+        self.staging = {}
+        self.staged_last = {}
+
+    def apply_snapshot(self, records):
+        """把快照的一部分套用到新的索引 (還不影響查詢)"""
+        for record in records:
+            key = shard_key(record.level, self.shard_mode, self.shard_buckets)
+            index = self.staging.get(key)
+            if index is None:
+                index = self.staging[key] = LeaderboardIndex()
+            index.apply(record)
+            self.staged_last[record.level] = record
+
+    def _staged_index(self, level_id):
+        key = shard_key(level_id, self.shard_mode, self.shard_buckets)
+        index = self.staging.get(key)
+        if index is None:
+            index = self.staging[key] = LeaderboardIndex()
+        return index
+
+    def finish_snapshot(self, carried=None, versions=None) -> int:
+        """
+        換上快照建立的索引，回傳快照的紀錄數
+        carried: Primary 統計檔裡的 { level_id: LevelStats } (被壓縮掉的嘗試)，加到各關的統計
+        versions: Primary 統計檔裡的 { level_id: 版本號 }，與重建出的版本號取較大者 (與 Primary 重啟時相同)
+        """
+        count = sum(sum(stats.count for stats in index.stats.values()) for index in self.staging.values())
+        for level_id, extra in (carried or {}).items():
+            index = self._staged_index(level_id)
+            stats = index.stats.get(level_id)
+            if stats is None:
+                stats = index.stats[level_id] = LevelStats()
+            stats.merge(extra)
+        for level_id, version in (versions or {}).items():
+            self._staged_index(level_id).restore_versions({level_id: version})
+        staging, self.staging = self.staging, None
+        self.replace_indexes(staging)
+        for record in self.staged_last.values():
+            for callback in self.listeners:
+                callback(record)
+        self.staged_last = {}
+        return count
+
+
+def _iter_records(view):
+    """解包串流中的原始紀錄 (長度不是 RECORD_SIZE 的倍數時丟出 ValueError)"""
+    try:
+        rows = struct.iter_unpack(RECORD_FORMAT, view)
+    except struct.error as e:
+        raise ValueError(f"Bad replication records: {e}")
+    names = {}
+    for name_b, lvl, t, stars, ts in rows:
+        name = names.get(name_b)
+        if name is None:
+            name = names[name_b] = name_b.decode('utf-8', errors='ignore').rstrip('\x00')
+        yield ScoreRecord(name, lvl, t, stars, ts)
+
+
+class ReplicaFollower:
+    """
+    Follower 的複寫執行緒：連到 Primary、送出 CMD_REPLICATE，之後持續套用收到的紀錄
+    斷線後每 reconnect_delay 秒重連，從上次套用到的 (epoch, lsn) 接著要。
+    """
+
+    def __init__(self, db: ReplicaDB, primary_addr, reconnect_delay=1.0):
+        self.db = db
+        self.primary_addr = primary_addr
+        self.reconnect_delay = reconnect_delay
+        self.epoch = ""
+        self.lsn = 0              # 已套用到的序號
+        self.snapshot_epoch = ""  # 接收中的快照屬於哪個 epoch
+        self.head = 0             # Primary 最新的序號 (最後一次收到的)
+        self.lag_ms = 0.0         # 最後一個封包從 Primary 送出到套用完成花了多久
+        self.last_contact = 0.0
+        self.connected = False
+        self.sock = None
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="replica-follower", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        sock = self.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.thread.join()
+
+    def status(self) -> dict:
+        return {
+            "role": "follower",
+            "primary": f"{self.primary_addr[0]}:{self.primary_addr[1]}",
+            "connected": self.connected,
+            "epoch": self.epoch,
+            "lsn": self.lsn,
+            "head": self.head,
+            "lag_records": max(0, self.head - self.lsn),
+            "lag_ms": round(self.lag_ms, 1),
+            "last_contact_sec": round(time.time() - self.last_contact, 1) if self.last_contact else None,
+        }
+
+    def _run(self):
+        while not self.stopping.is_set():
+            try:
+                self._follow()
+            except (OSError, ValueError) as e:
+                if not self.stopping.is_set():
+                    log.warning(f"[Replica] Replication from {self.primary_addr[0]}:{self.primary_addr[1]} "
+                                f"interrupted: {e}")
+            finally:
+                self.connected = False
+                if self.sock is not None:
+                    self.sock.close()
+                    self.sock = None
+            self.stopping.wait(self.reconnect_delay)
+
+    def _follow(self):
+        self.sock = sock = socket.create_connection(self.primary_addr, timeout=FOLLOWER_TIMEOUT_SEC)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.sendall(SteadyHandProtocol.pack_packet(CMD_REPLICATE, {"epoch": self.epoch, "lsn": self.lsn},
+                                                    request_id=1))
+        decoder = FrameDecoder()
+        while not self.stopping.is_set():
+            if decoder.recv_from(sock) == 0:
+                raise ConnectionError("Connection closed by primary")
+            while True:
+                frame = decoder.next_frame()
+                if frame is None:
+                    break
+                cmd, _, _, body = frame
+                self._handle(cmd, body)
+
+    def _handle(self, cmd, body):
+        self.last_contact = time.time()
+        if cmd in (CMD_REPLICATE, CMD_ERROR):
+            reply = SteadyHandProtocol.decode_payload(body)
+            if reply.get("status") != "ok":
+                raise ValueError(reply.get("msg", "Replication refused"))
+            if reply["snapshot"]:
+                # 快照套用完成前，手上的 (epoch, lsn) 都不能拿來續傳
+                self.epoch, self.lsn = "", 0
+                self.snapshot_epoch = reply["epoch"]
+                self.db.begin_snapshot()
+            self.connected = True
+            log.info(f"[Replica] Following {self.primary_addr[0]}:{self.primary_addr[1]} "
+                     f"(epoch {reply['epoch']}, {'snapshot' if reply['snapshot'] else f'resume from lsn {self.lsn}'})")
+            return
+        if cmd != CMD_REPL_RECORDS:
+            return
+
+        kind, lsn, head, sent_at, records = ReplicationCodec.decode(body)
+        if kind == ReplicationCodec.REPL_SNAPSHOT:
+            self.db.apply_snapshot(_iter_records(records))
+        elif kind == ReplicationCodec.REPL_SNAPSHOT_END:
+            carried, versions = {}, {}
+            if len(records):
+                carried, versions = decode_carried(SteadyHandProtocol.decode_payload(records))
+            count = self.db.finish_snapshot(carried, versions)
+            self.epoch, self.lsn = self.snapshot_epoch, lsn
+            log.info(f"[Replica] Snapshot loaded: {count} records @ lsn {lsn}")
+        else:
+            for record in _iter_records(records):
+                self.db.apply_record(record)
+            self.lsn = lsn
+        self.head = head
+        self.lag_ms = max(0.0, (time.time() - sent_at) * 1000.0)
@@ -0,0 +1,60 @@
+# 檔案名稱: server/response_cache.py
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    預先編碼的回應快取 (LRU)
+    key 的第一個欄位必須是 level_id；value 是已經編碼好的回應 payload bytes (加上 Header 就能直接送出)。
+    某關有新成績時呼叫 invalidate_level()，該關所有快取一起丟掉。
+
+    為了避免「查詢中途剛好有人寫入」把舊資料放回快取，每關有一個 generation 計數：
+    查詢前先取 generation()，put() 時若 generation 已經變了就不存。
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()   # key -> bytes
+        self.level_keys = {}           # level_id -> set(keys)
+        self.generations = {}          # level_id -> int
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def generation(self, level_id):
+        with self.lock:
+            return self.generations.get(level_id, 0)
+
+    def put(self, key, data, generation):
+        level_id = key[0]
+        with self.lock:
+            if self.generations.get(level_id, 0) != generation:
+                return # 查詢期間該關有新成績，這份結果可能已經過期
+            self.entries[key] = data
+            self.entries.move_to_end(key)
+            self.level_keys.setdefault(level_id, set()).add(key)
+
+            while len(self.entries) > self.max_entries:
+                old_key, _ = self.entries.popitem(last=False)
+                keys = self.level_keys.get(old_key[0])
+                if keys is not None:
+                    keys.discard(old_key)
+                    if not keys:
+                        del self.level_keys[old_key[0]]
+
+    def invalidate_level(self, level_id):
+        with self.lock:
+            self.generations[level_id] = self.generations.get(level_id, 0) + 1
+            for key in self.level_keys.pop(level_id, ()):
+                self.entries.pop(key, None)
@@ -0,0 +1,137 @@
+# 檔案名稱: server/workers.py
+import itertools
+import os
+import queue
+import signal
+import sys
+import threading
+
+# 加入專案根目錄，讓直接執行此檔案時也能 import server 底下的模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server.db_engine import SteadyHandDB
+from server.db_index import ScoreRecord
+from server.db_writer import WriteTicket
+from server.log import get_logger, setup as setup_logging
+
+log = get_logger("db")
+
+# 多行程模式 (SERVER_WORKERS > 1)
+# - 一個寫入行程 (writer_main) 擁有唯一可寫入的 SteadyHandDB
+# - N 個 worker 行程各自用 SO_REUSEPORT 監聽同一個 port，讀取走自己的記憶體索引 (WorkerDB)
+# - worker 的寫入透過 requests 佇列交給寫入行程；寫入行程把每筆新紀錄廣播到所有 worker 的 inbox，
+#   寫入完成後再把結果放進發出請求的 worker 的 inbox。同一個 inbox 先收到紀錄才收到完成通知，
+#   所以 worker 回覆「上傳成功」時，自己的索引一定已經包含這筆紀錄。
+#
+# 佇列訊息:
+#   requests: ("add", worker_id, request_id, (username, level_id, time_spent, stars))
+#             ("batch", worker_id, request_id, (username, [(level_id, time_spent, stars), ...]))
+#             None = 關閉
+#   inbox:    ("records", [record_tuple, ...])
+#             ("done", request_id, error_message 或 None)
+
+
+class WorkerDB(SteadyHandDB):
+    """
+    worker 行程使用的資料庫
+    - 讀取: 啟動時以 mmap 批次掃描建立自己的索引 (唯讀副本)，之後套用寫入行程廣播的紀錄
+    - 寫入: add_score / add_scores 交給寫入行程，回傳的 WriteTicket 在寫入行程確認後完成
+    """
+
+    def __init__(self, worker_id, requests, inbox, db_file, **options):
+        super().__init__(db_file, read_only=True, **options)
+        self.worker_id = worker_id
+        self.requests = requests
+        self.inbox = inbox
+        self.tickets = {}              # request_id -> WriteTicket
+        self.tickets_lock = threading.Lock()
+        self.request_ids = itertools.count(1)
+        self.inbox_thread = threading.Thread(target=self._inbox_loop, name="db-inbox", daemon=True)
+        self.inbox_thread.start()
+
+    def add_score(self, username: str, level_id: int, time_spent: float, stars: int):
+        return self._submit("add", (username, level_id, time_spent, stars))
+
+    def add_scores(self, username: str, scores):
+        return [self._submit("batch", (username, list(scores)))]
+
+    def _submit(self, op, args) -> WriteTicket:
+        ticket = WriteTicket()
+        with self.tickets_lock:
+            request_id = next(self.request_ids)
+            self.tickets[request_id] = ticket
+        self.requests.put((op, self.worker_id, request_id, args))
+        return ticket
+
+    def _inbox_loop(self):
+        while True:
+            msg = self.inbox.get()
+            if msg is None:
+                return
+            if msg[0] == "records":
+                for row in msg[1]:
+                    self.apply_record(ScoreRecord(*row))
+            elif msg[0] == "done":
+                _, request_id, error = msg
+                with self.tickets_lock:
+                    ticket = self.tickets.pop(request_id, None)
+                if ticket is not None:
+                    ticket._finish(RuntimeError(error) if error else None)
+
+
+def writer_main(db_file, options, requests, inboxes, ready, log_options):
+    """寫入行程的進入點：執行 worker 送來的寫入，並把新紀錄廣播給所有 worker"""
+    setup_logging(**log_options)
+    # Ctrl+C 由主行程處理：等所有 worker 結束後送出 None，寫入行程才把資料寫完並關閉
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # 關閉時 worker 已經結束，不必等送給它們的訊息被讀走
+    for inbox in inboxes:
+        inbox.cancel_join_thread()
+
+    db = SteadyHandDB(db_file, **options)
+
+    def broadcast(record):
+        msg = ("records", [tuple(record)])
+        for inbox in inboxes:
+            inbox.put(msg)
+    db.add_listener(broadcast)
+
+    # 等待寫入完成 (依 fsync 策略) 的工作交給另一個執行緒，這裡可以繼續收下一個請求
+    completions = queue.Queue()
+    completer = threading.Thread(target=_completion_loop, args=(completions, inboxes), name="db-completion")
+    completer.start()
+    ready.set()
+    log.info(f"[DB] Writer process ready (pid {os.getpid()})")
+
+    while True:
+        msg = requests.get()
+        if msg is None:
+            break
+        op, worker_id, request_id, args = msg
+        try:
+            if op == "add":
+                tickets = [db.add_score(*args)]
+            elif op == "batch":
+                tickets = db.add_scores(*args)
+            else:
+                raise ValueError(f"Unknown op: {op}")
+        except Exception as e:
+            log.error(f"[DB] Error: {e}")
+            inboxes[worker_id].put(("done", request_id, str(e)))
+            continue
+        completions.put((worker_id, request_id, tickets))
+
+    completions.put(None)
+    completer.join()
+    db.close()
+    log.info("[DB] Writer process stopped")
+
+
+def _completion_loop(completions, inboxes):
+    while True:
+        item = completions.get()
+        if item is None:
+            return
+        worker_id, request_id, tickets = item
+        ok = all(t.wait() for t in tickets)
+        inboxes[worker_id].put(("done", request_id, None if ok else "Write failed"))
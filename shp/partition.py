@@ -0,0 +1,76 @@
+# 檔案名稱: shp/partition.py
+import bisect
+import hashlib
+
+# --- 叢集分區表 (依關卡分區) ---
+# Server (server/main.py) 與 Client (steadyhand/network_client.py) 都 import 這裡的 PartitionMap，
+# 兩邊的計算結果一定相同。本檔案只依賴標準函式庫，Client 不需要 server/ 就能打包。
+# 送錯節點時 Server 回覆以 WRONG_NODE 開頭的錯誤，Client 重新取得分區表後再送一次。
+
+WRONG_NODE = "Wrong node"
+
+
+class PartitionMap:
+    """
+    叢集分區表：每個 level_id 屬於哪個節點 (節點編號 = nodes 的 index)
+    - static: [(first, last, node), ...] 明確指定的關卡區間，優先採用
+    - 其他關卡用一致性雜湊 (consistent hashing)：每個節點在環上放 vnodes 個點，
+      level_id 的雜湊值往後找到的第一個點屬於哪個節點，該關就屬於哪個節點；增加節點時只有少部分關卡換手
+    雜湊用 md5 (不受 PYTHONHASHSEED 影響)，環上的點以節點編號計算，節點換位址不會改變分區。
+    """
+
+    def __init__(self, nodes, static=(), vnodes=64):
+        if not nodes:
+            raise ValueError("Cluster needs at least one node")
+        self.nodes = list(nodes)  # ["host:port", ...]
+        self.static = sorted(tuple(r) for r in static)
+        for first, last, node in self.static:
+            if not 0 <= node < len(self.nodes) or first > last:
+                raise ValueError(f"Bad static partition: {first}-{last}:{node}")
+        self.vnodes = vnodes
+
+        points = sorted((self._hash(f"node{node}#{i}"), node)
+                        for node in range(len(self.nodes)) for i in range(vnodes))
+        self.ring_keys = [h for h, _ in points]
+        self.ring_nodes = [node for _, node in points]
+
+    @staticmethod
+    def _hash(text) -> int:
+        return int.from_bytes(hashlib.md5(text.encode('utf-8')).digest()[:8], "big")
+
+    @classmethod
+    def parse(cls, nodes, static=""):
+        """
+        從設定字串建立: nodes = "host:port,host:port,..."
+        static = "1-10:0,11-20:1,99:2" (關卡或關卡區間:節點編號，可留空)
+        """
+        node_list = [n.strip() for n in nodes.split(",") if n.strip()]
+        ranges = []
+        for item in static.split(","):
+            item = item.strip()
+            if not item:
+                continue
+            levels, _, node = item.rpartition(":")
+            first, _, last = levels.partition("-")
+            ranges.append((int(first), int(last or first), int(node)))
+        return cls(node_list, ranges)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["nodes"], data.get("static", ()), data.get("vnodes", 64))
+
+    def to_dict(self) -> dict:
+        return {"nodes": self.nodes, "static": [list(r) for r in self.static], "vnodes": self.vnodes}
+
+    def owner(self, level_id: int) -> int:
+        """負責 level_id 的節點編號"""
+        for first, last, node in self.static:
+            if first <= level_id <= last:
+                return node
+        i = bisect.bisect(self.ring_keys, self._hash(f"level{level_id}")) % len(self.ring_keys)
+        return self.ring_nodes[i]
+
+    def address(self, node):
+        """節點編號 -> (host, port)"""
+        host, _, port = self.nodes[node].rpartition(":")
+        return host, int(port)
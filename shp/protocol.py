@@ -0,0 +1,414 @@
+# 檔案名稱: shp/protocol.py
+import struct
+import json
+import time
+
+# --- 協定常數定義 ---
+CMD_UPLOAD_SCORE = 1
+CMD_GET_LEADERBOARD = 2   # {"level", "limit"?, "window"?: "all"|"day"|"week"|"season", "version"?} -> {"version", "data"}
+CMD_GET_RANK = 3        # {"level", "user"} -> 玩家名次與個人最佳
+CMD_GET_AROUND = 4      # {"level", "user", "k"} -> 玩家前後各 k 名
+CMD_GET_LEVEL_STATS = 5 # {"level", "user"?} -> 關卡統計 (次數、分位數、直方圖、贏過多少 % 玩家)
+CMD_UPLOAD_BATCH = 6    # {"user", "scores": [{"level", "time", "stars"}, ...]} -> 一次上傳多筆成績
+CMD_GET_LEADERBOARDS = 7 # {"levels": [...], "limit"?, "window"?, "versions"?: {"<level>": v}} 一次取多關排行榜
+                         #   -> {"versions": {"<level>": v}, "data": {"<level>": [...]}} (data 只包含版本有變的關卡)
+CMD_SUBSCRIBE = 8       # {"levels": [...], "limit"?} 訂閱總榜，前 limit 名有變動時 Server 主動推播
+CMD_UNSUBSCRIBE = 9     # {"levels"?: [...]} 取消訂閱 (沒給 levels 代表全部取消)
+CMD_PUSH_LEADERBOARD = 10 # (Server -> Client，REQ_ID 固定為 0) {"level", "version", "data": [...]}
+CMD_REPLICATE = 11      # (Follower -> Primary) {"epoch", "lsn"} 從 lsn 之後開始串流紀錄 -> {"epoch", "lsn", "snapshot"}
+                        #   之後 Primary 持續以同一個 REQ_ID 送出 CMD_REPL_RECORDS，直到連線中斷
+CMD_REPL_RECORDS = 12   # (Primary -> Follower，FLAG_BINARY) ReplicationCodec 格式的一批原始紀錄
+CMD_REPL_STATUS = 13    # {} -> 複寫狀態 (primary: epoch / lsn / followers；follower: 落後幾筆、幾毫秒)
+CMD_GET_PARTITION_MAP = 14 # {} -> {"node": 這個節點的編號, "map": PartitionMap.to_dict()}；非叢集模式時兩者皆為 None
+CMD_STATS = 15          # {"reset"?: bool} -> Server 指標 (每種指令的請求數、錯誤、bytes、延遲直方圖，DB 掃描與鎖等待)
+CMD_ERROR = 255
+
+# 指令編號 -> 名稱 (指標與紀錄使用)，例如 2 -> "get_leaderboard"
+COMMAND_NAMES = {value: name[4:].lower() for name, value in globals().items() if name.startswith("CMD_")}
+
+MAX_BATCH = 100         # 批次指令 (CMD_UPLOAD_BATCH / CMD_GET_LEADERBOARDS) 一次最多幾筆成績 / 幾個關卡
+
+# --- Header 旗標 (FLAGS) ---
+FLAG_CLOSE = 0x01       # Client 要求 Server 回覆這個請求後關閉連線 (預設連線會保持開啟)
+FLAG_BINARY = 0x02      # PAYLOAD 使用 BinaryCodec 二進位編碼 (只支援上傳與排行榜)，Server 會用同樣的編碼回覆
+FLAG_NOT_MODIFIED = 0x04 # (回覆) 請求帶的 version 仍是最新的，PAYLOAD 為空，Client 沿用手上的資料
+
+# --- 請求大小上限 (Server 端的 FrameDecoder 使用) ---
+# Header 的 LENGTH 超過該指令的上限時直接拒絕 (FrameTooLarge)，不會替它配置 buffer 或等它傳完
+MAX_REQUEST_PAYLOAD = {
+    CMD_UPLOAD_BATCH: 16 * 1024,      # 最多 MAX_BATCH 筆成績
+    CMD_GET_LEADERBOARDS: 16 * 1024,  # 最多 MAX_BATCH 個關卡與各自的版本號
+    CMD_SUBSCRIBE: 8 * 1024,
+    CMD_UNSUBSCRIBE: 8 * 1024,
+}
+DEFAULT_MAX_REQUEST_PAYLOAD = 1024    # 其他指令 (單一關卡的查詢與上傳)
+
+
+def max_request_payload(cmd_id) -> int:
+    return MAX_REQUEST_PAYLOAD.get(cmd_id, DEFAULT_MAX_REQUEST_PAYLOAD)
+
+
+class FrameTooLarge(ValueError):
+    """封包的 LENGTH 超過該指令的上限"""
+
+    def __init__(self, cmd_id, request_id, length, limit):
+        super().__init__(f"CMD {cmd_id} payload of {length} bytes exceeds {limit} bytes")
+        self.cmd_id = cmd_id
+        self.request_id = request_id
+        self.length = length
+        self.limit = limit
+
+
+class SteadyHandProtocol:
+    """
+    SHP (SteadyHand Protocol) 封包處理器
+    格式: [CMD(1B)] [FLAGS(1B)] [REQ_ID(4B)] [LENGTH(4B)] [PAYLOAD(JSON)]
+    - 一條 TCP 連線可以連續送出多個請求 (不必等上一個回覆，即 pipelining)
+    - REQ_ID 由 Client 指定，Server 回覆時原樣帶回，Client 用它對應回覆 (回覆順序不保證與請求相同)
+    - REQ_ID 0 保留給 Server 主動推播的封包 (CMD_PUSH_LEADERBOARD)
+    """
+
+    # Header 格式: 1 + 1 + 4 + 4 bytes
+    # B: unsigned char (1 byte)
+    # I: unsigned int (4 bytes)
+    # >: Big Endian (網路傳輸標準位元組順序)
+    HEADER_FORMAT = ">BBII"
+    HEADER_SIZE = struct.calcsize(HEADER_FORMAT) # 應該是 10 bytes
+
+    @staticmethod
+    def encode_payload(payload_dict: dict) -> bytes:
+        """將字典轉成 JSON 字串，再轉成 bytes"""
+        return json.dumps(payload_dict).encode('utf-8')
+
+    @staticmethod
+    def pack_header(cmd_id: int, length: int, request_id: int = 0, flags: int = 0) -> bytes:
+        return struct.pack(SteadyHandProtocol.HEADER_FORMAT, cmd_id, flags, request_id, length)
+
+    @staticmethod
+    def pack_packet(cmd_id: int, payload_dict: dict, request_id: int = 0, flags: int = 0) -> bytes:
+        """
+        將指令與資料打包成二進位封包
+        """
+        # 1. 將字典轉成 JSON bytes
+        payload_bytes = SteadyHandProtocol.encode_payload(payload_dict)
+
+        # 2. 製作 Header (含長度)
+        header = SteadyHandProtocol.pack_header(cmd_id, len(payload_bytes), request_id, flags)
+
+        # 3. 組合 (Header + Body)
+        return header + payload_bytes
+
+    @staticmethod
+    def unpack_header(header_bytes: bytes):
+        """
+        解析 Header，回傳 (cmd_id, flags, request_id, payload_length)
+        """
+        if len(header_bytes) != SteadyHandProtocol.HEADER_SIZE:
+            return None, 0, 0, 0
+        return struct.unpack(SteadyHandProtocol.HEADER_FORMAT, header_bytes)
+
+    @staticmethod
+    def decode_payload(payload_view):
+        """把 payload (bytes 或 memoryview) 解回字典；直接從 view 解碼，不先複製成 bytes"""
+        return json.loads(str(payload_view, 'utf-8'))
+
+
+class FrameDecoder:
+    """
+    增量式 SHP 封包解析器 (Server 與 Client 共用)
+    資料直接 recv_into 預先配置好的 bytearray，不用 buf += data 一直重新配置：
+      1. get_buffer() 取得可寫入的 memoryview，收資料後呼叫 buffer_updated(nbytes)
+         (asyncio.BufferedProtocol 的介面剛好一樣；同步 socket 可以用 recv_from())
+      2. 反覆呼叫 next_frame() 取出完整的封包，沒有完整封包時回傳 None
+    一次讀到半個封包或好幾個封包都沒問題。
+
+    注意: next_frame() 回傳的 payload 是指向內部 buffer 的 memoryview，
+    只在下一次 get_buffer() 之前有效，需要保留的話請先解碼或複製。
+
+    max_payload(cmd_id) 可限制每種指令的 PAYLOAD 大小 (Server 用 max_request_payload)：
+    超過上限的封包不會配置 buffer，next_frame() 直接丟出 FrameTooLarge，之後的資料也無法再解析。
+    """
+
+    MIN_READ = 4096 # 每次至少留這麼多空間給 recv_into
+
+    def __init__(self, initial_size=16 * 1024, max_payload=None):
+        self.initial_size = initial_size
+        self.max_payload = max_payload
+        self._alloc(initial_size)
+
+    def _alloc(self, size, keep=None):
+        buf = bytearray(size)
+        if keep is not None:
+            buf[:len(keep)] = keep
+        self.buf = buf
+        self.view = memoryview(buf)
+        self.start = 0                            # 尚未解析資料的開頭
+        self.end = 0 if keep is None else len(keep) # 已收到資料的結尾
+
+    def get_buffer(self, sizehint=-1):
+        """回傳一塊可寫入的 memoryview (必要時把未解析的資料搬到開頭或換更大的 buffer)"""
+        pending = self.end - self.start
+        if pending == 0:
+            self.start = self.end = 0
+            if len(self.buf) > self.initial_size * 16:
+                self._alloc(self.initial_size) # 處理過特別大的封包後縮回原本大小
+
+        # 至少要放得下「目前這個封包」，以及一次 recv 的空間
+        need = max(self._frame_size(), pending + max(sizehint, self.MIN_READ))
+        if need > len(self.buf):
+            self._alloc(max(need, len(self.buf) * 2), self.view[self.start:self.end])
+        elif len(self.buf) - self.end < self.MIN_READ and self.start > 0:
+            # 尾端空間不夠：把剩下的半個封包搬到最前面 (memoryview 複製會處理重疊，不會重新配置)
+            self.view[:pending] = self.view[self.start:self.end]
+            self.start, self.end = 0, pending
+        return self.view[self.end:]
+
+    def buffer_updated(self, nbytes):
+        self.end += nbytes
+
+    def recv_from(self, sock):
+        """從 socket 讀一次資料，回傳讀到的 bytes 數 (0 代表對方關閉連線)"""
+        n = sock.recv_into(self.get_buffer())
+        self.buffer_updated(n)
+        return n
+
+    def has_partial(self) -> bool:
+        """buffer 裡是否還有收到一半的封包"""
+        return self.end > self.start
+
+    def _header(self):
+        """目前第一個封包的 Header: (cmd_id, flags, request_id, payload 長度)，還沒收完時回傳 None"""
+        if self.end - self.start < SteadyHandProtocol.HEADER_SIZE:
+            return None
+        return struct.unpack_from(SteadyHandProtocol.HEADER_FORMAT, self.buf, self.start)
+
+    def _frame_size(self):
+        """目前第一個封包的總長度 (Header 還沒收完、或超過大小上限時回傳 0，不替它預留空間)"""
+        header = self._header()
+        if header is None:
+            return 0
+        cmd, _, _, length = header
+        if self.max_payload is not None and length > self.max_payload(cmd):
+            return 0
+        return SteadyHandProtocol.HEADER_SIZE + length
+
+    def next_frame(self):
+        """
+        取出下一個完整封包: (cmd_id, flags, request_id, payload_view)，不完整時回傳 None
+        PAYLOAD 超過 max_payload 的上限時丟出 FrameTooLarge
+        """
+        header = self._header()
+        if header is None:
+            return None
+        cmd, flags, req_id, length = header
+        if self.max_payload is not None:
+            limit = self.max_payload(cmd)
+            if length > limit:
+                raise FrameTooLarge(cmd, req_id, length, limit)
+        size = SteadyHandProtocol.HEADER_SIZE + length
+        if self.end - self.start < size:
+            return None
+        payload = self.view[self.start + SteadyHandProtocol.HEADER_SIZE:self.start + size]
+        self.start += size
+        return cmd, flags, req_id, payload
+
+class BinaryCodec:
+    """
+    上傳與排行榜的二進位 PAYLOAD 編碼 (Header 帶 FLAG_BINARY 時使用，其他情況一律 JSON)
+    數值欄位與 DB 紀錄 "16sIfId" 相同 (float32 時間、unsigned int 星數、double 時間戳)，
+    名字改成 1 byte 長度前綴 + UTF-8，所有欄位 Big Endian。
+
+    請求:
+      CMD_UPLOAD_SCORE     [NAME_LEN(1B)] [NAME] [LEVEL(4B)] [TIME(4B float)] [STARS(4B)]
+      CMD_GET_LEADERBOARD  [LEVEL(4B)] [LIMIT(2B)] [WINDOW(1B): 0=all 1=day 2=week 3=season] [VERSION(8B): 0=沒有]
+    回覆:
+      [STATUS(1B): 0=ok 1=error] [MSG_LEN(2B)] [MSG]
+      排行榜成功時後面接著 [VERSION(8B)] [COUNT(2B)] 與 COUNT 筆
+      [NAME_LEN(1B)] [NAME] [TIME(4B float)] [STARS(4B)] [TIMESTAMP(8B double)]
+    解碼後的字典與 JSON 版本完全相同，呼叫端不需要知道用的是哪一種編碼。
+    """
+
+    COMMANDS = (CMD_UPLOAD_SCORE, CMD_GET_LEADERBOARD)
+    WINDOWS = ("all", "day", "week", "season") # index 就是 WINDOW 欄位的值
+
+    STATUS_OK = 0
+    STATUS_ERROR = 1
+
+    UPLOAD = struct.Struct(">IfI")           # level, time, stars
+    LEADERBOARD = struct.Struct(">IHBQ")     # level, limit, window, version
+    STATUS = struct.Struct(">BH")            # status, msg_len
+    VERSION = struct.Struct(">Q")
+    COUNT = struct.Struct(">H")
+    ENTRY = struct.Struct(">fId")            # time, stars, timestamp
+
+    @staticmethod
+    def _pack_name(name) -> bytes:
+        name_b = name.encode('utf-8')[:255]
+        return bytes((len(name_b),)) + name_b
+
+    @staticmethod
+    def _unpack_name(view, offset):
+        n = view[offset]
+        return str(view[offset + 1:offset + 1 + n], 'utf-8', errors='ignore'), offset + 1 + n
+
+    @staticmethod
+    def encode_request(cmd_id, payload_dict) -> bytes:
+        """打包請求，沒辦法用二進位表示 (例如未知的 window、負數關卡) 時丟出 ValueError"""
+        try:
+            if cmd_id == CMD_UPLOAD_SCORE:
+                return (BinaryCodec._pack_name(payload_dict.get("user", "Unknown")) +
+                        BinaryCodec.UPLOAD.pack(payload_dict.get("level", 1), payload_dict.get("time", 999.0),
+                                                payload_dict.get("stars", 0)))
+            if cmd_id == CMD_GET_LEADERBOARD:
+                window = BinaryCodec.WINDOWS.index(payload_dict.get("window", "all"))
+                return BinaryCodec.LEADERBOARD.pack(payload_dict.get("level", 1), payload_dict.get("limit", 5), window,
+                                                    payload_dict.get("version", 0))
+        except struct.error as e:
+            raise ValueError(f"Cannot encode binary payload: {e}")
+        raise ValueError(f"CMD {cmd_id} has no binary encoding")
+
+    @staticmethod
+    def decode_request(cmd_id, view) -> dict:
+        """解碼請求，格式錯誤時丟出 ValueError"""
+        try:
+            if cmd_id == CMD_UPLOAD_SCORE:
+                user, offset = BinaryCodec._unpack_name(view, 0)
+                level, time_val, stars = BinaryCodec.UPLOAD.unpack(view[offset:])
+                return {"user": user, "level": level, "time": time_val, "stars": stars}
+            if cmd_id == CMD_GET_LEADERBOARD:
+                level, limit, window, version = BinaryCodec.LEADERBOARD.unpack(view)
+                payload = {"level": level, "limit": limit, "window": BinaryCodec.WINDOWS[window]}
+                if version:
+                    payload["version"] = version
+                return payload
+        except (struct.error, IndexError) as e:
+            raise ValueError(f"Bad binary payload: {e}")
+        raise ValueError(f"CMD {cmd_id} has no binary encoding")
+
+    @staticmethod
+    def encode_response(ok: bool, msg="", records=None, version=0) -> bytes:
+        """
+        打包回覆；records 是排行榜紀錄 (需有 name / time / stars / timestamp 屬性，例如 ScoreRecord)
+        """
+        msg_b = msg.encode('utf-8')
+        parts = [BinaryCodec.STATUS.pack(BinaryCodec.STATUS_OK if ok else BinaryCodec.STATUS_ERROR, len(msg_b)), msg_b]
+        if records is not None:
+            parts.append(BinaryCodec.VERSION.pack(version))
+            parts.append(BinaryCodec.COUNT.pack(len(records)))
+            pack_entry = BinaryCodec.ENTRY.pack
+            for r in records:
+                parts.append(BinaryCodec._pack_name(r.name))
+                parts.append(pack_entry(r.time, r.stars, r.timestamp))
+        return b"".join(parts)
+
+    @staticmethod
+    def decode_response(cmd_id, view) -> dict:
+        """解碼回覆，格式錯誤時丟出 ValueError"""
+        try:
+            status, msg_len = BinaryCodec.STATUS.unpack_from(view, 0)
+            offset = BinaryCodec.STATUS.size
+            result = {"status": "ok" if status == BinaryCodec.STATUS_OK else "error"}
+            if msg_len:
+                result["msg"] = str(view[offset:offset + msg_len], 'utf-8')
+            offset += msg_len
+
+            if cmd_id == CMD_GET_LEADERBOARD and status == BinaryCodec.STATUS_OK:
+                result["version"], = BinaryCodec.VERSION.unpack_from(view, offset)
+                offset += BinaryCodec.VERSION.size
+                count, = BinaryCodec.COUNT.unpack_from(view, offset)
+                offset += BinaryCodec.COUNT.size
+                data = []
+                for _ in range(count):
+                    name, offset = BinaryCodec._unpack_name(view, offset)
+                    time_val, stars, timestamp = BinaryCodec.ENTRY.unpack_from(view, offset)
+                    offset += BinaryCodec.ENTRY.size
+                    # 與 Server 端 JSON 版本 (_format_record) 相同的欄位
+                    data.append({"name": name, "time": round(time_val, 2), "stars": stars,
+                                 "date": time.ctime(timestamp)})
+                result["data"] = data
+            return result
+        except (struct.error, IndexError) as e:
+            raise ValueError(f"Bad binary payload: {e}")
+
+class ReplicationCodec:
+    """
+    複寫串流 (CMD_REPL_RECORDS) 的 PAYLOAD:
+      [KIND(1B)] [LSN(8B)] [HEAD(8B)] [SENT_AT(8B double)] [RECORDS...]
+    RECORDS 是與 .db 檔案完全相同的原始紀錄 (每筆 RECORD_SIZE bytes)，Primary 不必解包再打包。
+    KIND:
+      REPL_LIVE          新寫入的紀錄，LSN = 這批最後一筆的序號；沒有紀錄時是心跳 (LSN 不變)
+      REPL_SNAPSHOT      完整快照的一部分 (Follower 落後太多或第一次連線時)
+      REPL_SNAPSHOT_END  快照結束，LSN = 快照涵蓋到的序號，之後接著送 REPL_LIVE；
+                         RECORDS 的位置改放 JSON 的統計檔內容 (被壓縮掉的嘗試的統計與各關版本號，格式見 db_compactor.encode_carried，可以是空的)
+    HEAD 是 Primary 送出時最新的序號、SENT_AT 是送出時的 time.time()，Follower 用來計算落後幾筆與延遲。
+    """
+
+    REPL_LIVE = 0
+    REPL_SNAPSHOT = 1
+    REPL_SNAPSHOT_END = 2
+
+    HEADER = struct.Struct(">BQQd") # kind, lsn, head, sent_at
+
+    @staticmethod
+    def encode(kind, lsn, head, records=b"") -> bytes:
+        return ReplicationCodec.HEADER.pack(kind, lsn, head, time.time()) + records
+
+    @staticmethod
+    def decode(view):
+        """回傳 (kind, lsn, head, sent_at, records_view)，格式錯誤時丟出 ValueError"""
+        try:
+            kind, lsn, head, sent_at = ReplicationCodec.HEADER.unpack_from(view, 0)
+        except struct.error as e:
+            raise ValueError(f"Bad replication payload: {e}")
+        return kind, lsn, head, sent_at, view[ReplicationCodec.HEADER.size:]
+
+# --- 自我測試 ---
+if __name__ == "__main__":
+    # 模擬 Client 打包資料
+    test_data = {"user": "Ray", "time": 12.5}
+    packet = SteadyHandProtocol.pack_packet(CMD_UPLOAD_SCORE, test_data, request_id=7)
+    header_size = SteadyHandProtocol.HEADER_SIZE
+
+    print(f"原始資料: {test_data}")
+    print(f"打包後的 Bytes: {packet}")
+    print(f"總長度: {len(packet)} bytes (Header {header_size} + Body {len(packet)-header_size})")
+
+    # 模擬 Server 解析
+    # 1. 先讀 Header (前 10 bytes)
+    header_part = packet[:header_size]
+    cmd, flags, req_id, length = SteadyHandProtocol.unpack_header(header_part)
+    print(f"解析 Header -> CMD: {cmd}, FLAGS: {flags}, REQ_ID: {req_id}, Length: {length}")
+
+    # 2. 再讀 Body
+    body_part = packet[header_size:header_size+length]
+    restored_data = json.loads(body_part.decode('utf-8'))
+    print(f"解析 Body -> {restored_data}")
+
+    # 模擬 TCP 把兩個封包切得零零碎碎 (每次只到 3 bytes)
+    decoder = FrameDecoder()
+    stream = packet + SteadyHandProtocol.pack_packet(CMD_GET_LEADERBOARD, {"level": 1}, request_id=8)
+    frames = []
+    for i in range(0, len(stream), 3):
+        chunk = stream[i:i+3]
+        decoder.get_buffer()[:len(chunk)] = chunk
+        decoder.buffer_updated(len(chunk))
+        while True:
+            frame = decoder.next_frame()
+            if frame is None:
+                break
+            cmd, flags, req_id, view = frame
+            frames.append((cmd, req_id, SteadyHandProtocol.decode_payload(view)))
+    print(f"分段接收 -> {frames}")
+
+    # 二進位編碼: 與 JSON 版本比較大小
+    req = BinaryCodec.encode_request(CMD_UPLOAD_SCORE, {"user": "Ray", "level": 3, "time": 12.5, "stars": 2})
+    print(f"二進位上傳 ({len(req)} bytes) -> {BinaryCodec.decode_request(CMD_UPLOAD_SCORE, memoryview(req))}")
+
+    class _Row:
+        def __init__(self, i):
+            self.name, self.time, self.stars, self.timestamp = f"Player-{i:04d}", 10.0 + i, 3, 1700000000.0 + i
+    rows = [_Row(i) for i in range(5)]
+    binary_body = BinaryCodec.encode_response(True, records=rows)
+    decoded = BinaryCodec.decode_response(CMD_GET_LEADERBOARD, memoryview(binary_body))
+    json_body = SteadyHandProtocol.encode_payload(decoded)
+    print(f"排行榜前 5 名: JSON {len(json_body)} bytes vs 二進位 {len(binary_body)} bytes")
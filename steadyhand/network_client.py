@@ -1,28 +1,188 @@
 # 檔案名稱: steadyhand/network_client.py
 import socket
-import json
 import threading
 import os
 import uuid
-import struct
+import itertools
+import time
+
+# 通訊協定定義、封包解析與叢集分區表與 Server 共用同一份程式碼 (shp/，不依賴 server/)
+from shp.protocol import (SteadyHandProtocol, FrameDecoder, BinaryCodec, CMD_UPLOAD_SCORE, CMD_GET_LEADERBOARD,
+                          CMD_GET_RANK, CMD_GET_AROUND, CMD_GET_LEVEL_STATS, CMD_UPLOAD_BATCH,
+                          CMD_GET_LEADERBOARDS, CMD_SUBSCRIBE, CMD_UNSUBSCRIBE, CMD_PUSH_LEADERBOARD,
+                          CMD_GET_PARTITION_MAP, FLAG_BINARY, FLAG_NOT_MODIFIED, MAX_BATCH)
+from shp.partition import PartitionMap, WRONG_NODE
+
+# 排行榜快取超過這麼多秒就帶著版本號重新詢問 Server (沒有變動時只會收到一個空封包)
+LEADERBOARD_REFRESH_SEC = 30.0
+
+class ShpConnection:
+    """
+    與 Server 之間的長連線 (所有請求共用一條 TCP 連線)
+    - 每個請求帶一個 REQ_ID，可以同時送出多個請求 (pipelining)，不必等上一個回覆
+    - 背景讀取執行緒負責接收回覆，依 REQ_ID 交給正在等待的請求
+    - 連線斷掉 (例如 Server 閒置逾時關閉) 時，下一個請求會自動重新連線
+    - 上傳與排行榜預設用二進位編碼 (FLAG_BINARY)；Server 用 JSON 回覆時代表它不支援，之後改用 JSON
+    - Server 主動推播的封包 (REQ_ID 0) 交給 on_push(cmd, payload)；重新連線後呼叫 on_reconnect()
+      (例如重新訂閱，Server 端的訂閱會隨舊連線一起消失)
+    """
+
+    def __init__(self, server_addr, timeout=3.0, binary=True):
+        self.server_addr = server_addr
+        self.timeout = timeout
+        self.binary = binary
+        self.sock = None
+        self.lock = threading.Lock()       # 保護 sock / pending，並讓 sendall 不會互相穿插
+        self.pending = {}                  # req_id -> [threading.Event, (response, flags)]
+        self.req_ids = itertools.count(1)
+        self.on_push = None
+        self.on_reconnect = None
+        self.connected_once = False
+
+    def request(self, cmd, payload):
+        """送出請求並等待回覆，失敗或逾時回傳 None"""
+        payload_bytes = None
+        if self.binary and cmd in BinaryCodec.COMMANDS:
+            try:
+                payload_bytes = BinaryCodec.encode_request(cmd, payload)
+            except ValueError:
+                pass # 無法用二進位表示的參數 (例如未知的 window)，這個請求改用 JSON 送出
+
+        if payload_bytes is not None:
+            result = self._roundtrip(cmd, payload_bytes, FLAG_BINARY)
+            if result is None:
+                return None
+            response, flags = result
+            if flags & FLAG_BINARY or response is None or response.get("msg") != "Bad payload":
+                return response # 其他錯誤 (例如 Server busy) 照常回傳，不代表 Server 不支援二進位
+            # Server 看不懂二進位 payload (回了 JSON 錯誤)，這個請求沒有被處理，改用 JSON 重送
+            print("[Network] Server does not support binary payloads, falling back to JSON")
+            self.binary = False
+
+        result = self._roundtrip(cmd, SteadyHandProtocol.encode_payload(payload))
+        return None if result is None else result[0]
+
+    def _roundtrip(self, cmd, payload_bytes, flags=0):
+        """送出一個封包並等待對應 REQ_ID 的回覆，回傳 (response, flags)；失敗或逾時回傳 None"""
+        # 舊連線可能已經被 Server 關閉但還沒被讀取執行緒發現，送出失敗時重連再試一次
+        for attempt in range(2):
+            with self.lock:
+                req_id = (next(self.req_ids) - 1) % 0xFFFFFFFF + 1 # REQ_ID 0 保留不用
+                slot = self.pending[req_id] = [threading.Event(), None]
+                reused = self.sock is not None
+                try:
+                    if not reused:
+                        self._connect()
+                        if self.connected_once and self.on_reconnect is not None:
+                            # 在另一個執行緒呼叫，避免在持有 lock 時送出請求
+                            threading.Thread(target=self.on_reconnect, daemon=True).start()
+                        self.connected_once = True
+                    header = SteadyHandProtocol.pack_header(cmd, len(payload_bytes), req_id, flags)
+                    self.sock.sendall(header + payload_bytes)
+                except OSError as e:
+                    self.pending.pop(req_id, None)
+                    self._drop(self.sock)
+                    if reused and attempt == 0:
+                        continue
+                    print(f"[Network] Error: {e}")
+                    return None
+
+            if not slot[0].wait(self.timeout):
+                with self.lock:
+                    self.pending.pop(req_id, None)
+                print(f"[Network] Error: request {req_id} timed out")
+                return None
+            return slot[1]
+
+    def close(self):
+        with self.lock:
+            self._drop(self.sock)
+
+    def _connect(self):
+        sock = socket.create_connection(self.server_addr, timeout=self.timeout)
+        sock.settimeout(None) # 讀取執行緒會一直阻塞等待回覆，逾時由各個請求自己處理
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        threading.Thread(target=self._read_loop, args=(sock,), daemon=True).start()
+
+    def _drop(self, sock):
+        """(需持有 lock) 關閉連線，並讓所有等待這條連線回覆的請求結束 (回覆為 None)"""
+        if sock is None or sock is not self.sock:
+            return
+        self.sock = None
+        try:
+            sock.close()
+        except OSError:
+            pass
+        for slot in self.pending.values():
+            slot[0].set()
+        self.pending.clear()
+
+    def _read_loop(self, sock):
+        decoder = FrameDecoder()
+        try:
+            while decoder.recv_from(sock) > 0:
+                # 一次 recv 可能只有半個封包，也可能有好幾個封包
+                while True:
+                    frame = decoder.next_frame()
+                    if frame is None:
+                        break
+                    r_cmd, r_flags, r_id, body = frame
+                    try:
+                        if r_flags & FLAG_NOT_MODIFIED:
+                            response = {"status": "not_modified"}
+                        elif r_flags & FLAG_BINARY:
+                            response = BinaryCodec.decode_response(r_cmd, body)
+                        else:
+                            response = SteadyHandProtocol.decode_payload(body)
+                    except ValueError:
+                        response = None
+                    if r_id == 0:
+                        # Server 主動推播，不對應任何請求
+                        if self.on_push is not None and response is not None:
+                            self.on_push(r_cmd, response)
+                        continue
+                    with self.lock:
+                        slot = self.pending.pop(r_id, None)
+                    if slot is not None:
+                        slot[1] = (response, r_flags)
+                        slot[0].set()
+        except OSError:
+            pass
+        with self.lock:
+            self._drop(sock)
 
-# 通訊協定定義 (必須與 Server 保持一致)
-CMD_UPLOAD_SCORE = 1
-CMD_GET_LEADERBOARD = 2
-HEADER_FORMAT = ">BI"
-HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
 
 class NetworkClient:
     def __init__(self, host='127.0.0.1', port=9999):
         self.server_addr = (host, port)
+        # 所有請求共用一條長連線 (叢集模式下每個節點一條，self.conn 是設定檔指定的那個節點)
+        self.conns = {}
+        self.conns_lock = threading.Lock()
+        self.conn = self._connection(self.server_addr)
+        # 叢集分區表：第一次送出請求前向 Server 詢問，非叢集模式時為 None
+        self.partition = None
+        self.partition_checked = False
         # 取得或建立使用者 ID
         self.user_id = self.get_or_create_user_id()
         # 簡單產生一個代號名字，未來可以做改名功能
         self.username = f"Player-{self.user_id[:4]}"
         
-        # 排行榜快取: { level_id: [records...] }
-        self.leaderboard_cache = {} 
+        # 排行榜快取: { level_id 或 (level_id, window): {"version", "data": [records...], "fetched_at"} }
+        self.leaderboard_cache = {}
+        # 個人名次快取: { level_id: {"rank", "total", "time", ...} 或 None (尚無紀錄) }
+        self.rank_cache = {}
+        # 前後名次快取: { level_id: {"rank", "total", "data": [...]} 或 None }
+        self.around_cache = {}
+        # 關卡統計快取: { level_id: {"count", "players", "p50", "beat_pct", ...} }
+        self.stats_cache = {}
         self.is_loading = False
+        # 還沒上傳成功的成績 (例如離線時完成的關卡): [(level, time_spent, stars), ...]
+        # 下次上傳時一起用批次指令送出
+        self.pending_uploads = []
+        self.pending_lock = threading.Lock()
+        # 訂閱中的關卡 (總榜)：前幾名有變動時 Server 主動推送，重新連線後自動重新訂閱
+        self.subscribed_levels = set()
 
     def get_or_create_user_id(self):
         """讀取本地 user_id.txt，若無則生成新的 UUID"""
@@ -36,37 +196,158 @@ class NetworkClient:
                 f.write(new_id)
             return new_id
 
+    def _connection(self, addr):
+        """取得 (或建立) 連到 addr 的長連線"""
+        with self.conns_lock:
+            conn = self.conns.get(addr)
+            if conn is None:
+                conn = self.conns[addr] = ShpConnection(addr)
+                conn.on_push = self._handle_push
+                conn.on_reconnect = lambda: self._resubscribe(conn)
+            return conn
+
     def _send_request(self, cmd, payload):
-        """(內部函式) 建立連線 -> 發送 -> 接收 -> 斷線"""
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(3.0) # 設定 3 秒逾時，避免卡死
-            sock.connect(self.server_addr)
-            
-            # 1. 打包請求
-            payload_bytes = json.dumps(payload).encode('utf-8')
-            header = struct.pack(HEADER_FORMAT, cmd, len(payload_bytes))
-            sock.sendall(header + payload_bytes)
-            
-            # 2. 接收檔頭 (Header)
-            resp_header = sock.recv(HEADER_SIZE)
-            if not resp_header: return None
-            r_cmd, r_len = struct.unpack(HEADER_FORMAT, resp_header)
-            
-            # 3. 接收內容 (Body)
-            # 簡單實作：假設一次 recv 就能讀完 JSON (對於排行榜通常足夠)
-            resp_body = sock.recv(r_len)
-            response = json.loads(resp_body.decode('utf-8'))
-            
-            sock.close()
-            return response
-        except Exception as e:
-            print(f"[Network] Error: {e}")
-            return None
+        """
+        (內部函式) 透過長連線送出請求並等待回覆，失敗時回傳 None
+        叢集模式下送到負責該關卡的節點；涉及多個關卡的請求分送到各節點後合併回覆
+        """
+        self._load_partition()
+        res = self._route(cmd, payload)
+        if res and res.get("status") == "error" and str(res.get("msg", "")).startswith(WRONG_NODE):
+            # 分區表已經過期 (叢集重新配置)，重新取得後再送一次
+            self._load_partition(refresh=True)
+            res = self._route(cmd, payload)
+        return res
+
+    def _load_partition(self, refresh=False):
+        """向 Server 詢問分區表 (只問一次；連不上時下次再問)"""
+        if self.partition_checked and not refresh:
+            return
+        res = self.conn.request(CMD_GET_PARTITION_MAP, {})
+        if res is None:
+            return
+        self.partition_checked = True
+        if res.get("status") == "ok" and res.get("map"):
+            self.partition = PartitionMap.from_dict(res["map"])
+            print(f"[Network] Cluster mode: {len(self.partition.nodes)} nodes")
+        else:
+            self.partition = None # 單一 Server (舊版 Server 會回覆 Unknown CMD)
+
+    def _node_connection(self, node):
+        return self._connection(self.partition.address(node))
+
+    def _split_by_node(self, items, level_of):
+        """把 items 依所屬節點分組: { node: [item, ...] }"""
+        groups = {}
+        for item in items:
+            groups.setdefault(self.partition.owner(level_of(item)), []).append(item)
+        return groups
+
+    def _route(self, cmd, payload):
+        partition = self.partition
+        if partition is None:
+            return self.conn.request(cmd, payload)
+
+        if cmd == CMD_UPLOAD_BATCH:
+            groups = self._split_by_node(payload.get("scores", []), lambda s: s.get("level", 1))
+            parts = {node: dict(payload, scores=scores) for node, scores in groups.items()}
+        elif cmd == CMD_GET_LEADERBOARDS:
+            versions = payload.get("versions", {})
+            parts = {}
+            for node, levels in self._split_by_node(payload.get("levels", []), lambda l: l).items():
+                part = dict(payload, levels=levels)
+                if versions:
+                    part["versions"] = {str(l): versions[str(l)] for l in levels if str(l) in versions}
+                parts[node] = part
+        elif cmd in (CMD_SUBSCRIBE, CMD_UNSUBSCRIBE):
+            if cmd == CMD_UNSUBSCRIBE and payload.get("levels") is None:
+                # 全部取消: 送到每一個連過的節點
+                with self.conns_lock:
+                    conns = list(self.conns.values())
+                return self._merge(cmd, self._fan_out(cmd, {conn: payload for conn in conns}))
+            groups = self._split_by_node(payload.get("levels", []), lambda l: l)
+            parts = {node: dict(payload, levels=levels) for node, levels in groups.items()}
+        else:
+            return self._node_connection(partition.owner(payload.get("level", 1))).request(cmd, payload)
+
+        if len(parts) == 1:
+            (node, part), = parts.items()
+            return self._node_connection(node).request(cmd, part)
+        return self._merge(cmd, self._fan_out(cmd, {self._node_connection(node): part
+                                                   for node, part in parts.items()}))
+
+    @staticmethod
+    def _fan_out(cmd, parts):
+        """同時把 parts { conn: payload } 送出並等待全部回覆，回傳 { conn: response 或 None }"""
+        results = {}
+        def run(conn, part):
+            results[conn] = conn.request(cmd, part)
+        threads = [threading.Thread(target=run, args=item) for item in parts.items()]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    @staticmethod
+    def _merge(cmd, results):
+        """合併各節點的回覆 (格式與單一 Server 的回覆相同)"""
+        responses = list(results.values())
+        for res in responses:
+            if res and res.get("status") == "error" and str(res.get("msg", "")).startswith(WRONG_NODE):
+                return res # 讓呼叫端重新取得分區表後重送
+        ok = [res for res in responses if res and res.get("status") == "ok"]
+        if cmd == CMD_UPLOAD_BATCH and len(ok) < len(responses):
+            # 上傳必須全部成功 (由呼叫端整批重送)
+            return next((res for res in responses if res), None)
+        if not ok:
+            return next((res for res in responses if res), None)
+
+        if cmd == CMD_UPLOAD_BATCH:
+            return {"status": "ok", "msg": "Scores saved", "saved": sum(res.get("saved", 0) for res in ok)}
+        if cmd == CMD_GET_LEADERBOARDS:
+            # 有節點失敗時只回傳成功的部分，其他關卡下次再問
+            merged = {"status": "ok", "versions": {}, "data": {}}
+            for res in ok:
+                merged["versions"].update(res["versions"])
+                merged["data"].update(res["data"])
+            return merged
+        return {"status": "ok", "levels": sorted({l for res in ok for l in res.get("levels", [])})}
 
     def upload_score_async(self, level, time_spent, stars):
-        """[非同步] 上傳成績"""
-        def task():
+        """[非同步] 上傳成績 (之前上傳失敗的成績會一起補傳)"""
+        self.upload_scores_async([(level, time_spent, stars)])
+
+    def upload_scores_async(self, scores):
+        """[非同步] 一次上傳多筆成績 scores: [(level, time_spent, stars), ...]"""
+        with self.pending_lock:
+            self.pending_uploads.extend(scores)
+        threading.Thread(target=self._flush_uploads).start()
+
+    def _flush_uploads(self):
+        """把待上傳的成績送出：只有一筆用 CMD_UPLOAD_SCORE，多筆用 CMD_UPLOAD_BATCH；失敗的放回佇列"""
+        with self.pending_lock:
+            scores, self.pending_uploads = self.pending_uploads[:MAX_BATCH], self.pending_uploads[MAX_BATCH:]
+        if not scores:
+            return
+
+        self._load_partition()
+        if self.partition is not None and len(scores) > 1:
+            # 叢集模式: 每個節點各自上傳，只有失敗的那一份放回佇列 (避免成功的部分被重複寫入)
+            groups = self._split_by_node(scores, lambda s: s[0])
+            if len(groups) > 1:
+                threads = [threading.Thread(target=self._upload, args=(group,)) for group in groups.values()]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                return
+        self._upload(scores)
+
+    def _upload(self, scores):
+        """上傳一組成績，成功後讓相關快取失效，失敗時放回佇列"""
+        if len(scores) == 1:
+            level, time_spent, stars = scores[0]
             print(f"[Network] Uploading score for Lv.{level}...")
             data = {
                 "user": self.username,
@@ -75,36 +356,196 @@ class NetworkClient:
                 "stars": stars
             }
             res = self._send_request(CMD_UPLOAD_SCORE, data)
-            
-            if res and res.get("status") == "ok":
-                print("[Network] Upload success!")
-                
-                # [關鍵修正] 上傳成功後，清除該關卡的快取
-                # 這樣下次顯示排行榜時，會強制重新下載，就能看到剛上傳的成績
-                if level in self.leaderboard_cache:
-                    del self.leaderboard_cache[level]
-            else:
-                print("[Network] Upload failed.")
-        
-        threading.Thread(target=task).start()
+        else:
+            print(f"[Network] Uploading {len(scores)} scores...")
+            data = {
+                "user": self.username,
+                "scores": [{"level": l, "time": t, "stars": s} for l, t, s in scores]
+            }
+            res = self._send_request(CMD_UPLOAD_BATCH, data)
+
+        if res and res.get("status") == "ok":
+            print("[Network] Upload success!")
 
-    def fetch_leaderboard_async(self, level):
-        """[非同步] 下載排行榜"""
+            # [關鍵修正] 上傳成功後，清除該關卡的快取
+            # 這樣下次顯示排行榜時，會強制重新下載，就能看到剛上傳的成績
+            for level in {l for l, _, _ in scores}:
+                # 排行榜保留舊資料與版本號 (畫面不會閃成空白)，只標記成需要重新詢問
+                for window in ("all", "day", "week", "season"):
+                    entry = self.leaderboard_cache.get(self._board_key(level, window))
+                    if entry is not None:
+                        entry["fetched_at"] = 0.0
+                self.rank_cache.pop(level, None)
+                self.around_cache.pop(level, None)
+                self.stats_cache.pop(level, None)
+        elif res and res.get("msg") == "Bad payload":
+            # Server 拒絕這些成績的內容 (例如秒數不是有限數字)，重送也不會成功
+            print("[Network] Upload rejected by server, dropping invalid scores.")
+        else:
+            print("[Network] Upload failed, will retry with the next upload.")
+            with self.pending_lock:
+                self.pending_uploads[:0] = scores
+
+    def fetch_leaderboard_async(self, level, window="all"):
+        """
+        [非同步] 下載排行榜
+        window: "all" (歷史總榜) / "day" / "week" / "season"
+        """
         def task():
             self.is_loading = True
             # print(f"[Network] Fetching leaderboard for Lv.{level}...")
+            key = self._board_key(level, window)
+            entry = self.leaderboard_cache.get(key)
             data = {"level": level}
+            if window != "all":
+                data["window"] = window
+            if entry is not None:
+                data["version"] = entry["version"] # 版本沒變時 Server 只回覆 not modified
             res = self._send_request(CMD_GET_LEADERBOARD, data)
             
             if res and res.get("status") == "ok":
-                self.leaderboard_cache[level] = res["data"]
+                self._store_leaderboard(key, res.get("version", 0), res["data"])
                 # print(f"[Network] Leaderboard Lv.{level} updated.")
+            elif res and res.get("status") == "not_modified":
+                entry["fetched_at"] = time.monotonic()
             
             self.is_loading = False
         
         # 啟動背景執行緒
         threading.Thread(target=task).start()
 
-    def get_cached_leaderboard(self, level):
+    def fetch_leaderboards_async(self, levels, window="all"):
+        """[非同步] 一次下載多個關卡的排行榜 (例如進入選關畫面時預先載入)"""
+        def task():
+            self.is_loading = True
+            for i in range(0, len(levels), MAX_BATCH):
+                chunk = levels[i:i + MAX_BATCH]
+                data = {"levels": list(chunk)}
+                if window != "all":
+                    data["window"] = window
+                # 帶上手上的版本號，Server 只回傳有變動的關卡
+                versions = {}
+                for level in chunk:
+                    entry = self.leaderboard_cache.get(self._board_key(level, window))
+                    if entry is not None:
+                        versions[str(level)] = entry["version"]
+                if versions:
+                    data["versions"] = versions
+                res = self._send_request(CMD_GET_LEADERBOARDS, data)
+
+                if res and res.get("status") == "ok":
+                    now = time.monotonic()
+                    for level, version in res["versions"].items():
+                        key = self._board_key(int(level), window)
+                        if level in res["data"]:
+                            self._store_leaderboard(key, version, res["data"][level])
+                        elif key in self.leaderboard_cache:
+                            self.leaderboard_cache[key]["fetched_at"] = now
+
+            self.is_loading = False
+
+        threading.Thread(target=task).start()
+
+    @staticmethod
+    def _board_key(level, window):
+        # 總榜沿用 level 當 key，時間視窗榜用 (level, window)
+        return level if window == "all" else (level, window)
+
+    def _store_leaderboard(self, key, version, rows):
+        self.leaderboard_cache[key] = {"version": version, "data": rows, "fetched_at": time.monotonic()}
+
+    def get_cached_leaderboard(self, level, window="all"):
         """取得目前快取的排行榜 (不會卡頓)"""
-        return self.leaderboard_cache.get(level, [])
\ No newline at end of file
+        entry = self.leaderboard_cache.get(self._board_key(level, window))
+        return entry["data"] if entry is not None else []
+
+    def is_leaderboard_stale(self, level, window="all"):
+        """排行榜還沒下載過、剛上傳過成績，或超過 LEADERBOARD_REFRESH_SEC 秒沒有確認，就需要重新詢問"""
+        entry = self.leaderboard_cache.get(self._board_key(level, window))
+        return entry is None or time.monotonic() - entry["fetched_at"] > LEADERBOARD_REFRESH_SEC
+
+    def subscribe_leaderboards_async(self, levels):
+        """[非同步] 訂閱這些關卡的總榜，Server 會先推送一次目前的排行榜，之後前幾名有變動才推送"""
+        self.subscribed_levels.update(levels)
+        threading.Thread(target=self._send_request, args=(CMD_SUBSCRIBE, {"levels": list(levels)})).start()
+
+    def unsubscribe_leaderboards_async(self, levels=None):
+        """[非同步] 取消訂閱 (levels 為 None 時全部取消)"""
+        if levels is None:
+            self.subscribed_levels.clear()
+            data = {}
+        else:
+            self.subscribed_levels.difference_update(levels)
+            data = {"levels": list(levels)}
+        threading.Thread(target=self._send_request, args=(CMD_UNSUBSCRIBE, data)).start()
+
+    def _resubscribe(self, conn):
+        """(重新連線後) 在這條連線上重新訂閱它負責的關卡"""
+        levels = sorted(self.subscribed_levels)
+        partition = self.partition
+        if partition is not None:
+            levels = [l for l in levels if partition.address(partition.owner(l)) == conn.server_addr]
+        if levels:
+            conn.request(CMD_SUBSCRIBE, {"levels": levels})
+
+    def _handle_push(self, cmd, payload):
+        """(讀取執行緒) Server 推播的排行榜直接更新快取"""
+        if cmd == CMD_PUSH_LEADERBOARD:
+            self._store_leaderboard(self._board_key(payload["level"], "all"), payload["version"], payload["data"])
+
+    def fetch_rank_async(self, level):
+        """[非同步] 下載自己在該關的名次與個人最佳"""
+        def task():
+            self.is_loading = True
+            data = {"level": level, "user": self.username}
+            res = self._send_request(CMD_GET_RANK, data)
+
+            if res and res.get("status") == "ok":
+                self.rank_cache[level] = res["data"]
+
+            self.is_loading = False
+
+        threading.Thread(target=task).start()
+
+    def has_cached_rank(self, level):
+        return level in self.rank_cache
+
+    def get_cached_rank(self, level):
+        """取得目前快取的個人名次，沒有紀錄或尚未下載時回傳 None"""
+        return self.rank_cache.get(level)
+
+    def fetch_around_async(self, level, k=5):
+        """[非同步] 下載自己前後各 k 名"""
+        def task():
+            self.is_loading = True
+            data = {"level": level, "user": self.username, "k": k}
+            res = self._send_request(CMD_GET_AROUND, data)
+
+            if res and res.get("status") == "ok":
+                self.around_cache[level] = res["data"]
+
+            self.is_loading = False
+
+        threading.Thread(target=task).start()
+
+    def get_cached_around(self, level):
+        """取得目前快取的前後名次，沒有紀錄或尚未下載時回傳 None"""
+        return self.around_cache.get(level)
+
+    def fetch_stats_async(self, level):
+        """[非同步] 下載關卡統計 (包含自己贏過多少 % 的玩家)"""
+        def task():
+            self.is_loading = True
+            data = {"level": level, "user": self.username}
+            res = self._send_request(CMD_GET_LEVEL_STATS, data)
+
+            if res and res.get("status") == "ok":
+                self.stats_cache[level] = res["data"]
+
+            self.is_loading = False
+
+        threading.Thread(target=task).start()
+
+    def get_cached_stats(self, level):
+        """取得目前快取的關卡統計，尚未下載時回傳 None"""
+        return self.stats_cache.get(level)
\ No newline at end of file
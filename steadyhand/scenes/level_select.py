@@ -20,6 +20,9 @@ class LevelSelectScene(Scene):
         self.buttons = []
         self.back_btn_rect = (20, 20, 100, 40)
         self.init_buttons()
+        # 停留在選關畫面期間訂閱所有關卡的排行榜：Server 會先推送一次目前的排行榜
+        # (取代原本的批次預先載入)，之後有人刷新紀錄時主動推送，滑過按鈕時直接讀快取
+        self.game.net.subscribe_leaderboards_async([b["level_idx"] + 1 for b in self.buttons if b["real"]])
 
     # ... (init_buttons, update, draw_thumbnail, draw_stars 保持不變) ...
     def init_buttons(self):
@@ -62,7 +65,7 @@ class LevelSelectScene(Scene):
         bbx, bby, bbw, bbh = self.back_btn_rect
         if clicked and (bbx <= mx <= bbx+bbw and bby <= my <= bby+bbh):
             from .menu import MenuScene
-            self.game.switch_scene(MenuScene(self.game))
+            self.leave(MenuScene(self.game))
             return
 
         if clicked:
@@ -74,12 +77,19 @@ class LevelSelectScene(Scene):
                 if (bx <= mx <= bx+bw and screen_y <= my <= screen_y+bh):
                     if not btn["locked"]:
                         from .gameplay import GameplayScene
-                        self.game.switch_scene(GameplayScene(self.game, btn["level_idx"]))
+                        self.leave(GameplayScene(self.game, btn["level_idx"]))
                         return
 
         if cpygfx.is_key_down(KEY_ESCAPE):
             from .menu import MenuScene
-            self.game.switch_scene(MenuScene(self.game))
+            self.leave(MenuScene(self.game))
+
+    def leave(self, next_scene):
+        """離開選關畫面：取消排行榜訂閱後切換場景"""
+        if self.game.transition_state != 'NONE':
+            return # 已經在切換場景中 (例如按住 ESC)
+        self.game.net.unsubscribe_leaderboards_async()
+        self.game.switch_scene(next_scene)
 
     def draw_thumbnail(self, level_idx, x, y, size):
         raw_data = self.level_manager.get_level_data_raw(level_idx)
@@ -110,7 +120,7 @@ class LevelSelectScene(Scene):
         db_lvl = level_idx + 1
         data = self.game.net.get_cached_leaderboard(db_lvl)
         
-        if not data and not self.game.net.is_loading:
+        if self.game.net.is_leaderboard_stale(db_lvl) and not self.game.net.is_loading:
             self.game.net.fetch_leaderboard_async(db_lvl)
             
         # [修正 1] 加高面板高度到 180 (原本 160)
@@ -158,6 +168,21 @@ class LevelSelectScene(Scene):
                 tx = time_end_x - tw
                 cpygfx.draw_text(time_str, tx, y_pos, 0, 255, 255)
 
+            # 自己不在前 5 名時，在最下方顯示自己的名次
+            if not self.game.net.has_cached_rank(db_lvl):
+                if not self.game.net.is_loading:
+                    self.game.net.fetch_rank_async(db_lvl)
+            else:
+                mine = self.game.net.get_cached_rank(db_lvl)
+                if mine and mine["rank"] > len(data[:5]):
+                    y_pos = y + 45 + 5 * 22
+                    cpygfx.draw_line(x + 10, y_pos - 4, x + w - 10, y_pos - 4, 60, 70, 90)
+                    cpygfx.draw_text(f"{mine['rank']}.", rank_x, y_pos, 0, 255, 255)
+                    cpygfx.draw_text(self.game.net.username[:13], name_x, y_pos, 0, 255, 255)
+                    time_str = f"{mine['time']}s"
+                    tw = cpygfx.get_text_width(time_str)
+                    cpygfx.draw_text(time_str, time_end_x - tw, y_pos, 0, 255, 255)
+
     def render(self):
         c = COLOR_GRID
         for x in range(0, SCREEN_WIDTH, 40): cpygfx.draw_line(x, 0, x, SCREEN_HEIGHT, *c)
@@ -0,0 +1,6 @@
+# 檔案名稱: tests/conftest.py
+import os
+import sys
+
+# 加入專案根目錄，讓測試可以 import server、shp 底下的模組 (與直接執行 server/*.py 時相同)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,59 @@
+# 檔案名稱: tests/test_compaction.py
+import os
+
+import pytest
+
+from server.db_engine import SteadyHandDB, SHARD_NONE, SHARD_LEVEL, SHARD_HASH
+from server.db_index import TIME_WINDOWS, WINDOW_ALL
+from server.db_scan import ScoreTable
+
+LEVELS = (1, 2, 3)
+
+
+def _open(db_file, shard_mode):
+    # 很小的分段 + 不保留歷史：幾百筆就會換好幾次檔，壓縮時只留下每位玩家的最佳成績
+    return SteadyHandDB(db_file, segment_max_bytes=4000, compact_interval=1e9, history_days=0,
+                        shard_mode=shard_mode, shard_buckets=2)
+
+
+def _state(db):
+    """每關的排行榜 (所有時間視窗)、版本號與統計"""
+    return {
+        lvl: {
+            "boards": {w: db.get_leaderboard(lvl, 50, w) for w in (WINDOW_ALL,) + TIME_WINDOWS},
+            "versions": {w: db.get_leaderboard_version(lvl, w) for w in (WINDOW_ALL,) + TIME_WINDOWS},
+            "stats": db.get_stats(lvl),
+            "rank": db.get_rank(lvl, "p3"),
+        }
+        for lvl in LEVELS
+    }
+
+
+@pytest.mark.parametrize("shard_mode", [SHARD_NONE, SHARD_LEVEL, SHARD_HASH])
+def test_compaction_and_restart_keep_boards_stats_and_versions(tmp_path, shard_mode):
+    db_file = os.path.join(tmp_path, "steadyhand.db")
+    db = _open(db_file, shard_mode)
+    try:
+        for i in range(600):
+            # 最後幾筆都比各自的最佳成績慢：壓縮會丟掉它們，但它們正是設定版本號的最新紀錄
+            t = 50.0 - (i % 40) * 0.5 if i < 590 else 99.0
+            assert db.add_score(f"p{i % 7}", LEVELS[i % 3], t, 1).wait(5)
+        before = _state(db)
+        files = db._shard_files()
+        assert db.compactor.compact_once() > 0
+        assert len(ScoreTable.load(*files)) < 600 # 真的有紀錄被壓縮掉
+    finally:
+        db.close()
+
+    db = _open(db_file, shard_mode)
+    try:
+        assert _state(db) == before
+        db.compactor.compact_once() # 再壓縮一次 (統計檔累加) 也不變
+    finally:
+        db.close()
+
+    db = _open(db_file, shard_mode)
+    try:
+        assert _state(db) == before
+    finally:
+        db.close()
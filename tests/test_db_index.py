@@ -0,0 +1,64 @@
+# 檔案名稱: tests/test_db_index.py
+import random
+
+from server.db_index import IndexableSkipList, LevelBoard, ScoreRecord
+
+
+def test_skip_list_matches_sorted_list():
+    """隨機插入/刪除後，名次、count_less 與 slice 都與暴力排序的結果相同"""
+    rng = random.Random(7)
+    skip = IndexableSkipList()
+    expected = []
+    for _ in range(3000):
+        if expected and rng.random() < 0.3:
+            key = rng.choice(expected)
+            assert skip.remove(key) == sorted(expected).index(key) + 1
+            expected.remove(key)
+        else:
+            key = (rng.randrange(500), rng.random())
+            expected.append(key)
+            assert skip.insert(key) == sorted(expected).index(key) + 1
+
+    expected.sort()
+    assert len(skip) == len(expected)
+    assert skip.slice(0, len(expected) + 10) == expected
+    for rank, key in enumerate(expected, 1):
+        assert skip.rank(key) == rank
+    assert skip.rank((-1, 0.0)) == 0 # 不存在
+    for probe in [(-1, 0.0), (250, 0.5), (999, 0.0)] + expected[::97]:
+        assert skip.count_less(probe) == sum(1 for key in expected if key < probe)
+    for start in range(0, len(expected), 37):
+        assert skip.slice(start, start + 11) == expected[start:start + 11]
+
+
+def _brute_force_board(records):
+    """每位玩家的最佳成績 (同秒數先達成者優先)，依名次排序"""
+    best = {}
+    for seq, r in enumerate(records):
+        if r.name not in best or r.time < best[r.name][0]:
+            best[r.name] = (r.time, seq, r)
+    return [entry[2] for entry in sorted(best.values())]
+
+
+def test_level_board_rank_and_around_match_brute_force():
+    rng = random.Random(11)
+    records = [ScoreRecord(f"p{rng.randrange(200)}", 1, round(rng.uniform(5, 60), 1), 3, 1000.0 + i)
+               for i in range(2000)]
+    board = LevelBoard()
+    for seq, r in enumerate(records):
+        board.update(r, seq)
+
+    expected = _brute_force_board(records)
+    assert len(board) == len(expected)
+    assert board.top(50) == expected[:50]
+    assert board.top(len(expected) + 5) == expected # 超過快照深度，走 skip list
+
+    for rank, r in enumerate(expected, 1):
+        assert board.rank_of(r.name) == (rank, r)
+    for r in expected[::13] + [expected[0], expected[-1]]:
+        rank = expected.index(r) + 1
+        for k in (0, 1, 5):
+            lo = max(1, rank - k)
+            assert board.around(r.name, k) == [(i, expected[i - 1]) for i in range(lo, min(len(expected), rank + k) + 1)]
+    assert board.rank_of("nobody") is None
+    assert board.around("nobody", 3) is None
@@ -0,0 +1,113 @@
+# 檔案名稱: tests/test_protocol.py
+import time
+
+import pytest
+
+from server.db_index import ScoreRecord
+from shp.protocol import (SteadyHandProtocol, FrameDecoder, FrameTooLarge, BinaryCodec, CMD_UPLOAD_SCORE,
+                          CMD_GET_LEADERBOARD, CMD_UPLOAD_BATCH, FLAG_BINARY, max_request_payload)
+
+
+def _feed(decoder, data, chunk):
+    """把 data 每次 chunk bytes 餵給 decoder，回傳解出的 (cmd, flags, req_id, payload bytes)"""
+    frames = []
+    for i in range(0, len(data), chunk):
+        part = data[i:i + chunk]
+        decoder.get_buffer(len(part))[:len(part)] = part
+        decoder.buffer_updated(len(part))
+        while (frame := decoder.next_frame()) is not None:
+            cmd, flags, req_id, payload = frame
+            frames.append((cmd, flags, req_id, bytes(payload))) # view 只在下一次 get_buffer() 前有效
+    return frames
+
+
+@pytest.mark.parametrize("chunk", [1, 3, 10, 11, 4096, 1 << 20])
+def test_frame_decoder_handles_split_and_coalesced_frames(chunk):
+    payloads = [{"level": i, "user": "x" * (i * 37 % 300)} for i in range(40)]
+    payloads.append({"blob": "y" * 100000}) # 比初始 buffer 大的封包
+    stream = b"".join(SteadyHandProtocol.pack_packet(CMD_GET_LEADERBOARD, p, request_id=i + 1, flags=i % 4)
+                      for i, p in enumerate(payloads))
+
+    decoder = FrameDecoder(initial_size=1024)
+    frames = _feed(decoder, stream, chunk)
+    assert [(cmd, flags, req_id) for cmd, flags, req_id, _ in frames] == \
+        [(CMD_GET_LEADERBOARD, i % 4, i + 1) for i in range(len(payloads))]
+    assert [SteadyHandProtocol.decode_payload(p) for *_, p in frames] == payloads
+    assert not decoder.has_partial()
+
+
+def test_frame_decoder_waits_for_the_rest_of_a_frame():
+    packet = SteadyHandProtocol.pack_packet(CMD_UPLOAD_SCORE, {"user": "a"}, request_id=9)
+    decoder = FrameDecoder()
+    assert _feed(decoder, packet[:-1], 4096) == []
+    assert decoder.has_partial()
+    assert _feed(decoder, packet[-1:], 1) == [(CMD_UPLOAD_SCORE, 0, 9, b'{"user": "a"}')]
+
+
+def test_frame_decoder_rejects_oversized_frames_before_buffering():
+    limit = max_request_payload(CMD_UPLOAD_SCORE)
+    decoder = FrameDecoder(initial_size=1024, max_payload=max_request_payload)
+    ok = SteadyHandProtocol.pack_packet(CMD_UPLOAD_SCORE, {"user": "a"}, request_id=1)
+    # 只送出 Header：LENGTH 超過上限就要立刻拒絕，不必等 PAYLOAD 傳完
+    too_big = SteadyHandProtocol.pack_header(CMD_UPLOAD_SCORE, limit + 1, request_id=2)
+
+    assert _feed(decoder, ok, 4096) == [(CMD_UPLOAD_SCORE, 0, 1, b'{"user": "a"}')]
+    decoder.get_buffer(len(too_big))[:len(too_big)] = too_big
+    decoder.buffer_updated(len(too_big))
+    size = len(decoder.buf)
+    with pytest.raises(FrameTooLarge) as e:
+        decoder.next_frame()
+    assert (e.value.cmd_id, e.value.request_id, e.value.length, e.value.limit) == (CMD_UPLOAD_SCORE, 2, limit + 1, limit)
+    assert len(decoder.buf) == size # 沒有替它擴大 buffer
+
+    # 批次指令的上限比較大，同樣長度的封包可以通過
+    big = SteadyHandProtocol.pack_packet(CMD_UPLOAD_BATCH, {"scores": "z" * limit}, request_id=3)
+    assert len(big) - SteadyHandProtocol.HEADER_SIZE > limit
+    assert [f[:3] for f in _feed(FrameDecoder(max_payload=max_request_payload), big, 700)] == \
+        [(CMD_UPLOAD_BATCH, 0, 3)]
+
+
+def test_binary_upload_round_trip():
+    payload = {"user": "玩家-1", "level": 12, "time": 23.5, "stars": 3}
+    body = BinaryCodec.encode_request(CMD_UPLOAD_SCORE, payload)
+    assert BinaryCodec.decode_request(CMD_UPLOAD_SCORE, memoryview(body)) == payload
+
+
+@pytest.mark.parametrize("window", BinaryCodec.WINDOWS)
+def test_binary_leaderboard_request_round_trip(window):
+    payload = {"level": 7, "limit": 25, "window": window, "version": 1792309855119053}
+    body = BinaryCodec.encode_request(CMD_GET_LEADERBOARD, payload)
+    assert BinaryCodec.decode_request(CMD_GET_LEADERBOARD, memoryview(body)) == payload
+
+
+def test_binary_leaderboard_version_zero_means_none():
+    """VERSION 欄位 0 = Client 沒有版本號：解碼後不能出現 "version" (否則會被當成版本 0 比對)"""
+    for payload in ({"level": 3, "limit": 5, "window": "all"}, {"level": 3, "limit": 5, "window": "all", "version": 0}):
+        decoded = BinaryCodec.decode_request(CMD_GET_LEADERBOARD, memoryview(
+            BinaryCodec.encode_request(CMD_GET_LEADERBOARD, payload)))
+        assert decoded == {"level": 3, "limit": 5, "window": "all"}
+
+
+def test_binary_leaderboard_response_round_trip():
+    now = time.time()
+    records = [ScoreRecord("alice", 1, 12.25, 3, now), ScoreRecord("名字很長的玩家" * 3, 1, 13.5, 2, now - 60)]
+    body = BinaryCodec.encode_response(True, records=records, version=42)
+    assert BinaryCodec.decode_response(CMD_GET_LEADERBOARD, memoryview(body)) == {
+        "status": "ok", "version": 42,
+        "data": [{"name": r.name, "time": round(r.time, 2), "stars": r.stars, "date": time.ctime(r.timestamp)}
+                 for r in records],
+    }
+    # 空榜 (沒有紀錄的關卡版本號是 0)
+    assert BinaryCodec.decode_response(CMD_GET_LEADERBOARD, memoryview(
+        BinaryCodec.encode_response(True, records=[], version=0))) == {"status": "ok", "version": 0, "data": []}
+
+
+def test_binary_error_response_and_bad_payloads():
+    body = BinaryCodec.encode_response(False, "Bad payload")
+    assert BinaryCodec.decode_response(CMD_GET_LEADERBOARD, memoryview(body)) == {"status": "error", "msg": "Bad payload"}
+    with pytest.raises(ValueError):
+        BinaryCodec.decode_request(CMD_GET_LEADERBOARD, memoryview(b"\x00\x01"))
+    with pytest.raises(ValueError):
+        BinaryCodec.encode_request(CMD_GET_LEADERBOARD, {"level": -1})
+    with pytest.raises(ValueError):
+        BinaryCodec.encode_request(CMD_GET_LEADERBOARD, {"level": 1, "window": "month"})